@@ -6,7 +6,6 @@ import argparse
 import sys
 import hashlib
 import csv
-import sqlite3
 from io import StringIO
 from datetime import datetime
 
@@ -17,7 +16,8 @@ sys.path.extend([f"{INSTALL_PATH}/front/plugins", f"{INSTALL_PATH}/server"])
 from plugin_helper import Plugin_Object, Plugin_Objects, decodeBase64
 from logger import mylog, append_line_to_file
 from helper import timeNowTZ, get_setting_value 
-from const import logPath, applicationPath, fullDbPath
+from const import logPath, applicationPath
+from database import get_connection
 import conf
 from pytz import timezone
 
@@ -45,8 +45,8 @@ def main():
 
     mylog('verbose', ['[CSVBCKP] In script'])     
 
-    # Connect to the App database
-    conn = sqlite3.connect(fullDbPath)
+    # Connect to the App database, read only
+    conn = get_connection(readOnly = True)
     cursor = conn.cursor()
 
     # Execute your SQL query
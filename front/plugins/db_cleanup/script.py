@@ -17,7 +17,8 @@ sys.path.extend([f"{INSTALL_PATH}/front/plugins", f"{INSTALL_PATH}/server"])
 from plugin_helper import Plugin_Object, Plugin_Objects, decodeBase64
 from logger import mylog, append_line_to_file
 from helper import timeNowTZ, get_setting_value
-from const import logPath, applicationPath, fullDbPath
+from const import logPath, applicationPath, fullDbPath, sql_plugins_history_trim, sql_notifications_trim, sql_appevents_trim, sql_plugins_history_plugins, sql_plugins_objects_dedupe
+from database import get_connection
 import conf
 from pytz import timezone
 
@@ -58,8 +59,8 @@ def cleanup_database (dbPath, DAYS_TO_KEEP_EVENTS, PHOLUS_DAYS_DATA, HRS_TO_KEEP
 
     mylog('verbose', [f'[{pluginName}] Upkeep Database:' ])
 
-    # Connect to the App database
-    conn    = sqlite3.connect(dbPath)
+    # Connect to the App database, all deletes are committed together
+    conn    = get_connection(dbPath = dbPath)
     cursor  = conn.cursor()
 
     # -----------------------------------------------------
@@ -79,19 +80,11 @@ def cleanup_database (dbPath, DAYS_TO_KEEP_EVENTS, PHOLUS_DAYS_DATA, HRS_TO_KEEP
     # Trim Plugins_History entries to less than PLUGINS_KEEP_HIST setting per unique "Plugin" column entry
     mylog('verbose', [f'[{pluginName}] Plugins_History: Trim Plugins_History entries to less than {str(PLUGINS_KEEP_HIST)} per Plugin (PLUGINS_KEEP_HIST setting)'])
 
-    # Build the SQL query to delete entries that exceed the limit per unique "Plugin" column entry
-    delete_query = f"""DELETE FROM Plugins_History 
-                            WHERE "Index" NOT IN (
-                                SELECT "Index"
-                                FROM (
-                                    SELECT "Index", 
-                                        ROW_NUMBER() OVER(PARTITION BY "Plugin" ORDER BY DateTimeChanged DESC) AS row_num
-                                    FROM Plugins_History
-                                ) AS ranked_objects
-                                WHERE row_num <= {str(PLUGINS_KEEP_HIST)}
-                            );"""
+    # Delete the entries that exceed the limit, one plugin at a time to use the (Plugin, DateTimeChanged) index
+    plugins = [row[0] for row in cursor.execute(sql_plugins_history_plugins).fetchall()]
 
-    cursor.execute(delete_query)
+    for plugin in plugins:
+        cursor.execute(sql_plugins_history_trim, (plugin, plugin, PLUGINS_KEEP_HIST))
 
     # -----------------------------------------------------
     # Trim Notifications entries to less than DBCLNP_NOTIFI_HIST setting
@@ -100,19 +93,8 @@ def cleanup_database (dbPath, DAYS_TO_KEEP_EVENTS, PHOLUS_DAYS_DATA, HRS_TO_KEEP
 
     mylog('verbose', [f'[{pluginName}] Plugins_History: Trim Notifications entries to less than {histCount}'])
 
-    # Build the SQL query to delete entries 
-    delete_query = f"""DELETE FROM Notifications 
-                            WHERE "Index" NOT IN (
-                               SELECT "Index"
-                                        FROM (
-                                            SELECT "Index", 
-                                                ROW_NUMBER() OVER(PARTITION BY "Notifications" ORDER BY DateTimeCreated DESC) AS row_num
-                                            FROM Notifications
-                                        ) AS ranked_objects
-                                        WHERE row_num <= {histCount}
-                            );"""
-
-    cursor.execute(delete_query)
+    # Delete all entries older than the latest histCount entries
+    cursor.execute(sql_notifications_trim, (int(histCount),))
 
 
     # -----------------------------------------------------
@@ -121,19 +103,8 @@ def cleanup_database (dbPath, DAYS_TO_KEEP_EVENTS, PHOLUS_DAYS_DATA, HRS_TO_KEEP
 
     mylog('verbose', [f'[{pluginName}] Trim AppEvents to less than {histCount}'])
 
-    # Build the SQL query to delete entries 
-    delete_query = f"""DELETE FROM AppEvents 
-                            WHERE "Index" NOT IN (
-                               SELECT "Index"
-                                        FROM (
-                                            SELECT "Index", 
-                                                ROW_NUMBER() OVER(PARTITION BY "AppEvents" ORDER BY DateTimeCreated DESC) AS row_num
-                                            FROM AppEvents
-                                        ) AS ranked_objects
-                                        WHERE row_num <= {histCount}
-                            );"""
-
-    cursor.execute(delete_query)
+    # Delete all entries older than the latest histCount entries, the "Index" grows with DateTimeCreated
+    cursor.execute(sql_appevents_trim, (int(histCount),))
 
 
     # -----------------------------------------------------
@@ -181,16 +152,7 @@ def cleanup_database (dbPath, DAYS_TO_KEEP_EVENTS, PHOLUS_DAYS_DATA, HRS_TO_KEEP
     # De-dupe (de-duplicate) from the Plugins_Objects table 
     # TODO This shouldn't be necessary - probably a concurrency bug somewhere in the code :(        
     mylog('verbose', [f'[{pluginName}] Plugins_Objects: Delete all duplicates'])
-    cursor.execute("""
-        DELETE FROM Plugins_Objects
-        WHERE rowid > (
-            SELECT MIN(rowid) FROM Plugins_Objects p2
-            WHERE Plugins_Objects.Plugin = p2.Plugin
-            AND Plugins_Objects.Object_PrimaryID = p2.Object_PrimaryID
-            AND Plugins_Objects.Object_SecondaryID = p2.Object_SecondaryID
-            AND Plugins_Objects.UserData = p2.UserData
-        )
-    """)
+    cursor.execute(sql_plugins_objects_dedupe)
 
 
     conn.commit()
@@ -6,7 +6,6 @@ import sys
 import hashlib
 import requests
 import json
-import sqlite3
 import base64
 
 
@@ -17,7 +16,8 @@ sys.path.extend([f"{INSTALL_PATH}/front/plugins", f"{INSTALL_PATH}/server"])
 from plugin_helper import Plugin_Object, Plugin_Objects, decodeBase64
 from plugin_utils import get_plugins_configs, decode_and_rename_files
 from logger import mylog
-from const import pluginsPath, fullDbPath
+from const import pluginsPath
+from database import get_connection
 from helper import timeNowTZ, get_setting_value 
 from crypto_utils import encrypt_data
 from notification import write_notification
@@ -162,7 +162,7 @@ def main():
         mylog('verbose', [f'[{pluginName}] Mode 3: RECEIVE (HUB) - This is a HUB as received data found']) 
 
         # Connect to the App database
-        conn    = sqlite3.connect(fullDbPath)
+        conn    = get_connection()
         cursor  = conn.cursor()
 
         # Collect all unique dev_MAC values from the JSON files
@@ -18,8 +18,9 @@ sys.path.extend([f"{INSTALL_PATH}/front/plugins", f"{INSTALL_PATH}/server"])
 from plugin_helper import Plugin_Object, Plugin_Objects, decodeBase64, handleEmpty
 from logger import mylog, append_line_to_file
 from helper import timeNowTZ, get_setting_value 
-from const import logPath, applicationPath, fullDbPath
-from device import query_MAC_vendor
+from const import logPath, applicationPath, fullDbPath, vendorsPath, vendorsPathNewest, vendorsPathIndex
+from device import query_MAC_vendor, build_vendor_index_file
+from database import get_connection
 import conf
 from pytz import timezone
 
@@ -67,12 +68,20 @@ def update_vendor_database():
         mylog('verbose', ['    FAILED: Updating vendors DB, set LOG_LEVEL=debug for more info'])  
         mylog('verbose', [e.output])        
 
+    # Rebuild the binary vendors index used by query_MAC_vendor
+    sourcePath = vendorsPathNewest if os.path.isfile(vendorsPathNewest) else vendorsPath
+
+    try:
+        build_vendor_index_file(sourcePath, vendorsPathIndex)
+    except OSError as e:
+        mylog('verbose', [f'    FAILED: Building vendors index {vendorsPathIndex}: {e}'])
+
 # ------------------------------------------------------------------------------
 # resolve missing vendors
 def update_vendors (dbPath, plugin_objects): 
    
-    # Connect to the App SQLite database
-    conn = sqlite3.connect(dbPath)
+    # Connect to the App SQLite database, read only
+    conn = get_connection(readOnly = True, dbPath = dbPath)
     sql  = conn.cursor()
 
     # Initialize variables
@@ -95,7 +104,6 @@ def update_vendors (dbPath, plugin_objects):
                                     OR dev_Vendor   IS NULL
                         """)
     devices = sql.fetchall() 
-    conn.commit()    
 
     # Close the database connection
     conn.close()  
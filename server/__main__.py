@@ -26,13 +26,15 @@ from const import *
 from logger import  mylog
 from helper import  filePermissions, timeNowTZ, updateState, get_setting_value
 from api import update_api
-from networkscan import process_scan
+from networkscan import process_scan, reconcile_sessions
 from initialise import importConfigs
 from database import DB
 from reporting import get_notifications
 from notification import Notification_obj
 from plugin import run_plugin_scripts, check_and_run_user_event 
 from device import update_devices_names
+from scheduler import file_watcher_class, seconds_to_next_run, schedule_due
+from api_server import apiServer
 
 
 #===============================================================================
@@ -55,6 +57,7 @@ main structure of Pi Alert
         processing scan results
         run plugins (after Scan)
         reporting - could be replaced by run flows TODO
+        wait for the next cycle, schedule, config change or frontend event
     end loop
 """
 
@@ -86,11 +89,20 @@ def main ():
 
     all_plugins = None
 
+    # wake up the loop when the config changes or the frontend queues an event
+    fileWatcher = file_watcher_class([fullConfPath, logPath + '/execution_queue.log'])
+
     while True:
 
         # re-load user configuration and plugins   
         all_plugins = importConfigs(db, all_plugins)
 
+        # start, restart or stop the optional API server, if the settings changed
+        if get_setting_value('API_SERVER_PORT'):
+            apiServer.start(int(get_setting_value('API_SERVER_PORT')), get_setting_value('API_SERVER_HOST'))
+        else:
+            apiServer.stop()
+
         # update time started
         conf.loop_start_time = timeNowTZ()       
         
@@ -107,8 +119,8 @@ def main ():
         # Update API endpoints              
         update_api(db, all_plugins)
         
-        # proceed if 1 minute passed
-        if conf.last_scan_run + datetime.timedelta(minutes=1) < conf.loop_start_time :
+        # proceed if 1 minute passed or a plugin schedule is due
+        if conf.last_scan_run + datetime.timedelta(minutes=1) < conf.loop_start_time or schedule_due(conf.loop_start_time):
 
              # last time any scan or maintenance/upkeep was run
             conf.last_scan_run = loop_start_time            
@@ -137,6 +149,11 @@ def main ():
                 mylog('debug', "[MAIN] start processig scan results")  
                 pluginsState.processScan = False
                 process_scan(db)
+
+            # check the incrementally maintained sessions against the events once a day
+            if conf.last_sessions_check + datetime.timedelta(hours=24) < loop_start_time:
+                conf.last_sessions_check = loop_start_time
+                reconcile_sessions(db)
                           
             # --------
             # Reporting   
@@ -171,8 +188,11 @@ def main ():
             if notificationObj.HasNotifications:                
                 
                 pluginsState = run_plugin_scripts(db, all_plugins, 'on_notification', pluginsState) 
-                notification.setAllProcessed()
-                notification.clearPendingEmailFlag()
+
+                # one commit for the notification and the events
+                with db.savepoint('notifications_processed'):
+                    notification.setAllProcessed()
+                    notification.clearPendingEmailFlag()
                 
 
                 
@@ -191,8 +211,9 @@ def main ():
             dummyVariable = 1          
             
 
-        #loop     
-        time.sleep(5) # wait for N seconds      
+        #loop - wait for the next cycle, a due schedule or a change of the watched files
+        # (API endpoints are refreshed with the next loop, so they can lag up to a minute, see docs/API.md)
+        fileWatcher.wait(seconds_to_next_run(timeNowTZ()))
 
 
 
@@ -1,13 +1,25 @@
 import json
+import os
+import re
+import hashlib
+import sqlite3
 
 
 # Register NetAlertX modules 
 import conf  
-from const import (apiPath, sql_appevents, sql_devices_all, sql_events_pending_alert, sql_settings, sql_plugins_events, sql_plugins_history, sql_plugins_objects,sql_language_strings, sql_notifications_all, sql_online_history)
+from const import (apiPath, sql_appevents, sql_devices_all, sql_events_pending_alert, sql_settings, sql_plugins_events, sql_plugins_history, sql_plugins_objects,sql_language_strings, sql_notifications_all, sql_online_history,
+                   sql_plugins_objects_plugin, sql_plugins_events_plugin, sql_plugins_history_plugin)
 from logger import mylog
 from helper import write_file
+from appevent import appEventsFeed
 
 apiEndpoints = []
+pluginsHash = None
+
+# per plugin shards of the plugin tables 
+pluginShardsPageSize = 500
+pluginShards = {}       # (endpoint, plugin prefix) -> {"version": change counter, "entry": manifest entry}
+pluginManifests = {}    # endpoint -> manifest hash
 
 #===============================================================================
 # API
@@ -16,78 +28,335 @@ def update_api(db, all_plugins, isNotification = False, updateOnlyDataSources =
     mylog('debug', ['[API] Update API starting'])
     # return
 
+    global pluginsHash
+
     folder = apiPath 
 
     # Save plugins    
-    write_file(folder + 'plugins.json'  , json.dumps({"data" : all_plugins}))  
-
-    #  prepare database tables we want to expose 
-    dataSourcesSQLs = [
-        ["appevents", sql_appevents],        
-        ["devices", sql_devices_all],        
-        ["events_pending_alert", sql_events_pending_alert],
-        ["settings", sql_settings],
-        ["plugins_events", sql_plugins_events],
-        ["plugins_history", sql_plugins_history],
-        ["plugins_objects", sql_plugins_objects],
-        ["plugins_language_strings", sql_language_strings],
-        ["notifications", sql_notifications_all],
-        ["online_history", sql_online_history],
-        ["custom_endpoint", conf.API_CUSTOM_SQL],
-    ]
+    pluginsJson = json.dumps({"data" : all_plugins})
+    newPluginsHash = hashlib.sha256(pluginsJson.encode()).hexdigest()
+
+    if newPluginsHash != pluginsHash or not os.path.exists(folder + 'plugins.json'):
+        write_file(folder + 'plugins.json'  , pluginsJson)  
+        pluginsHash = newPluginsHash
+
+    #  prepare database tables we want to expose
+    dataSourcesSQLs = get_data_sources()
+
+    # change counters of the source tables
+    tableChanges = db.get_table_changes()
 
     # Save selected database tables
     for dsSQL in dataSourcesSQLs:
 
         if updateOnlyDataSources == [] or dsSQL[0] in updateOnlyDataSources:
 
-            api_endpoint_class(db, dsSQL[1], folder + 'table_' + dsSQL[0] + '.json')
+            api_endpoint_class(db, dsSQL[1], folder + 'table_' + dsSQL[0] + '.json', get_tables_version(tableChanges, dsSQL[2]))
+
+    # Append new app events to the change feed
+    if updateOnlyDataSources == [] or "appevents" in updateOnlyDataSources:
+        appEventsFeed.export(db)
+
+    # Save the plugin tables split per plugin and into pages
+    pluginShardsSQLs = [
+        ["plugins_events", sql_plugins_events_plugin, "Plugins_Events"],
+        ["plugins_history", sql_plugins_history_plugin, "Plugins_History"],
+        ["plugins_objects", sql_plugins_objects_plugin, "Plugins_Objects"],
+    ]
+
+    for shardSQL in pluginShardsSQLs:
+
+        if updateOnlyDataSources == [] or shardSQL[0] in updateOnlyDataSources:
+
+            update_plugin_shards(db, shardSQL[0], shardSQL[1], shardSQL[2], tableChanges, folder + shardSQL[0] + '/')
+
+
+#-------------------------------------------------------------------------------
+# Database tables exposed via the API as [name, SQL query, tables the query is reading from]
+# (tables are None if unknown, the endpoint is then always re-queried)
+def get_data_sources():
+    return [
+        ["appevents", sql_appevents, ["AppEvents"]],        
+        ["devices", sql_devices_all, ["Devices"]],        
+        ["events_pending_alert", sql_events_pending_alert, ["Events"]],
+        ["settings", sql_settings, ["Settings"]],
+        ["plugins_events", sql_plugins_events, ["Plugins_Events"]],
+        ["plugins_history", sql_plugins_history, ["Plugins_History"]],
+        ["plugins_objects", sql_plugins_objects, ["Plugins_Objects"]],
+        ["plugins_language_strings", sql_language_strings, ["Plugins_Language_Strings"]],
+        ["notifications", sql_notifications_all, ["Notifications"]],
+        ["online_history", sql_online_history, ["Online_History"]],
+        ["custom_endpoint", conf.API_CUSTOM_SQL, None],
+    ]
+
+
+#-------------------------------------------------------------------------------
+# Returns the change counters of the given tables, None if they are unknown or not tracked
+def get_tables_version(tableChanges, tables):
+
+    if tables is None or any(table not in tableChanges for table in tables):
+        return None
+
+    return tuple(tableChanges[table] for table in tables)
 
 
 #-------------------------------------------------------------------------------
 
 
 class api_endpoint_class:
-    def __init__(self, db, query, path):        
+    def __init__(self, db, query, path, version = None):        
 
         global apiEndpoints
         self.db = db
         self.query = query
-        self.jsonData = db.get_table_as_json(self.query).json
         self.path = path
         self.fileName = path.split('/')[-1]
-        self.hash = hash(json.dumps(self.jsonData))
-
-        # check if the endpoint needs to be updated
-        found = False
-        changed = False
-        changedIndex = -1
-        index = 0
-        
+        self.version = version
+        self.hash = None
+
         # search previous endpoint states to check if API needs updating
+        previous = None
         for endpoint in apiEndpoints:
             # match sql and API endpoint path 
             if endpoint.query == self.query and endpoint.path == self.path:
-                found = True 
-                if endpoint.hash != self.hash:                    
-                    changed = True
-                    changedIndex = index
+                previous = endpoint
 
-            index = index + 1
-        
-        # check if API endpoints have changed or if it's a new one
-        if not found or changed:
+        # skip reading the data if the source tables didn't change since the last update
+        if previous is not None and version is not None and previous.version == version and os.path.exists(self.path):
+            mylog('trace', [f'[API] No changes for {self.fileName}'])
+            return
 
-            mylog('verbose', [f'[API] Updating {self.fileName} file in /front/api'])
+        # stream the table into the endpoint file, replaced only if the content changed
+        previousHash = previous.hash if previous is not None and os.path.exists(self.path) else None
+
+        self.hash = write_json_stream(self.path, db.iter_table_as_json(self.query), previousHash)
 
-            write_file(self.path, json.dumps(self.jsonData)) 
+        if self.hash is None:
+            # previous file kept, retry next time
+            self.version = None
+        elif self.hash != previousHash:
+            mylog('verbose', [f'[API] Updating {self.fileName} file in /front/api'])
             
-            if not found:
-                apiEndpoints.append(self)
+        if previous is None:
+            apiEndpoints.append(self)
+        else:
+            # update hash and version
+            previous.hash = self.hash
+            previous.version = self.version
+
+
+#-------------------------------------------------------------------------------
+# Writes text chunks into a temporary file while computing their SHA-256 digest. 
+# The file at path is replaced (atomically) only if the digest differs from previousHash.
+# Returns the digest, or None if the file couldn't be written and the previous file was kept.
+def write_json_stream(path, chunks, previousHash = None):
+
+    writer = json_stream_writer_class(path)
+
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+    except sqlite3.Error as e:
+        # the rows are read while writing
+        writer.fail(e)
+
+    return writer.close(previousHash)
+
+#-------------------------------------------------------------------------------
+# Temporary file with a running SHA-256 digest of the written text, see write_json_stream.
+# Errors are logged, close() returns None and removes the temporary file if the file 
+# couldn't be written, the file at path isn't replaced then.
+class json_stream_writer_class:
+    def __init__(self, path):
+        self.path = path
+        self.tmpPath = path + '.tmp'
+        self.digest = hashlib.sha256()
+        self.error = None
+
+        try:
+            self.file = open(self.tmpPath, 'w', encoding='utf-8')
+        except OSError as e:
+            self.file = None
+            self.error = e
+
+    def write(self, text):
+        if self.file is None:
+            return
+
+        try:
+            self.file.write(text)
+            self.digest.update(text.encode('utf-8'))
+        except OSError as e:
+            self.error = e
+
+    # Marks the file as failed (e.g. reading the rows failed), it's discarded on close()
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+
+    def close(self, previousHash = None):
+        try:
+            if self.file is not None:
+                self.file.close()
 
-            elif changed and changedIndex != -1 and changedIndex < len(apiEndpoints):
-                # update hash
-                apiEndpoints[changedIndex].hash = self.hash
+            if self.error is not None:
+                raise self.error
+
+            newHash = self.digest.hexdigest()
+
+            if newHash != previousHash or not os.path.exists(self.path):
+                os.replace(self.tmpPath, self.path)
             else:
-                mylog('minimal', [f'[API] ⚠ ERROR Updating {self.fileName}'])
-            
+                os.remove(self.tmpPath)
+
+            return newHash
+
+        except (OSError, sqlite3.Error) as e:
+            mylog('none', [f'[API] ⚠ ERROR Updating {self.path}: {e}'])
+
+            if os.path.exists(self.tmpPath):
+                os.remove(self.tmpPath)
+
+            return None
+
+
+#-------------------------------------------------------------------------------
+# Writes the rows of a plugin table into one file per plugin (<prefix>.json) and pages of 
+# pluginShardsPageSize rows (<prefix>_page_<n>.json) in the folder of the endpoint, and 
+# a manifest.json with the row counts and hashes of all files. Only plugins with changed 
+# rows (counted by the change triggers) are re-read. Plugins without rows have no files.
+def update_plugin_shards(db, endpoint, query, table, tableChanges, shardsFolder):
+
+    global pluginShards, pluginManifests
+
+    # plugins with changes tracked per plugin as <table>/<prefix>
+    prefixes = [key.split('/', 1)[1] for key in tableChanges if key.startswith(table + '/')]
+
+    if table not in tableChanges:
+        # no change tracking, read the plugins from the table
+        rows = db.read(f"SELECT DISTINCT Plugin FROM {table}")
+
+        if rows is None:
+            return
+
+        prefixes = [row[0] for row in rows]
+
+    os.makedirs(shardsFolder, exist_ok=True)
+
+    manifest = {"pageSize": pluginShardsPageSize, "count": 0, "plugins": {}}
+
+    for prefix in sorted(prefixes):
+
+        # the prefix is used in file names
+        if not re.match(r'^[A-Za-z0-9_-]+$', prefix):
+            mylog('verbose', [f'[API] Skipping shard of plugin "{prefix}" in {endpoint}, invalid prefix'])
+            continue
+
+        version = tableChanges.get(f'{table}/{prefix}')
+        previous = pluginShards.get((endpoint, prefix))
+
+        if previous is not None and version is not None and previous["version"] == version and (previous["entry"]["count"] == 0 or os.path.exists(shardsFolder + previous["entry"]["file"])):
+            entry = previous["entry"]
+        else:
+            entry = write_plugin_shard(db, query, prefix, shardsFolder, previous["entry"] if previous is not None else None)
+
+            # retry next time if reading the rows or writing failed
+            if entry is None or entry["hash"] is None:
+                version = None
+
+            # reading the rows failed, the previous files are kept
+            if entry is None:
+                if previous is None:
+                    continue
+
+                entry = previous["entry"]
+
+            pluginShards[(endpoint, prefix)] = {"version": version, "entry": entry}
+
+        # plugins without rows are left out
+        if entry["count"] > 0:
+            manifest["plugins"][prefix] = entry
+            manifest["count"] += entry["count"]
+
+    # forget removed plugins
+    for key in [key for key in pluginShards if key[0] == endpoint and key[1] not in prefixes]:
+        del pluginShards[key]
+
+    pluginManifests[endpoint] = write_json_stream(shardsFolder + 'manifest.json', [json.dumps(manifest)], pluginManifests.get(endpoint))
+
+    # remove the files of plugins without rows or removed plugins, also left by previous runs
+    files = ['manifest.json'] + [fileName for entry in manifest["plugins"].values() for fileName in [entry["file"]] + [page["file"] for page in entry["pages"]]]
+
+    for fileName in os.listdir(shardsFolder):
+        if fileName.endswith('.json') and fileName not in files:
+            os.remove(shardsFolder + fileName)
+
+#-------------------------------------------------------------------------------
+# Writes the shard and pages of a plugin, returns the manifest entry of the plugin, or None if
+# reading the rows failed
+def write_plugin_shard(db, query, prefix, shardsFolder, previousEntry):
+
+    previousHashes = {}
+    if previousEntry is not None:
+        previousHashes[previousEntry["file"]] = previousEntry["hash"]
+        for page in previousEntry["pages"]:
+            previousHashes[page["file"]] = page["hash"]
+
+    shard = json_data_file_class(shardsFolder, f'{prefix}.json')
+    pages = []
+    page = None
+
+    try:
+        for row in db.iter_rows_as_json(query, (prefix,)):
+            if page is None or page.count == pluginShardsPageSize:
+                if page is not None:
+                    pages.append(page.close(previousHashes.get(page.fileName)))
+
+                page = json_data_file_class(shardsFolder, f'{prefix}_page_{len(pages) + 1}.json')
+
+            shard.addRow(row)
+            page.addRow(row)
+
+    except sqlite3.Error as e:
+        # discard the unfinished files, the previous files are kept 
+        for unfinished in [shard, page]:
+            if unfinished is not None:
+                unfinished.writer.fail(e)
+                unfinished.close()
+
+        return None
+
+    if page is not None:
+        pages.append(page.close(previousHashes.get(page.fileName)))
+
+    entry = shard.close(previousHashes.get(shard.fileName))
+    entry["pages"] = pages
+
+    # remove pages which are not needed anymore
+    for fileName in previousHashes:
+        if fileName != entry["file"] and fileName not in [page["file"] for page in pages] and os.path.exists(shardsFolder + fileName):
+            os.remove(shardsFolder + fileName)
+
+    if entry["hash"] != previousHashes.get(entry["file"]):
+        mylog('verbose', [f'[API] Updating {entry["file"]} ({entry["count"]} rows, {len(pages)} pages) in /front/api/{shardsFolder.split("/")[-2]}'])
+
+    return entry
+
+#-------------------------------------------------------------------------------
+# JSON file in the {"data": [...]} format of the API endpoints, written row by row 
+class json_data_file_class:
+    def __init__(self, folder, fileName):
+        self.path = folder + fileName
+        self.fileName = fileName
+        self.count = 0
+        self.writer = json_stream_writer_class(self.path)
+        self.writer.write('{"data": [')
+
+    def addRow(self, rowJson):
+        self.writer.write((', ' if self.count > 0 else '') + rowJson)
+        self.count += 1
+
+    # Returns the manifest entry of the file
+    def close(self, previousHash = None):
+        self.writer.write(']}')
+        return {"file": self.fileName, "count": self.count, "hash": self.writer.close(previousHash)}
@@ -0,0 +1,352 @@
+""" optional HTTP server with read-only access to the API data sources """
+
+import json
+import gzip
+import queue
+import sqlite3
+import hashlib
+import asyncio
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# Register NetAlertX modules
+from const import fullDbPath
+from database import get_connection
+from logger import mylog
+from helper import row_to_json
+from api import get_data_sources, get_tables_version
+from appevent import get_app_events_feed_id, get_app_events_after
+
+#-------------------------------------------------------------------------------
+# Serves the data sources of the API (see api.get_data_sources) on demand, queried
+# with a pool of read-only DB connections. Runs an asyncio event loop in its own thread.
+#
+#   GET /                       list of the available data sources
+#   GET /<data source>          {"data": [...]} - the same content as the table_<data source>.json file
+#       ?<column>=<value>       only rows with the given column value (multiple filters are combined)
+#       &limit=<n>&offset=<n>   a page of the rows, the response contains the "count" of all matching rows
+#   GET /changes?after=<n>      change feed - app events after the given "Index", at most "limit" (default 1000).
+#                               "next" is the cursor for the next request, reset it to 0 if "feedId" changes.
+#
+# Responses carry an ETag. Requests with a matching If-None-Match header get a 304, without
+# querying the DB if the source tables didn't change (see DB.createChangeTriggers).
+# Responses are gzip compressed if the client accepts it.
+class api_server_class:
+    def __init__(self, dbPath = fullDbPath, poolSize = 4, minGzipSize = 1024):
+        self.dbPath = dbPath
+        self.poolSize = poolSize
+        self.minGzipSize = minGzipSize
+        self.connections = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers = poolSize)
+        self.columns = {}   # SQL query -> column names
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.port = None
+        self.address = None     # requested (host, port)
+
+    #-------------------------------------------------------------------------------
+    # Starts the server in a background thread, returns the port (useful with port 0) or 
+    # None if it couldn't be started (retried on the next call). The server is restarted 
+    # if the host or port changed. The server has no authentication, it listens on the 
+    # loopback interface only by default.
+    def start(self, port, host = '127.0.0.1'):
+        if self.server is not None and self.address == (host, port):
+            return self.port
+
+        self.stop()
+
+        started = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+
+            try:
+                self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+                self.port = self.server.sockets[0].getsockname()[1]
+                mylog('verbose', [f'[API server] Listening on {host}:{self.port}'])
+            except OSError as e:
+                mylog('none', [f'[API server] ⚠ ERROR Starting on {host}:{port}: {e}'])
+                self.server = None
+
+            started.set()
+
+            if self.server is not None:
+                self.loop.run_forever()
+
+            self.loop.close()
+
+        self.thread = threading.Thread(target = run, name = 'api_server', daemon = True)
+        self.thread.start()
+        started.wait()
+
+        if self.server is None:
+            self.thread.join()
+            self.thread = None
+            return None
+
+        self.address = (host, port)
+
+        return self.port
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        if self.server is None:
+            return
+
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop)
+        self.thread.join()
+
+        while not self.connections.empty():
+            self.connections.get().close()
+
+        mylog('verbose', [f'[API server] Stopped listening on port {self.port}'])
+
+        self.thread = None
+        self.server = None
+        self.port = None
+        self.address = None
+
+    #-------------------------------------------------------------------------------
+    async def handle(self, reader, writer):
+        try:
+            requestLine = await reader.readline()
+            method, target, _ = requestLine.decode('latin-1').split(' ', 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        except (ValueError, ConnectionError):
+            writer.close()
+            return
+
+        if method not in ('GET', 'HEAD'):
+            status, body, responseHeaders = 405, json.dumps({"error": "Method not allowed"}), {}
+        else:
+            url = urllib.parse.urlsplit(target)
+            params = urllib.parse.parse_qsl(url.query)
+
+            status, body, responseHeaders = await self.loop.run_in_executor(
+                self.executor, self.respond, url.path.strip('/'), params, headers.get('if-none-match'))
+
+        await self.send(writer, method, status, body, responseHeaders, headers.get('accept-encoding', ''))
+
+    #-------------------------------------------------------------------------------
+    async def send(self, writer, method, status, body, headers, acceptEncoding):
+
+        reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+        content = body.encode('utf-8') if body is not None else b''
+
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        headers['Cache-Control'] = 'no-cache'
+        headers['Vary'] = 'Accept-Encoding'
+        headers['Connection'] = 'close'
+
+        if len(content) >= self.minGzipSize and 'gzip' in acceptEncoding:
+            content = gzip.compress(content, compresslevel = 6)
+            headers['Content-Encoding'] = 'gzip'
+
+        headers['Content-Length'] = str(len(content))
+
+        response = f'HTTP/1.1 {status} {reasons.get(status, "")}\r\n'
+        response += ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        response += '\r\n'
+
+        try:
+            writer.write(response.encode('latin-1'))
+
+            if method != 'HEAD':
+                writer.write(content)
+
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    #-------------------------------------------------------------------------------
+    # Builds the response for a request, runs in the executor.
+    # Returns (HTTP status, body, headers)
+    def respond(self, path, params, ifNoneMatch):
+
+        dataSources = {dsSQL[0]: dsSQL for dsSQL in get_data_sources()}
+
+        if path == '':
+            return 200, json.dumps({"data": sorted(dataSources.keys())}), {}
+
+        if path == 'changes':
+            return self.respondChanges(params)
+
+        if path not in dataSources:
+            return 404, json.dumps({"error": f"Unknown data source {path}"}), {}
+
+        name, query, tables = dataSources[path]
+
+        connection = self.getConnection()
+
+        try:
+            try:
+                limit, offset, filters = self.parseParams(connection, query, params)
+            except ValueError as e:
+                return 400, json.dumps({"error": str(e)}), {}
+
+            # ETag based on the change counters of the source tables, without running the query
+            version = get_tables_version(self.getTableChanges(connection), tables)
+
+            if version is not None:
+                etag = '"' + hashlib.sha256(json.dumps([query, sorted(params), version]).encode()).hexdigest() + '"'
+
+                if matches_etag(ifNoneMatch, etag):
+                    return 304, None, {'ETag': etag}
+
+            body = self.query(connection, query, filters, limit, offset)
+
+            if version is None:
+                etag = '"' + hashlib.sha256(body.encode()).hexdigest() + '"'
+
+                if matches_etag(ifNoneMatch, etag):
+                    return 304, None, {'ETag': etag}
+
+            return 200, body, {'ETag': etag}
+
+        except sqlite3.Error as e:
+            mylog('none', [f'[API server] ⚠ ERROR Querying {name}: {e}'])
+            return 500, json.dumps({"error": str(e)}), {}
+
+        finally:
+            self.connections.put(connection)
+
+    #-------------------------------------------------------------------------------
+    # Change feed of the app events, see appevent.app_events_feed_class
+    def respondChanges(self, params):
+        params = dict(params)
+
+        for key in ('after', 'limit'):
+            if key in params and not params[key].isdigit():
+                return 400, json.dumps({"error": f"Invalid {key} {params[key]}"}), {}
+
+        after = int(params.get('after', 0))
+        limit = int(params.get('limit', 1000))
+
+        connection = self.getConnection()
+
+        try:
+            events = get_app_events_after(connection, after, limit)
+
+            result = {
+                "feedId": get_app_events_feed_id(connection),
+                "next": events[-1]["Index"] if len(events) > 0 else after,
+                "data": events
+            }
+
+            return 200, json.dumps(result), {}
+
+        except sqlite3.Error as e:
+            mylog('none', [f'[API server] ⚠ ERROR Querying app events: {e}'])
+            return 500, json.dumps({"error": str(e)}), {}
+
+        finally:
+            self.connections.put(connection)
+
+    #-------------------------------------------------------------------------------
+    # Validates the query string, returns limit, offset and the column filters
+    def parseParams(self, connection, query, params):
+        limit = None
+        offset = 0
+        filters = []
+
+        columns = self.getColumns(connection, query)
+
+        for key, value in params:
+            if key in ('limit', 'offset'):
+                if not value.isdigit():
+                    raise ValueError(f'Invalid {key} {value}')
+
+                if key == 'limit':
+                    limit = int(value)
+                else:
+                    offset = int(value)
+
+            elif key in columns:
+                filters.append((key, value))
+
+            else:
+                raise ValueError(f'Unknown column {key}')
+
+        return limit, offset, filters
+
+    #-------------------------------------------------------------------------------
+    def query(self, connection, query, filters, limit, offset):
+
+        where = ' AND '.join(f'"{column}" = ?' for column, _ in filters)
+        filtered = f'SELECT * FROM ({query})' + (f' WHERE {where}' if where else '')
+        values = [value for _, value in filters]
+
+        result = {}
+
+        if limit is not None:
+            result["count"] = connection.execute(f'SELECT COUNT(*) FROM ({filtered})', values).fetchone()[0]
+            result["limit"] = limit
+            result["offset"] = offset
+
+            filtered += ' LIMIT ? OFFSET ?'
+            values += [limit, offset]
+
+        cursor = connection.execute(filtered, values)
+        columnNames = list(map(lambda x: x[0], cursor.description))
+
+        result["data"] = [row_to_json(columnNames, row) for row in cursor.fetchall()]
+
+        return json.dumps(result)
+
+    #-------------------------------------------------------------------------------
+    def getColumns(self, connection, query):
+        if query not in self.columns:
+            cursor = connection.execute(f'SELECT * FROM ({query}) LIMIT 0')
+            self.columns[query] = [column[0] for column in cursor.description]
+
+        return self.columns[query]
+
+    #-------------------------------------------------------------------------------
+    def getTableChanges(self, connection):
+        try:
+            return {row[0]: row[1] for row in connection.execute("SELECT Table_Name, Changes FROM Table_Changes")}
+        except sqlite3.Error:
+            return {}
+
+    #-------------------------------------------------------------------------------
+    # Read-only connections, at most one per executor thread is created
+    def getConnection(self):
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            connection = get_connection(readOnly = True, dbPath = self.dbPath, check_same_thread = False)
+            connection.row_factory = sqlite3.Row
+            return connection
+
+#-------------------------------------------------------------------------------
+# Checks an If-None-Match header against an ETag
+def matches_etag(ifNoneMatch, etag):
+    if not ifNoneMatch:
+        return False
+
+    tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+apiServer = api_server_class()
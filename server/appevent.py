@@ -1,240 +1,251 @@
+import os
 import datetime
 import json
 import uuid
 
 # Register NetAlertX modules 
 import conf
-from const import applicationPath, logPath, apiPath, confFileName, sql_generateGuid
+from const import applicationPath, logPath, apiPath, confFileName, sql_generateGuid, sql_appevents_after, sql_appevents_export, sql_appevents_oldest
 from logger import logResult, mylog, print_log
-from helper import  timeNowTZ
+from helper import  timeNowTZ, row_to_json
 
 #-------------------------------------------------------------------------------
 # Execution object handling
 #-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# (Re)creates the AppEvents table and the triggers filling it, used by the DB migrations.
+# Doesn't commit, the migration is committed as a whole.
+def create_app_events(db):
+
+    # drop table 
+    db.sql.execute("""DROP TABLE IF EXISTS "AppEvents" """)
+
+    # Drop all triggers
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_create_device;')
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_read_device;')
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_update_device;')
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_delete_device;')
+
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_delete_plugin_object;')
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_create_plugin_object;')
+    db.sql.execute('DROP TRIGGER IF EXISTS trg_update_plugin_object;')
+
+    # Create AppEvent table if missing
+    db.sql.execute("""CREATE TABLE IF NOT EXISTS "AppEvents" (
+        "Index"                 INTEGER,
+        "GUID"                  TEXT UNIQUE,
+        "DateTimeCreated"       TEXT,
+        "ObjectType"            TEXT, -- ObjectType (Plugins, Notifications, Events)
+        "ObjectGUID"            TEXT,
+        "ObjectPlugin"          TEXT,
+        "ObjectPrimaryID"       TEXT,
+        "ObjectSecondaryID"     TEXT,
+        "ObjectForeignKey"      TEXT,
+        "ObjectIndex"           TEXT,            
+        "ObjectIsNew"           BOOLEAN, 
+        "ObjectIsArchived"      BOOLEAN, 
+        "ObjectStatusColumn"    TEXT, -- Status (Notifications, Plugins), eve_EventType (Events)
+        "ObjectStatus"          TEXT, -- new_devices, down_devices, events, new, watched-changed, watched-not-changed, missing-in-last-scan, Device down, New Device, IP Changed, Connected, Disconnected, VOIDED - Disconnected, VOIDED - Connected, <missing event>            
+        "AppEventType"          TEXT, -- "create", "update", "delete" (+TBD)
+        "Helper1"               TEXT,
+        "Helper2"               TEXT,
+        "Helper3"               TEXT,
+        "Extra"                 TEXT,            
+        PRIMARY KEY("Index" AUTOINCREMENT)
+    );
+    """)
+
+    # -------------
+    # Device events
+
+    sql_devices_mappedColumns = '''
+                "GUID",
+                "DateTimeCreated",
+                "ObjectType",
+                "ObjectPrimaryID",
+                "ObjectSecondaryID",
+                "ObjectStatus",
+                "ObjectStatusColumn",
+                "ObjectIsNew",
+                "ObjectIsArchived",
+                "ObjectForeignKey",
+                "AppEventType"
+    '''
+
+    # Trigger for create event
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS "trg_create_device"
+        AFTER INSERT ON "Devices"
+        BEGIN
+            INSERT INTO "AppEvents" (
+                {sql_devices_mappedColumns}
+            )
+            VALUES (                    
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Devices',
+                NEW.dev_MAC,
+                NEW.dev_LastIP,
+                CASE WHEN NEW.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
+                'dev_PresentLastScan',
+                NEW.dev_NewDevice,
+                NEW.dev_Archived,
+                NEW.dev_MAC,
+                'create'
+            );
+        END;
+    ''')
+
+    # 🔴 This would generate too many events, disabled for now
+    # # Trigger for read event
+    # db.sql.execute('''
+    #     TODO
+    # ''')
+
+    # Trigger for update event
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS "trg_update_device"
+        AFTER UPDATE ON "Devices"
+        BEGIN
+            INSERT INTO "AppEvents" (
+                {sql_devices_mappedColumns}
+            )
+            VALUES (                    
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Devices',
+                NEW.dev_MAC,
+                NEW.dev_LastIP,
+                CASE WHEN NEW.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
+                'dev_PresentLastScan',
+                NEW.dev_NewDevice,
+                NEW.dev_Archived,
+                NEW.dev_MAC,
+                'update'
+            );
+        END;
+    ''')
+
+    # Trigger for delete event
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS "trg_delete_device"
+        AFTER DELETE ON "Devices"
+        BEGIN
+            INSERT INTO "AppEvents" (
+                {sql_devices_mappedColumns}
+            )
+            VALUES (                    
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Devices',
+                OLD.dev_MAC,
+                OLD.dev_LastIP,
+                CASE WHEN OLD.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
+                'dev_PresentLastScan',
+                OLD.dev_NewDevice,
+                OLD.dev_Archived,
+                OLD.dev_MAC,
+                'delete'
+            );
+        END;
+    ''')
+
+
+    # -------------
+    # Plugins_Objects events
+
+    sql_plugins_objects_mappedColumns = '''
+                "GUID",
+                "DateTimeCreated",
+                "ObjectType",                    
+                "ObjectPlugin",
+                "ObjectPrimaryID",
+                "ObjectSecondaryID",
+                "ObjectForeignKey",
+                "ObjectStatusColumn",
+                "ObjectStatus",
+                "AppEventType"
+    '''
+
+    # Create trigger for update event on Plugins_Objects
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_update_plugin_object
+        AFTER UPDATE ON Plugins_Objects
+        BEGIN
+            INSERT INTO AppEvents (
+               {sql_plugins_objects_mappedColumns}
+            )
+            VALUES (
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Plugins_Objects',                    
+                NEW.Plugin,
+                NEW.Object_PrimaryID,
+                NEW.Object_SecondaryID,
+                NEW.ForeignKey,
+                'Status',
+                NEW.Status,
+                'update'
+            );
+        END;
+    ''')
+
+    # Create trigger for CREATE event on Plugins_Objects
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_create_plugin_object
+        AFTER INSERT ON Plugins_Objects
+        BEGIN
+            INSERT INTO AppEvents (
+            {sql_plugins_objects_mappedColumns}
+            )
+            VALUES (
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Plugins_Objects',
+                NEW.Plugin,
+                NEW.Object_PrimaryID,
+                NEW.Object_SecondaryID,
+                NEW.ForeignKey,
+                'Status',
+                NEW.Status,
+                'create'
+            );
+        END;
+    ''')
+
+    # Create trigger for DELETE event on Plugins_Objects
+    db.sql.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_delete_plugin_object
+        AFTER DELETE ON Plugins_Objects
+        BEGIN
+            INSERT INTO AppEvents (
+            {sql_plugins_objects_mappedColumns}
+            )
+            VALUES (
+                {sql_generateGuid},
+                DATETIME('now'),
+                'Plugins_Objects',
+                OLD.Plugin,
+                OLD.Object_PrimaryID,
+                OLD.Object_SecondaryID,
+                OLD.ForeignKey,
+                'Status',
+                OLD.Status,
+                'delete'
+            );
+        END;
+    ''')
+
+    # The table is recreated, so the "Index" restarts - a new feed ID tells consumers of
+    # the change feed to reset their cursor (see app_events_feed_class)
+    db.sql.execute("INSERT OR REPLACE INTO Parameters (par_ID, par_Value) VALUES ('AppEvents_FeedID', ?)", (str(uuid.uuid4()),))
+
+#-------------------------------------------------------------------------------
 class AppEvent_obj:
     def __init__(self, db):
         self.db = db
 
-        # drop table 
-        self.db.sql.execute("""DROP TABLE IF EXISTS "AppEvents" """)
-
-        # Drop all triggers
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_create_device;')
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_read_device;')
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_update_device;')
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_delete_device;')
-
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_delete_plugin_object;')
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_create_plugin_object;')
-        self.db.sql.execute('DROP TRIGGER IF EXISTS trg_update_plugin_object;')
-
-        # Create AppEvent table if missing
-        self.db.sql.execute("""CREATE TABLE IF NOT EXISTS "AppEvents" (
-            "Index"                 INTEGER,
-            "GUID"                  TEXT UNIQUE,
-            "DateTimeCreated"       TEXT,
-            "ObjectType"            TEXT, -- ObjectType (Plugins, Notifications, Events)
-            "ObjectGUID"            TEXT,
-            "ObjectPlugin"          TEXT,
-            "ObjectPrimaryID"       TEXT,
-            "ObjectSecondaryID"     TEXT,
-            "ObjectForeignKey"      TEXT,
-            "ObjectIndex"           TEXT,            
-            "ObjectIsNew"           BOOLEAN, 
-            "ObjectIsArchived"      BOOLEAN, 
-            "ObjectStatusColumn"    TEXT, -- Status (Notifications, Plugins), eve_EventType (Events)
-            "ObjectStatus"          TEXT, -- new_devices, down_devices, events, new, watched-changed, watched-not-changed, missing-in-last-scan, Device down, New Device, IP Changed, Connected, Disconnected, VOIDED - Disconnected, VOIDED - Connected, <missing event>            
-            "AppEventType"          TEXT, -- "create", "update", "delete" (+TBD)
-            "Helper1"               TEXT,
-            "Helper2"               TEXT,
-            "Helper3"               TEXT,
-            "Extra"                 TEXT,            
-            PRIMARY KEY("Index" AUTOINCREMENT)
-        );
-        """)
-
-        # -------------
-        # Device events
-
-        sql_devices_mappedColumns = '''
-                    "GUID",
-                    "DateTimeCreated",
-                    "ObjectType",
-                    "ObjectPrimaryID",
-                    "ObjectSecondaryID",
-                    "ObjectStatus",
-                    "ObjectStatusColumn",
-                    "ObjectIsNew",
-                    "ObjectIsArchived",
-                    "ObjectForeignKey",
-                    "AppEventType"
-        '''
-
-        # Trigger for create event
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS "trg_create_device"
-            AFTER INSERT ON "Devices"
-            BEGIN
-                INSERT INTO "AppEvents" (
-                    {sql_devices_mappedColumns}
-                )
-                VALUES (                    
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Devices',
-                    NEW.dev_MAC,
-                    NEW.dev_LastIP,
-                    CASE WHEN NEW.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
-                    'dev_PresentLastScan',
-                    NEW.dev_NewDevice,
-                    NEW.dev_Archived,
-                    NEW.dev_MAC,
-                    'create'
-                );
-            END;
-        ''')
-
-        # 🔴 This would generate too many events, disabled for now
-        # # Trigger for read event
-        # self.db.sql.execute('''
-        #     TODO
-        # ''')
-
-        # Trigger for update event
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS "trg_update_device"
-            AFTER UPDATE ON "Devices"
-            BEGIN
-                INSERT INTO "AppEvents" (
-                    {sql_devices_mappedColumns}
-                )
-                VALUES (                    
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Devices',
-                    NEW.dev_MAC,
-                    NEW.dev_LastIP,
-                    CASE WHEN NEW.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
-                    'dev_PresentLastScan',
-                    NEW.dev_NewDevice,
-                    NEW.dev_Archived,
-                    NEW.dev_MAC,
-                    'update'
-                );
-            END;
-        ''')
-
-        # Trigger for delete event
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS "trg_delete_device"
-            AFTER DELETE ON "Devices"
-            BEGIN
-                INSERT INTO "AppEvents" (
-                    {sql_devices_mappedColumns}
-                )
-                VALUES (                    
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Devices',
-                    OLD.dev_MAC,
-                    OLD.dev_LastIP,
-                    CASE WHEN OLD.dev_PresentLastScan = 1 THEN 'online' ELSE 'offline' END,
-                    'dev_PresentLastScan',
-                    OLD.dev_NewDevice,
-                    OLD.dev_Archived,
-                    OLD.dev_MAC,
-                    'delete'
-                );
-            END;
-        ''')
-
-
-        # -------------
-        # Plugins_Objects events
-
-        sql_plugins_objects_mappedColumns = '''
-                    "GUID",
-                    "DateTimeCreated",
-                    "ObjectType",                    
-                    "ObjectPlugin",
-                    "ObjectPrimaryID",
-                    "ObjectSecondaryID",
-                    "ObjectForeignKey",
-                    "ObjectStatusColumn",
-                    "ObjectStatus",
-                    "AppEventType"
-        '''
-
-        # Create trigger for update event on Plugins_Objects
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS trg_update_plugin_object
-            AFTER UPDATE ON Plugins_Objects
-            BEGIN
-                INSERT INTO AppEvents (
-                   {sql_plugins_objects_mappedColumns}
-                )
-                VALUES (
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Plugins_Objects',                    
-                    NEW.Plugin,
-                    NEW.Object_PrimaryID,
-                    NEW.Object_SecondaryID,
-                    NEW.ForeignKey,
-                    'Status',
-                    NEW.Status,
-                    'update'
-                );
-            END;
-        ''')
-
-        # Create trigger for CREATE event on Plugins_Objects
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS trg_create_plugin_object
-            AFTER INSERT ON Plugins_Objects
-            BEGIN
-                INSERT INTO AppEvents (
-                {sql_plugins_objects_mappedColumns}
-                )
-                VALUES (
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Plugins_Objects',
-                    NEW.Plugin,
-                    NEW.Object_PrimaryID,
-                    NEW.Object_SecondaryID,
-                    NEW.ForeignKey,
-                    'Status',
-                    NEW.Status,
-                    'create'
-                );
-            END;
-        ''')
-
-        # Create trigger for DELETE event on Plugins_Objects
-        self.db.sql.execute(f'''
-            CREATE TRIGGER IF NOT EXISTS trg_delete_plugin_object
-            AFTER DELETE ON Plugins_Objects
-            BEGIN
-                INSERT INTO AppEvents (
-                {sql_plugins_objects_mappedColumns}
-                )
-                VALUES (
-                    {sql_generateGuid},
-                    DATETIME('now'),
-                    'Plugins_Objects',
-                    OLD.Plugin,
-                    OLD.Object_PrimaryID,
-                    OLD.Object_SecondaryID,
-                    OLD.ForeignKey,
-                    'Status',
-                    OLD.Status,
-                    'delete'
-                );
-            END;
-        ''')
-
-        self.save()
 
     # -------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------
@@ -378,3 +389,155 @@ def getPluginObject(**kwargs):
 
         return None
 
+
+
+#-------------------------------------------------------------------------------
+# Change feed of the AppEvents table
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# ID of the current AppEvents table, changes when the table is recreated
+def get_app_events_feed_id(connection):
+    row = connection.execute("SELECT par_Value FROM Parameters WHERE par_ID = 'AppEvents_FeedID'").fetchone()
+
+    return row[0] if row is not None else ''
+
+#-------------------------------------------------------------------------------
+# Returns the app events after the given "Index" (cursor), at most limit events, oldest first
+def get_app_events_after(connection, afterIndex, limit = 1000):
+    cursor = connection.execute(sql_appevents_after, (afterIndex, limit))
+    columnNames = list(map(lambda x: x[0], cursor.description))
+
+    return [row_to_json(columnNames, row) for row in cursor.fetchall()]
+
+#-------------------------------------------------------------------------------
+# Writes new app events into append-only NDJSON segment files (one event per line) with up to
+# segmentSize events each, e.g. /api/appevents/appevents_1001.ndjson for events starting at
+# "Index" 1001. index.json lists the feed ID, the last exported "Index" and the segments.
+# Consumers read the segments after their last processed "Index" and reset when the feed ID changes.
+class app_events_feed_class:
+    def __init__(self, folder = apiPath + 'appevents/', segmentSize = 1000):
+        self.folder = folder
+        self.segmentSize = segmentSize
+        self.manifestPath = folder + 'index.json'
+        self.manifest = None
+
+    #-------------------------------------------------------------------------------
+    def export(self, db):
+        try:
+            self.exportEvents(db.sql_connection)
+        except OSError as e:
+            mylog('none', [f'[AppEvents] ⚠ ERROR Exporting the change feed to {self.folder}: {e}'])
+            # continue from the last saved index.json
+            self.manifest = None
+
+    #-------------------------------------------------------------------------------
+    def exportEvents(self, connection):
+
+        feedId = get_app_events_feed_id(connection)
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        if self.manifest is None:
+            self.manifest = self.loadManifest()
+
+            if self.manifest is not None and self.manifest["feedId"] == feedId:
+                self.removeUnsavedEvents()
+
+        # new feed - start over
+        if self.manifest is None or self.manifest["feedId"] != feedId:
+            for fileName in os.listdir(self.folder):
+                if fileName.endswith('.ndjson'):
+                    os.remove(self.folder + fileName)
+
+            self.manifest = {"feedId": feedId, "lastIndex": 0, "segmentSize": self.segmentSize, "segments": []}
+            changed = True
+        else:
+            changed = False
+
+        segments = self.manifest["segments"]
+        file = None
+
+        cursor = connection.execute(sql_appevents_export, (self.manifest["lastIndex"],))
+        columnNames = list(map(lambda x: x[0], cursor.description))
+
+        try:
+            while True:
+                rows = cursor.fetchmany(500)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    index = row["Index"]
+
+                    # start a new segment
+                    if len(segments) == 0 or segments[-1]["count"] >= self.segmentSize:
+                        segments.append({"file": f'appevents_{index}.ndjson', "first": index, "last": index, "count": 0, "size": 0})
+
+                        if file is not None:
+                            file.close()
+                            file = None
+
+                    if file is None:
+                        file = open(self.folder + segments[-1]["file"], 'ab')
+
+                    line = (json.dumps(row_to_json(columnNames, row)) + '\n').encode('utf-8')
+                    file.write(line)
+
+                    segments[-1]["last"] = index
+                    segments[-1]["count"] += 1
+                    segments[-1]["size"] += len(line)
+                    self.manifest["lastIndex"] = index
+                    changed = True
+        finally:
+            if file is not None:
+                file.close()
+
+        # remove segments with events only older than the oldest remaining event (deleted by DB cleanup)
+        oldestIndex = connection.execute(sql_appevents_oldest).fetchone()[0]
+
+        if oldestIndex is not None:
+            for segment in [segment for segment in segments if segment["last"] < oldestIndex]:
+                segments.remove(segment)
+                changed = True
+
+                if os.path.exists(self.folder + segment["file"]):
+                    os.remove(self.folder + segment["file"])
+
+        if changed:
+            mylog('verbose', [f'[AppEvents] Change feed exported up to index {self.manifest["lastIndex"]}'])
+
+            tmpPath = self.manifestPath + '.tmp'
+            with open(tmpPath, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f)
+            os.replace(tmpPath, self.manifestPath)
+
+    #-------------------------------------------------------------------------------
+    # Removes the events written after the last saved index.json (e.g. the app stopped before 
+    # saving it), so they are not exported twice: segment files which are not listed are deleted
+    # and the last segment is truncated to its saved size.
+    def removeUnsavedEvents(self):
+        segments = self.manifest["segments"]
+        files = [segment["file"] for segment in segments]
+
+        for fileName in os.listdir(self.folder):
+            if fileName.endswith('.ndjson') and fileName not in files:
+                os.remove(self.folder + fileName)
+
+        if len(segments) > 0:
+            path = self.folder + segments[-1]["file"]
+
+            if os.path.exists(path) and os.path.getsize(path) > segments[-1]["size"]:
+                mylog('verbose', [f'[AppEvents] Removing events exported after index {self.manifest["lastIndex"]} from {segments[-1]["file"]}'])
+                os.truncate(path, segments[-1]["size"])
+
+    #-------------------------------------------------------------------------------
+    def loadManifest(self):
+        try:
+            with open(self.manifestPath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            return None
+
+appEventsFeed = app_events_feed_class()
@@ -21,6 +21,7 @@ time_started = ''
 startTime = ''
 last_scan_run = ''
 last_version_check = ''
+last_sessions_check = ''
 arpscan_devices = []
 
 # ACTUAL CONFIGRATION ITEMS set to defaults
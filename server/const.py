@@ -9,6 +9,7 @@ confFileName    = 'app.conf'
 confPath        = "/config/" + confFileName
 
 dbPath          = '/db/' + dbFileName
+dbBusyTimeout   = 30    # seconds a connection waits for the write lock held by another connection
 
 
 pluginsPath         = applicationPath + '/front/plugins'
@@ -20,6 +21,7 @@ fullConfPath        = applicationPath + confPath
 fullDbPath          = applicationPath + dbPath
 vendorsPath         = '/usr/share/arp-scan/ieee-oui.txt'
 vendorsPathNewest   = '/usr/share/arp-scan/ieee-oui_all_filtered.txt'
+vendorsPathIndex    = '/usr/share/arp-scan/ieee-oui.idx'
 
        
 
@@ -41,6 +43,76 @@ sql_notifications_all = "SELECT  * FROM Notifications"
 sql_online_history = "SELECT  * FROM Online_History"
 sql_plugins_events = "SELECT  * FROM Plugins_Events"
 sql_plugins_history = "SELECT  * FROM Plugins_History ORDER BY DateTimeChanged DESC"
+sql_plugins_objects_plugin = "SELECT  * FROM Plugins_Objects WHERE Plugin = ?"
+sql_plugins_events_plugin = "SELECT  * FROM Plugins_Events WHERE Plugin = ?"
+sql_plugins_history_plugin = "SELECT  * FROM Plugins_History WHERE Plugin = ? ORDER BY DateTimeChanged DESC"
+sql_notifications_new = """SELECT * FROM Notifications WHERE Status = 'new'"""
+sql_notifications_set_processed = """UPDATE Notifications SET Status = 'processed' WHERE Status = 'new'"""
+sql_notifications_remove = """DELETE FROM Notifications WHERE GUID = ?"""
+sql_plugins_objects_update = """UPDATE Plugins_Objects
+                                SET "Plugin" = ?, "Object_PrimaryID" = ?, "Object_SecondaryID" = ?, "DateTimeCreated" = ?, 
+                                    "DateTimeChanged" = ?, "Watched_Value1" = ?, "Watched_Value2" = ?, "Watched_Value3" = ?, 
+                                    "Watched_Value4" = ?, "Status" = ?, "Extra" = ?, "UserData" = ?, "ForeignKey" = ?, "SyncHubNodeName" = ?, "HelpVal1" = ?, "HelpVal2" = ?, "HelpVal3" = ?, "HelpVal4" = ?
+                                WHERE "Index" = ?"""
+# Name entries of the plugins with the {placeholders} of the plugin prefixes (see helper.plugin_device_names_class)
+sql_plugins_device_names = """SELECT Plugin, Object_PrimaryID, Object_SecondaryID, Watched_Value2 FROM Plugins_Objects 
+                              WHERE Plugin IN ({placeholders})
+                              ORDER BY Plugin, "Index" """
+# App events change feed - events after the "Index" cursor, with / without a limit
+sql_appevents_after = """SELECT * FROM AppEvents WHERE "Index" > ? ORDER BY "Index" LIMIT ?"""
+sql_appevents_export = """SELECT * FROM AppEvents WHERE "Index" > ? ORDER BY "Index" """
+sql_appevents_oldest = """SELECT MIN("Index") FROM AppEvents"""
+# DB cleanup - plugins to trim the history of, one at a time
+sql_plugins_history_plugins = """SELECT DISTINCT Plugin FROM Plugins_History"""
+# DB cleanup - delete duplicate plugin objects, the first one is kept
+sql_plugins_objects_dedupe = """DELETE FROM Plugins_Objects
+                                WHERE rowid > (
+                                    SELECT MIN(rowid) FROM Plugins_Objects p2
+                                    WHERE Plugins_Objects.Plugin = p2.Plugin
+                                    AND Plugins_Objects.Object_PrimaryID = p2.Object_PrimaryID
+                                    AND Plugins_Objects.Object_SecondaryID = p2.Object_SecondaryID
+                                    AND Plugins_Objects.UserData = p2.UserData
+                                )"""
+# DB cleanup - keep the latest <n> entries of each plugin (params: plugin, plugin, n)
+sql_plugins_history_trim = """DELETE FROM Plugins_History WHERE Plugin = ? AND "Index" NOT IN (
+                                SELECT "Index" FROM Plugins_History WHERE Plugin = ? ORDER BY DateTimeChanged DESC LIMIT ?)"""
+# DB cleanup - keep the latest <n> notifications / app events (param: n), by the "Index" (rowid) growing 
+# with the creation time, so entries created at the same time and gaps in the "Index" don't matter
+sql_notifications_trim = """DELETE FROM Notifications WHERE "Index" <= (
+                                SELECT "Index" FROM Notifications ORDER BY "Index" DESC LIMIT 1 OFFSET ?)"""
+sql_appevents_trim = """DELETE FROM AppEvents WHERE "Index" <= (
+                                SELECT "Index" FROM AppEvents ORDER BY "Index" DESC LIMIT 1 OFFSET ?)"""
+# Sessions of the events selected by {eventRowids} - the rows of the Convert_Events_to_Sessions view,
+# keyed by the rowid of the event they come from (see networkscan.update_sessions). The view is a 
+# UNION without duplicates, so events with the same session as an earlier (smaller rowid) event are skipped.
+sql_insert_sessions = """INSERT INTO Sessions (ses_EventRowid, ses_MAC, ses_IP, ses_EventTypeConnection, ses_DateTimeConnection,
+                            ses_EventTypeDisconnection, ses_DateTimeDisconnection, ses_StillConnected, ses_AdditionalInfo)
+                        SELECT EVE1.rowid, EVE1.eve_MAC, EVE1.eve_IP, EVE1.eve_EventType, EVE1.eve_DateTime,
+                            CASE WHEN EVE2.eve_EventType IN ('Disconnected', 'Device Down') OR EVE2.eve_EventType IS NULL
+                                 THEN EVE2.eve_EventType ELSE '<missing event>' END,
+                            CASE WHEN EVE2.eve_EventType IN ('Disconnected', 'Device Down') THEN EVE2.eve_DateTime ELSE NULL END,
+                            CASE WHEN EVE2.eve_EventType IS NULL THEN 1 ELSE 0 END,
+                            EVE1.eve_AdditionalInfo
+                        FROM Events AS EVE1 LEFT JOIN Events AS EVE2 ON EVE1.eve_PairEventRowID = EVE2.rowid
+                        WHERE EVE1.eve_EventType IN ('New Device', 'Connected')
+                          AND EVE1.rowid IN ({eventRowids})
+                          AND NOT EXISTS (SELECT 1 FROM Events AS EVE3
+                                          WHERE EVE3.eve_MAC = EVE1.eve_MAC AND EVE3.eve_DateTime = EVE1.eve_DateTime
+                                            AND EVE3.rowid < EVE1.rowid AND EVE3.eve_EventType = EVE1.eve_EventType
+                                            AND EVE3.eve_IP IS EVE1.eve_IP AND EVE3.eve_AdditionalInfo IS EVE1.eve_AdditionalInfo
+                                            AND EVE3.eve_PairEventRowID IS EVE1.eve_PairEventRowID)
+                        UNION ALL
+                        SELECT rowid, eve_MAC, eve_IP, '<missing event>', NULL, eve_EventType, eve_DateTime, 0, eve_AdditionalInfo
+                        FROM Events AS EVE1
+                        WHERE eve_EventType IN ('Device Down', 'Disconnected') AND eve_PairEventRowID IS NULL
+                          AND rowid IN ({eventRowids})
+                          AND NOT EXISTS (SELECT 1 FROM Events AS EVE3
+                                          WHERE EVE3.eve_MAC = EVE1.eve_MAC AND EVE3.eve_DateTime = EVE1.eve_DateTime
+                                            AND EVE3.rowid < EVE1.rowid AND EVE3.eve_EventType = EVE1.eve_EventType
+                                            AND EVE3.eve_IP IS EVE1.eve_IP AND EVE3.eve_AdditionalInfo IS EVE1.eve_AdditionalInfo
+                                            AND EVE3.eve_PairEventRowID IS NULL)"""
+sql_sessions_columns = """ses_MAC, ses_IP, ses_EventTypeConnection, ses_DateTimeConnection, ses_EventTypeDisconnection,
+                          ses_DateTimeDisconnection, ses_StillConnected, ses_AdditionalInfo"""
 sql_new_devices = """SELECT * FROM ( 
                         SELECT eve_IP as dev_LastIP, eve_MAC as dev_MAC 
                         FROM Events_Devices
@@ -3,13 +3,19 @@
 import sqlite3
 import base64
 import json
+from contextlib import contextmanager
 
 # Register NetAlertX modules 
-from const import fullDbPath, sql_devices_stats, sql_devices_all, sql_generateGuid
+from const import fullDbPath, dbBusyTimeout, sql_devices_stats, sql_devices_all, sql_generateGuid, sql_insert_sessions
 
 from logger import mylog
 from helper import json_obj, initOrSetParam, row_to_json, timeNowTZ#, split_string #, updateState
-from appevent import AppEvent_obj
+from appevent import create_app_events
+
+# tables with change counters in Table_Changes (see createChangeTriggers)
+changeTrackedTables = ['AppEvents', 'Devices', 'Events', 'Settings', 'Plugins_Events', 'Plugins_History', 
+                       'Plugins_Objects', 'Plugins_Language_Strings', 'Notifications', 'Online_History']
+changeTrackedPluginTables = ['Plugins_Events', 'Plugins_History', 'Plugins_Objects']
 
 class DB():
     """
@@ -20,6 +26,7 @@ class DB():
     def __init__(self):
         self.sql = None
         self.sql_connection = None
+        self.savepoints = []    # names of the open savepoints, see savepoint()
 
     #-------------------------------------------------------------------------------
     def open (self):
@@ -31,8 +38,9 @@ class DB():
         mylog('none', '[Database] Opening DB' )
         # Open DB and Cursor
         try:
-            self.sql_connection = sqlite3.connect (fullDbPath, isolation_level=None)
+            self.sql_connection = get_connection (isolation_level=None)
             self.sql_connection.execute('pragma journal_mode=wal') #
+            self.sql_connection.execute('pragma temp_store=memory') # TEMP tables (CurrentScan) and temporary indexes
             self.sql_connection.text_factory = str
             self.sql_connection.row_factory = sqlite3.Row
             self.sql = self.sql_connection.cursor()
@@ -46,22 +54,49 @@ class DB():
             mylog('debug','commitDB: database is not open')
             return False
 
+        # Within a savepoint the changes are committed when the outermost savepoint is released
+        if self.savepoints:
+            mylog('trace', f'commitDB: deferred to the release of savepoint {self.savepoints[0]}')
+            return True
+
         # Commit changes to DB
         self.sql_connection.commit()
         return True
 
+    #-------------------------------------------------------------------------------
+    # Runs the block in a savepoint: released when the block completes, rolled back when it
+    # raises. The outermost savepoint is the transaction, so nested blocks (and commitDB()
+    # calls within them) are committed together with one WAL commit when it's released.
+    @contextmanager
+    def savepoint(self, name):
+        self.sql_connection.execute(f'SAVEPOINT {name}')
+        self.savepoints.append(name)
+
+        try:
+            yield
+        except Exception:
+            # an error can already have rolled back the whole transaction
+            if self.sql_connection.in_transaction:
+                self.sql_connection.execute(f'ROLLBACK TO {name}')
+                self.sql_connection.execute(f'RELEASE {name}')
+            raise
+        else:
+            self.sql_connection.execute(f'RELEASE {name}')
+        finally:
+            self.savepoints.pop()
+
     #-------------------------------------------------------------------------------
     def rollbackDB(self):
         if self.sql_connection:
             self.sql_connection.rollback()
 
     #-------------------------------------------------------------------------------    
-    def get_sql_array(self, query):
+    def get_sql_array(self, query, params = ()):
         if self.sql_connection == None :
             mylog('debug','getQueryArray: database is not open')
             return
 
-        self.sql.execute(query)
+        self.sql.execute(query, params)
         rows = self.sql.fetchall()
         #self.commitDB()
 
@@ -79,454 +114,39 @@ class DB():
     #-------------------------------------------------------------------------------
     def upgradeDB(self):
         """
-        Check the current tables in the DB and upgrade them if neccessary
+        Migrate the DB schema to the latest version (see schemaMigrations). The current version
+        is stored in PRAGMA user_version, so an up to date DB costs one PRAGMA read.
         """
-        
-        # indicates, if Online_History table is available
-        onlineHistoryAvailable = self.sql.execute("""
-            SELECT name FROM sqlite_master WHERE type='table'
-                AND name='Online_History';
-        """).fetchall() != []
-
-        # Check if it is incompatible (Check if table has all required columns)
-        isIncompatible = False
-
-        if onlineHistoryAvailable :
-          isIncompatible = self.sql.execute ("""
-                SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Online_History') WHERE name='Archived_Devices'
-            """).fetchone()[0] == 0
-
-        # Drop table if available, but incompatible
-        if onlineHistoryAvailable and isIncompatible:
-          mylog('none','[upgradeDB] Table is incompatible, Dropping the Online_History table')
-          self.sql.execute("DROP TABLE Online_History;")
-          onlineHistoryAvailable = False
-          
-        if onlineHistoryAvailable == False :
-          self.sql.execute("""
-          CREATE TABLE "Online_History" (
-            "Index"	INTEGER,
-            "Scan_Date"	TEXT,
-            "Online_Devices"	INTEGER,
-            "Down_Devices"	INTEGER,
-            "All_Devices"	INTEGER,
-            "Archived_Devices" INTEGER,
-            PRIMARY KEY("Index" AUTOINCREMENT)
-          );
-          """)
-
-        # Offline_Devices column
-        Offline_Devices_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Online_History') WHERE name='Offline_Devices'
-          """).fetchone()[0] == 0
-
-        if Offline_Devices_missing :
-          mylog('verbose', ["[upgradeDB] Adding Offline_Devices to the Online_History table"])
-          self.sql.execute("""
-            ALTER TABLE "Online_History" ADD "Offline_Devices" INTEGER
-          """)
-
-
-        # -------------------------------------------------------------------------
-        # Alter Devices table       
-        # -------------------------------------------------------------------------
-        # dev_Network_Node_MAC_ADDR column
-        dev_Network_Node_MAC_ADDR_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Network_Node_MAC_ADDR'
-          """).fetchone()[0] == 0
-
-        if dev_Network_Node_MAC_ADDR_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_Network_Node_MAC_ADDR to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_Network_Node_MAC_ADDR" TEXT
-          """)
-
-        # dev_Network_Node_port column
-        dev_Network_Node_port_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Network_Node_port'
-          """).fetchone()[0] == 0
-
-        if dev_Network_Node_port_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_Network_Node_port to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_Network_Node_port" INTEGER
-          """)
-
-        # dev_Icon column
-        dev_Icon_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Icon'
-          """).fetchone()[0] == 0
-
-        if dev_Icon_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_Icon to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_Icon" TEXT
-          """)
-
-        # dev_GUID column
-        dev_GUID_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_GUID'
-          """).fetchone()[0] == 0
-
-        if dev_GUID_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_GUID to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_GUID" TEXT
-          """)
-
-        # dev_NetworkSite column
-        dev_NetworkSite_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_NetworkSite'
-          """).fetchone()[0] == 0
-
-        if dev_NetworkSite_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_NetworkSite to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_NetworkSite" TEXT
-          """)
-
-        # dev_SSID column
-        dev_SSID_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_SSID'
-          """).fetchone()[0] == 0
-
-        if dev_SSID_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_SSID to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_SSID" TEXT
-          """)
-
-        # SQL query to update missing dev_GUID
-        self.sql.execute(f'''
-            UPDATE Devices
-            SET dev_GUID = {sql_generateGuid}
-            WHERE dev_GUID IS NULL
-        ''')
-
-        # dev_SyncHubNodeName column
-        dev_SyncHubNodeName_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_SyncHubNodeName'
-          """).fetchone()[0] == 0
-
-        if dev_SyncHubNodeName_missing :
-          mylog('verbose', ["[upgradeDB] Adding dev_SyncHubNodeName to the Devices table"])
-          self.sql.execute("""
-            ALTER TABLE "Devices" ADD "dev_SyncHubNodeName" TEXT
-          """)
-
-        # -------------------------------------------------------------------------
-        # Settings table setup
-        # -------------------------------------------------------------------------
-
-        
-        # Re-creating Settings table
-        mylog('verbose', ["[upgradeDB] Re-creating Settings table"])
-
-        self.sql.execute(""" DROP TABLE IF EXISTS Settings;""")
-        self.sql.execute("""
-            CREATE TABLE "Settings" (
-            "Code_Name"	      TEXT,
-            "Display_Name"	  TEXT,
-            "Description"	    TEXT,
-            "Type"            TEXT,
-            "Options"         TEXT,
-            "RegEx"           TEXT,
-            "Group"	          TEXT,
-            "Value"	          TEXT,
-            "Events"	        TEXT,
-            "OverriddenByEnv" INTEGER
-            );
-            """)
-
-
-        # -------------------------------------------------------------------------
-        # Pholus_Scan table setup
-        # -------------------------------------------------------------------------
-
-        # Create Pholus_Scan table if missing
-        mylog('verbose', ["[upgradeDB] Re-creating Pholus_Scan table"])
-        self.sql.execute("""CREATE TABLE IF NOT EXISTS "Pholus_Scan" (
-            "Index"	          INTEGER,
-            "Info"	          TEXT,
-            "Time"	          TEXT,
-            "MAC"	          TEXT,
-            "IP_v4_or_v6"	  TEXT,
-            "Record_Type"	  TEXT,
-            "Value"           TEXT,
-            "Extra"           TEXT,
-            PRIMARY KEY("Index" AUTOINCREMENT)
-        );
-        """)
-
 
-        # -------------------------------------------------------------------------
-        # Parameters table setup
-        # -------------------------------------------------------------------------
+        version = self.sql.execute('PRAGMA user_version').fetchone()[0]
 
-        # Re-creating Parameters table
-        mylog('verbose', ["[upgradeDB] Re-creating Parameters table"])
-        self.sql.execute("DROP TABLE Parameters;")
+        if version > len(schemaMigrations):
+            mylog('none', [f'[upgradeDB] ⚠ ERROR DB schema version {version} is newer than the supported version {len(schemaMigrations)}'])
 
-        self.sql.execute("""
-          CREATE TABLE "Parameters" (
-            "par_ID" TEXT PRIMARY KEY,
-            "par_Value"	TEXT
-          );
-          """)        
+        for number, migration in enumerate(schemaMigrations[version:], start = version + 1):
+            mylog('verbose', [f'[upgradeDB] Migrating the DB schema to version {number} ({migration.__name__})'])
 
-        # -------------------------------------------------------------------------
-        # Nmap_Scan table setup DEPRECATED after 9/9/2024
-        # -------------------------------------------------------------------------
+            # each migration is applied together with its version or not at all
+            try:
+                self.sql.execute('BEGIN')
+                migration(self)
+                self.sql.execute(f'PRAGMA user_version = {number}')
+                self.sql.execute('COMMIT')
+            except sqlite3.Error as e:
+                self.rollbackDB()
+                mylog('none', [f'[upgradeDB] ⚠ ERROR Migrating the DB schema to version {number}: {e}'])
+                raise
 
-        # indicates, if Nmap_Scan table is available
-        nmapScanMissing = self.sql.execute("""
-        SELECT name FROM sqlite_master WHERE type='table'
-        AND name='Nmap_Scan';
-        """).fetchone() == None
-
-        if nmapScanMissing == False:
-            # move data into the PLugins_Objects table
-            self.sql.execute("""INSERT INTO Plugins_Objects (
-                                    Plugin,
-                                    Object_PrimaryID,
-                                    Object_SecondaryID,
-                                    DateTimeCreated,
-                                    DateTimeChanged,
-                                    Watched_Value1,
-                                    Watched_Value2,
-                                    Watched_Value3,
-                                    Watched_Value4,
-                                    Status,
-                                    Extra,
-                                    UserData,
-                                    ForeignKey
-                                )
-                                SELECT
-                                    'NMAP' AS Plugin,
-                                    MAC AS Object_PrimaryID,
-                                    Port AS Object_SecondaryID,
-                                    Time AS DateTimeCreated,
-                                    DATETIME('now') AS DateTimeChanged,
-                                    State AS Watched_Value1,
-                                    Service AS Watched_Value2,
-                                    '' AS Watched_Value3,
-                                    '' AS Watched_Value4,
-                                    'watched-not-changed' AS Status,
-                                    Extra AS Extra,
-                                    Extra AS UserData,
-                                    MAC AS ForeignKey
-                                FROM Nmap_Scan;""")
-
-            # Delete the Nmap_Scan table
-            self.sql.execute("DROP TABLE Nmap_Scan;")
-            nmapScanMissing = True
-
-        # -------------------------------------------------------------------------
-        # Nmap_Scan table setup DEPRECATED after 9/9/2024 cleanup above
-        # -------------------------------------------------------------------------
-
-        # -------------------------------------------------------------------------
-        # Icon format migration table setup DEPRECATED after 9/9/2024 cleanup below
-        # -------------------------------------------------------------------------
-
-        sql_Icons = """ UPDATE Devices SET dev_Icon = '<i class="fa fa-' || dev_Icon || '"></i>'
-                WHERE dev_Icon NOT LIKE '<i class="fa fa-%'
-                AND dev_Icon NOT LIKE '<svg%' 
-                AND dev_Icon NOT LIKE 'PGkg%' 
-                AND dev_Icon NOT LIKE 'PHN%' 
-                AND dev_Icon NOT IN ('', 'null')
-                 """
-        self.sql.execute(sql_Icons)
-        self.commitDB()      
-
-        # Base64 conversion
-
-        self.sql.execute("SELECT dev_MAC, dev_Icon FROM Devices WHERE dev_Icon like '<%' ")
-        icons = self.sql.fetchall()
-
-
-        # Loop through the icons, encode them, and update the database
-        for icon_tuple in icons:
-            icon = icon_tuple[1]
-            
-            # Encode the icon as base64
-            encoded_icon = base64.b64encode(icon.encode('utf-8')).decode('ascii')
-            # Update the database with the encoded icon
-            sql_update = f"""
-                UPDATE Devices
-                SET dev_Icon = '{encoded_icon}'
-                WHERE dev_MAC = '{icon_tuple[0]}'
-            """
-
-            self.sql.execute(sql_update)
-
-        # -------------------------------------------------------------------------
-        # Icon format migration table setup DEPRECATED after 9/9/2024 cleanup above
-        # -------------------------------------------------------------------------
-
-        # -------------------------------------------------------------------------
-        # Plugins tables setup
-        # -------------------------------------------------------------------------
-
-        # Plugin state
-        sql_Plugins_Objects = """ CREATE TABLE IF NOT EXISTS Plugins_Objects(
-                                    "Index"	          INTEGER,
-                                    Plugin TEXT NOT NULL,
-                                    Object_PrimaryID TEXT NOT NULL,
-                                    Object_SecondaryID TEXT NOT NULL,
-                                    DateTimeCreated TEXT NOT NULL,
-                                    DateTimeChanged TEXT NOT NULL,
-                                    Watched_Value1 TEXT NOT NULL,
-                                    Watched_Value2 TEXT NOT NULL,
-                                    Watched_Value3 TEXT NOT NULL,
-                                    Watched_Value4 TEXT NOT NULL,
-                                    Status TEXT NOT NULL,
-                                    Extra TEXT NOT NULL,
-                                    UserData TEXT NOT NULL,
-                                    ForeignKey TEXT NOT NULL,
-                                    PRIMARY KEY("Index" AUTOINCREMENT)
-                        ); """
-        self.sql.execute(sql_Plugins_Objects)
-
-        # syncHubNodeName column
-        plug_SyncHubNodeName_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Objects') WHERE name='SyncHubNodeName'
-          """).fetchone()[0] == 0
-
-        if plug_SyncHubNodeName_missing :
-          mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_Objects table"])
-          self.sql.execute("""
-            ALTER TABLE "Plugins_Objects" ADD "SyncHubNodeName" TEXT
-          """)
-          
-        # helper columns HelpVal1-4
-        plug_HelpValues_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Objects') WHERE name='HelpVal1'
-          """).fetchone()[0] == 0
-
-        if plug_HelpValues_missing :
-          mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_Objects table"])
-          self.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal1" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal2" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal3" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal4" TEXT')
-
-        # Plugin execution results
-        sql_Plugins_Events = """ CREATE TABLE IF NOT EXISTS Plugins_Events(
-                                    "Index"	          INTEGER,
-                                    Plugin TEXT NOT NULL,
-                                    Object_PrimaryID TEXT NOT NULL,
-                                    Object_SecondaryID TEXT NOT NULL,
-                                    DateTimeCreated TEXT NOT NULL,
-                                    DateTimeChanged TEXT NOT NULL,
-                                    Watched_Value1 TEXT NOT NULL,
-                                    Watched_Value2 TEXT NOT NULL,
-                                    Watched_Value3 TEXT NOT NULL,
-                                    Watched_Value4 TEXT NOT NULL,
-                                    Status TEXT NOT NULL,
-                                    Extra TEXT NOT NULL,
-                                    UserData TEXT NOT NULL,
-                                    ForeignKey TEXT NOT NULL,
-                                    PRIMARY KEY("Index" AUTOINCREMENT)
-                        ); """
-        self.sql.execute(sql_Plugins_Events)
-
-        # syncHubNodeName column
-        plug_SyncHubNodeName_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Events') WHERE name='SyncHubNodeName'
-          """).fetchone()[0] == 0
-
-        if plug_SyncHubNodeName_missing :
-          mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_Events table"])
-          self.sql.execute("""
-            ALTER TABLE "Plugins_Events" ADD "SyncHubNodeName" TEXT
-          """)
-          
-        # helper columns HelpVal1-4
-        plug_HelpValues_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Events') WHERE name='HelpVal1'
-          """).fetchone()[0] == 0
-
-        if plug_HelpValues_missing :
-          mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_Events table"])
-          self.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal1" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal2" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal3" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal4" TEXT')
-
-
-        # Plugin execution history
-        sql_Plugins_History = """ CREATE TABLE IF NOT EXISTS Plugins_History(
-                                    "Index"	          INTEGER,
-                                    Plugin TEXT NOT NULL,
-                                    Object_PrimaryID TEXT NOT NULL,
-                                    Object_SecondaryID TEXT NOT NULL,
-                                    DateTimeCreated TEXT NOT NULL,
-                                    DateTimeChanged TEXT NOT NULL,
-                                    Watched_Value1 TEXT NOT NULL,
-                                    Watched_Value2 TEXT NOT NULL,
-                                    Watched_Value3 TEXT NOT NULL,
-                                    Watched_Value4 TEXT NOT NULL,
-                                    Status TEXT NOT NULL,
-                                    Extra TEXT NOT NULL,
-                                    UserData TEXT NOT NULL,
-                                    ForeignKey TEXT NOT NULL,
-                                    PRIMARY KEY("Index" AUTOINCREMENT)
-                        ); """
-        self.sql.execute(sql_Plugins_History)
-
-        # syncHubNodeName column
-        plug_SyncHubNodeName_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_History') WHERE name='SyncHubNodeName'
-          """).fetchone()[0] == 0
-
-        if plug_SyncHubNodeName_missing :
-          mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_History table"])
-          self.sql.execute("""
-            ALTER TABLE "Plugins_History" ADD "SyncHubNodeName" TEXT
-          """)
-          
-        # helper columns HelpVal1-4
-        plug_HelpValues_missing = self.sql.execute ("""
-            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_History') WHERE name='HelpVal1'
-          """).fetchone()[0] == 0
-
-        if plug_HelpValues_missing :
-          mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_History table"])
-          self.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal1" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal2" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal3" TEXT')
-          self.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal4" TEXT')
-
-
-        # -------------------------------------------------------------------------
-        # Plugins_Language_Strings table setup
-        # -------------------------------------------------------------------------
-
-        # Dynamically generated language strings
-        self.sql.execute("DROP TABLE IF EXISTS Plugins_Language_Strings;")
-        self.sql.execute(""" CREATE TABLE IF NOT EXISTS Plugins_Language_Strings(
-                                "Index"	          INTEGER,
-                                Language_Code TEXT NOT NULL,
-                                String_Key TEXT NOT NULL,
-                                String_Value TEXT NOT NULL,
-                                Extra TEXT NOT NULL,
-                                PRIMARY KEY("Index" AUTOINCREMENT)
-                        ); """)
+        self.createCurrentScan()
 
-        self.commitDB()        
-
- 
-
-        # -------------------------------------------------------------------------
-        # CurrentScan table setup
-        # -------------------------------------------------------------------------
+    #-------------------------------------------------------------------------------
+    # CurrentScan holds the scan results only within a scan cycle. It's a TEMP table of the
+    # backend connection, kept in memory without WAL writes and empty after a restart, with
+    # one row per MAC (see current_scan_upsert).
+    def createCurrentScan(self):
 
-        # indicates, if CurrentScan table is available
-        # 🐛 CurrentScan DEBUG: comment out below when debugging to keep the CurrentScan table after restarts/scan finishes
-        self.sql.execute("DROP TABLE IF EXISTS CurrentScan;")
-        self.sql.execute(""" CREATE TABLE IF NOT EXISTS CurrentScan (                                
-                                cur_MAC STRING(50) NOT NULL COLLATE NOCASE,
+        self.sql.execute("""CREATE TEMP TABLE IF NOT EXISTS CurrentScan (
+                                cur_MAC STRING(50) NOT NULL COLLATE NOCASE PRIMARY KEY,
                                 cur_IP STRING(50) NOT NULL COLLATE NOCASE,
                                 cur_Vendor STRING(250),
                                 cur_ScanMethod STRING(10),
@@ -539,54 +159,83 @@ class DB():
                                 cur_NetworkNodeMAC STRING(250),
                                 cur_PORT STRING(250),
                                 cur_Type STRING(250)
-                            );
-                        """)
+                            )""")
 
-        self.commitDB()        
-
-        # -------------------------------------------------------------------------
-        # Create the LatestEventsPerMAC view
-        # -------------------------------------------------------------------------
-
-        # Dynamically generated language strings
-        self.sql.execute(""" CREATE VIEW IF NOT EXISTS LatestEventsPerMAC AS
-                                WITH RankedEvents AS (
-                                    SELECT 
-                                        e.*,
-                                        ROW_NUMBER() OVER (PARTITION BY e.eve_MAC ORDER BY e.eve_DateTime DESC) AS row_num
-                                    FROM Events AS e
-                                )
-                                SELECT 
-                                    e.*, 
-                                    d.*, 
-                                    c.*
-                                FROM RankedEvents AS e
-                                LEFT JOIN Devices AS d ON e.eve_MAC = d.dev_MAC
-                                INNER JOIN CurrentScan AS c ON e.eve_MAC = c.cur_MAC
-                                WHERE e.row_num = 1;
-                            """)
-
-        self.commitDB()       
 
+    #-------------------------------------------------------------------------------
+    # Creates triggers counting the inserted, updated and deleted rows of each table 
+    # in Table_Changes, so readers can check if a table changed without reading it.
+    # For the plugin tables, the changes of each plugin are counted too.
+    # Changes made by the frontend or plugins with their own DB connection are counted as well.
+    # The per-row overhead is a few µs (see test_change_triggers_benchmark in test/test_api.py).
+    # Used by the DB migrations, doesn't commit.
+    def createChangeTriggers(self, tables):
+
+        self.sql.execute("""CREATE TABLE IF NOT EXISTS Table_Changes (
+                                Table_Name TEXT NOT NULL PRIMARY KEY,
+                                Changes INTEGER NOT NULL DEFAULT 0
+                            )""")
+
+        existingTables = [row[0] for row in self.sql.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+
+        for table in tables:
+            # migrations creating or re-creating a tracked table have to create its triggers again
+            if table not in existingTables:
+                mylog('verbose', [f'[upgradeDB] Table {table} not found, changes are not tracked'])
+                continue
+
+            self.sql.execute("INSERT OR IGNORE INTO Table_Changes (Table_Name) VALUES (?)", (table,))
+
+            for operation in ['INSERT', 'UPDATE', 'DELETE']:
+                self.sql.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS "trg_changes_{table}_{operation.lower()}"
+                    AFTER {operation} ON "{table}"
+                    BEGIN
+                        UPDATE Table_Changes SET Changes = Changes + 1 WHERE Table_Name = '{table}';
+                    END
+                """)
+
+            # plugin tables count the changes per plugin as well, as <table>/<plugin prefix>
+            if table in changeTrackedPluginTables:
+                for operation, rowNames in [('INSERT', ['NEW']), ('UPDATE', ['NEW', 'OLD']), ('DELETE', ['OLD'])]:
+                    upserts = ''.join(f"""
+                        INSERT INTO Table_Changes (Table_Name, Changes) VALUES ('{table}/' || {rowName}.Plugin, 1)
+                            ON CONFLICT(Table_Name) DO UPDATE SET Changes = Changes + 1;""" for rowName in rowNames)
+
+                    self.sql.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS "trg_changes_{table}_plugin_{operation.lower()}"
+                        AFTER {operation} ON "{table}"
+                        BEGIN {upserts}
+                        END
+                    """)
 
-        # Init the AppEvent database table
-        AppEvent_obj(self)
+    #-------------------------------------------------------------------------------
+    # Creates the given indexes and drops other IDX_ indexes of the same tables, so the
+    # index set of these tables is exactly the given one. Used by the DB migrations, doesn't commit.
+    def createIndexes(self, indexes):
 
-        # -------------------------------------------------------------------------
-        #  DELETING OBSOLETE TABLES - to remove with updated db file after 9/9/2024
-        # -------------------------------------------------------------------------        
+        tables = set(table for _, table, _ in indexes)
+        names = [name for name, _, _ in indexes]
 
-        # Deletes obsolete ScanCycles
-        self.sql.execute(""" DROP TABLE IF EXISTS ScanCycles;""")
-        self.sql.execute(""" DROP TABLE IF EXISTS DHCP_Leases;""")
-        self.sql.execute(""" DROP TABLE IF EXISTS PiHole_Network;""")
+        existingIndexes = self.sql.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name LIKE 'IDX_%'").fetchall()
 
-        self.commitDB()
+        for name, table in existingIndexes:
+            if table in tables and name not in names:
+                mylog('verbose', [f'[upgradeDB] Dropping index {name}'])
+                self.sql.execute(f'DROP INDEX IF EXISTS "{name}"')
 
-        # -------------------------------------------------------------------------
-        #  DELETING OBSOLETE TABLES - to remove with updated db file after 9/9/2024
-        # -------------------------------------------------------------------------
+        for name, table, columns in indexes:
+            self.sql.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})')
 
+    #-------------------------------------------------------------------------------
+    # Returns the change counters of the tracked tables, {Table_Name: Changes}
+    def get_table_changes(self):
+        try:
+            self.sql.execute("SELECT Table_Name, Changes FROM Table_Changes")
+            return {row[0]: row[1] for row in self.sql.fetchall()}
+        except sqlite3.Error as e:
+            mylog('none',[ '[Database] - SQL ERROR: ', e])
+            return {}
 
     #-------------------------------------------------------------------------------
     def get_table_as_json(self, sqlQuery):
@@ -609,6 +258,50 @@ class DB():
         # mylog('debug',[ '[Database] - get_table_as_json - returning json ', json.dumps(result) ])
         return json_obj(result, columnNames)
 
+    #-------------------------------------------------------------------------------
+    # Same JSON as get_table_as_json, but returned in chunks of text while reading the rows
+    # in batches, so the whole table is never held in memory
+    def iter_table_as_json(self, sqlQuery, params = (), batchSize = 500):
+
+        rows = self.iter_rows_as_json(sqlQuery, params, batchSize)
+
+        try:
+            firstRow = next(rows, None)
+        except sqlite3.Error as e:
+            mylog('none',[ '[Database] - SQL ERROR: ', e])
+            yield json.dumps({}) # return empty object
+            return
+
+        yield '{"data": ['
+
+        if firstRow is not None:
+            yield firstRow
+
+            for row in rows:
+                yield ', ' + row
+
+        yield ']}'
+
+    #-------------------------------------------------------------------------------
+    # Returns the rows of the query one by one as JSON objects (text), reading them in batches
+    def iter_rows_as_json(self, sqlQuery, params = (), batchSize = 500):
+
+        # own cursor, the rows are read while the caller is processing them
+        cursor = self.sql_connection.cursor()
+        cursor.execute(sqlQuery, params)
+        columnNames = list(map(lambda x: x[0], cursor.description))
+
+        while True:
+            rows = cursor.fetchmany(batchSize)
+
+            if not rows:
+                break
+
+            for row in rows:
+                yield json.dumps(row_to_json(columnNames, row))
+
+        cursor.close()
+
     #-------------------------------------------------------------------------------
     # referece from here: https://codereview.stackexchange.com/questions/241043/interface-class-for-sqlite-databases
     #-------------------------------------------------------------------------------
@@ -646,6 +339,739 @@ class DB():
 
 
 
+#-------------------------------------------------------------------------------
+# ON CONFLICT clause for INSERT INTO CurrentScan with the given columns - merges the rows of
+# scanners reporting the same MAC. The IP, vendor and scan method are taken from the first
+# row of the MAC, the other columns from the first row with a value.
+def current_scan_upsert(columns):
+
+    merged = [column for column in columns if column not in ('cur_MAC', 'cur_IP', 'cur_Vendor', 'cur_ScanMethod')]
+
+    if len(merged) == 0:
+        return ' ON CONFLICT (cur_MAC) DO NOTHING'
+
+    return ' ON CONFLICT (cur_MAC) DO UPDATE SET ' + ', '.join(
+        f"""{column} = CASE WHEN {column} IS NULL OR {column} IN ('', 'null') THEN excluded.{column} ELSE {column} END"""
+        for column in merged)
+
+
+#-------------------------------------------------------------------------------
+# DB schema migrations, see DB.upgradeDB
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Online_History table, new Devices columns
+def migrate_devices(db):
+
+    # indicates, if Online_History table is available
+    onlineHistoryAvailable = db.sql.execute("""
+        SELECT name FROM sqlite_master WHERE type='table'
+            AND name='Online_History';
+    """).fetchall() != []
+
+    # Check if it is incompatible (Check if table has all required columns)
+    isIncompatible = False
+
+    if onlineHistoryAvailable :
+      isIncompatible = db.sql.execute ("""
+            SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Online_History') WHERE name='Archived_Devices'
+        """).fetchone()[0] == 0
+
+    # Drop table if available, but incompatible
+    if onlineHistoryAvailable and isIncompatible:
+      mylog('none','[upgradeDB] Table is incompatible, Dropping the Online_History table')
+      db.sql.execute("DROP TABLE Online_History;")
+      onlineHistoryAvailable = False
+      
+    if onlineHistoryAvailable == False :
+      db.sql.execute("""
+      CREATE TABLE "Online_History" (
+        "Index"	INTEGER,
+        "Scan_Date"	TEXT,
+        "Online_Devices"	INTEGER,
+        "Down_Devices"	INTEGER,
+        "All_Devices"	INTEGER,
+        "Archived_Devices" INTEGER,
+        PRIMARY KEY("Index" AUTOINCREMENT)
+      );
+      """)
+
+    # Offline_Devices column
+    Offline_Devices_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Online_History') WHERE name='Offline_Devices'
+      """).fetchone()[0] == 0
+
+    if Offline_Devices_missing :
+      mylog('verbose', ["[upgradeDB] Adding Offline_Devices to the Online_History table"])
+      db.sql.execute("""
+        ALTER TABLE "Online_History" ADD "Offline_Devices" INTEGER
+      """)
+
+
+    # -------------------------------------------------------------------------
+    # Alter Devices table       
+    # -------------------------------------------------------------------------
+    # dev_Network_Node_MAC_ADDR column
+    dev_Network_Node_MAC_ADDR_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Network_Node_MAC_ADDR'
+      """).fetchone()[0] == 0
+
+    if dev_Network_Node_MAC_ADDR_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_Network_Node_MAC_ADDR to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_Network_Node_MAC_ADDR" TEXT
+      """)
+
+    # dev_Network_Node_port column
+    dev_Network_Node_port_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Network_Node_port'
+      """).fetchone()[0] == 0
+
+    if dev_Network_Node_port_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_Network_Node_port to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_Network_Node_port" INTEGER
+      """)
+
+    # dev_Icon column
+    dev_Icon_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_Icon'
+      """).fetchone()[0] == 0
+
+    if dev_Icon_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_Icon to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_Icon" TEXT
+      """)
+
+    # dev_GUID column
+    dev_GUID_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_GUID'
+      """).fetchone()[0] == 0
+
+    if dev_GUID_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_GUID to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_GUID" TEXT
+      """)
+
+    # dev_NetworkSite column
+    dev_NetworkSite_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_NetworkSite'
+      """).fetchone()[0] == 0
+
+    if dev_NetworkSite_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_NetworkSite to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_NetworkSite" TEXT
+      """)
+
+    # dev_SSID column
+    dev_SSID_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_SSID'
+      """).fetchone()[0] == 0
+
+    if dev_SSID_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_SSID to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_SSID" TEXT
+      """)
+
+    # SQL query to update missing dev_GUID
+    db.sql.execute(f'''
+        UPDATE Devices
+        SET dev_GUID = {sql_generateGuid}
+        WHERE dev_GUID IS NULL
+    ''')
+
+    # dev_SyncHubNodeName column
+    dev_SyncHubNodeName_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Devices') WHERE name='dev_SyncHubNodeName'
+      """).fetchone()[0] == 0
+
+    if dev_SyncHubNodeName_missing :
+      mylog('verbose', ["[upgradeDB] Adding dev_SyncHubNodeName to the Devices table"])
+      db.sql.execute("""
+        ALTER TABLE "Devices" ADD "dev_SyncHubNodeName" TEXT
+      """)
+
+#-------------------------------------------------------------------------------
+# Settings, Pholus_Scan and Parameters tables
+def migrate_settings_parameters(db):
+
+    # -------------------------------------------------------------------------
+    # Settings table setup
+    # -------------------------------------------------------------------------
+
+    
+    # Re-creating Settings table
+    mylog('verbose', ["[upgradeDB] Re-creating Settings table"])
+
+    db.sql.execute(""" DROP TABLE IF EXISTS Settings;""")
+    db.sql.execute("""
+        CREATE TABLE "Settings" (
+        "Code_Name"	      TEXT,
+        "Display_Name"	  TEXT,
+        "Description"	    TEXT,
+        "Type"            TEXT,
+        "Options"         TEXT,
+        "RegEx"           TEXT,
+        "Group"	          TEXT,
+        "Value"	          TEXT,
+        "Events"	        TEXT,
+        "OverriddenByEnv" INTEGER
+        );
+        """)
+
+
+    # -------------------------------------------------------------------------
+    # Pholus_Scan table setup
+    # -------------------------------------------------------------------------
+
+    # Create Pholus_Scan table if missing
+    mylog('verbose', ["[upgradeDB] Re-creating Pholus_Scan table"])
+    db.sql.execute("""CREATE TABLE IF NOT EXISTS "Pholus_Scan" (
+        "Index"	          INTEGER,
+        "Info"	          TEXT,
+        "Time"	          TEXT,
+        "MAC"	          TEXT,
+        "IP_v4_or_v6"	  TEXT,
+        "Record_Type"	  TEXT,
+        "Value"           TEXT,
+        "Extra"           TEXT,
+        PRIMARY KEY("Index" AUTOINCREMENT)
+    );
+    """)
+
+
+    # -------------------------------------------------------------------------
+    # Parameters table setup
+    # -------------------------------------------------------------------------
+
+    # Re-creating Parameters table
+    mylog('verbose', ["[upgradeDB] Re-creating Parameters table"])
+    db.sql.execute("DROP TABLE IF EXISTS Parameters;")
+
+    db.sql.execute("""
+      CREATE TABLE "Parameters" (
+        "par_ID" TEXT PRIMARY KEY,
+        "par_Value"	TEXT
+      );
+      """)        
+
+#-------------------------------------------------------------------------------
+# Nmap_Scan data moved to the NMAP plugin, icons converted to base64
+def migrate_nmap_scan_icons(db):
+
+    # -------------------------------------------------------------------------
+    # Nmap_Scan table setup DEPRECATED after 9/9/2024
+    # -------------------------------------------------------------------------
+
+    # indicates, if Nmap_Scan table is available
+    nmapScanMissing = db.sql.execute("""
+    SELECT name FROM sqlite_master WHERE type='table'
+    AND name='Nmap_Scan';
+    """).fetchone() == None
+
+    if nmapScanMissing == False:
+        # move data into the PLugins_Objects table
+        db.sql.execute("""INSERT INTO Plugins_Objects (
+                                Plugin,
+                                Object_PrimaryID,
+                                Object_SecondaryID,
+                                DateTimeCreated,
+                                DateTimeChanged,
+                                Watched_Value1,
+                                Watched_Value2,
+                                Watched_Value3,
+                                Watched_Value4,
+                                Status,
+                                Extra,
+                                UserData,
+                                ForeignKey
+                            )
+                            SELECT
+                                'NMAP' AS Plugin,
+                                MAC AS Object_PrimaryID,
+                                Port AS Object_SecondaryID,
+                                Time AS DateTimeCreated,
+                                DATETIME('now') AS DateTimeChanged,
+                                State AS Watched_Value1,
+                                Service AS Watched_Value2,
+                                '' AS Watched_Value3,
+                                '' AS Watched_Value4,
+                                'watched-not-changed' AS Status,
+                                Extra AS Extra,
+                                Extra AS UserData,
+                                MAC AS ForeignKey
+                            FROM Nmap_Scan;""")
+
+        # Delete the Nmap_Scan table
+        db.sql.execute("DROP TABLE Nmap_Scan;")
+        nmapScanMissing = True
+
+    # -------------------------------------------------------------------------
+    # Nmap_Scan table setup DEPRECATED after 9/9/2024 cleanup above
+    # -------------------------------------------------------------------------
+
+    # -------------------------------------------------------------------------
+    # Icon format migration table setup DEPRECATED after 9/9/2024 cleanup below
+    # -------------------------------------------------------------------------
+
+    sql_Icons = """ UPDATE Devices SET dev_Icon = '<i class="fa fa-' || dev_Icon || '"></i>'
+            WHERE dev_Icon NOT LIKE '<i class="fa fa-%'
+            AND dev_Icon NOT LIKE '<svg%' 
+            AND dev_Icon NOT LIKE 'PGkg%' 
+            AND dev_Icon NOT LIKE 'PHN%' 
+            AND dev_Icon NOT IN ('', 'null')
+             """
+    db.sql.execute(sql_Icons)
+
+    # Base64 conversion
+
+    db.sql.execute("SELECT dev_MAC, dev_Icon FROM Devices WHERE dev_Icon like '<%' ")
+    icons = db.sql.fetchall()
+
+
+    # Loop through the icons, encode them, and update the database
+    for icon_tuple in icons:
+        icon = icon_tuple[1]
+        
+        # Encode the icon as base64
+        encoded_icon = base64.b64encode(icon.encode('utf-8')).decode('ascii')
+        # Update the database with the encoded icon
+        sql_update = f"""
+            UPDATE Devices
+            SET dev_Icon = '{encoded_icon}'
+            WHERE dev_MAC = '{icon_tuple[0]}'
+        """
+
+        db.sql.execute(sql_update)
+
+    # -------------------------------------------------------------------------
+    # Icon format migration table setup DEPRECATED after 9/9/2024 cleanup above
+    # -------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+# Plugins_Objects, Plugins_Events, Plugins_History and Plugins_Language_Strings tables
+def migrate_plugin_tables(db):
+
+    # -------------------------------------------------------------------------
+    # Plugins tables setup
+    # -------------------------------------------------------------------------
+
+    # Plugin state
+    sql_Plugins_Objects = """ CREATE TABLE IF NOT EXISTS Plugins_Objects(
+                                "Index"	          INTEGER,
+                                Plugin TEXT NOT NULL,
+                                Object_PrimaryID TEXT NOT NULL,
+                                Object_SecondaryID TEXT NOT NULL,
+                                DateTimeCreated TEXT NOT NULL,
+                                DateTimeChanged TEXT NOT NULL,
+                                Watched_Value1 TEXT NOT NULL,
+                                Watched_Value2 TEXT NOT NULL,
+                                Watched_Value3 TEXT NOT NULL,
+                                Watched_Value4 TEXT NOT NULL,
+                                Status TEXT NOT NULL,
+                                Extra TEXT NOT NULL,
+                                UserData TEXT NOT NULL,
+                                ForeignKey TEXT NOT NULL,
+                                PRIMARY KEY("Index" AUTOINCREMENT)
+                    ); """
+    db.sql.execute(sql_Plugins_Objects)
+
+    # syncHubNodeName column
+    plug_SyncHubNodeName_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Objects') WHERE name='SyncHubNodeName'
+      """).fetchone()[0] == 0
+
+    if plug_SyncHubNodeName_missing :
+      mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_Objects table"])
+      db.sql.execute("""
+        ALTER TABLE "Plugins_Objects" ADD "SyncHubNodeName" TEXT
+      """)
+      
+    # helper columns HelpVal1-4
+    plug_HelpValues_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Objects') WHERE name='HelpVal1'
+      """).fetchone()[0] == 0
+
+    if plug_HelpValues_missing :
+      mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_Objects table"])
+      db.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal1" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal2" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal3" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Objects" ADD COLUMN "HelpVal4" TEXT')
+
+    # indexes for lookups of plugin objects by their IDs (e.g. device names from plugins)
+    db.sql.execute('CREATE INDEX IF NOT EXISTS IDX_Plugins_Objects_PrimaryID ON Plugins_Objects (Plugin, Object_PrimaryID)')
+    db.sql.execute('CREATE INDEX IF NOT EXISTS IDX_Plugins_Objects_SecondaryID ON Plugins_Objects (Plugin, Object_SecondaryID)')
+
+    # Plugin execution results
+    sql_Plugins_Events = """ CREATE TABLE IF NOT EXISTS Plugins_Events(
+                                "Index"	          INTEGER,
+                                Plugin TEXT NOT NULL,
+                                Object_PrimaryID TEXT NOT NULL,
+                                Object_SecondaryID TEXT NOT NULL,
+                                DateTimeCreated TEXT NOT NULL,
+                                DateTimeChanged TEXT NOT NULL,
+                                Watched_Value1 TEXT NOT NULL,
+                                Watched_Value2 TEXT NOT NULL,
+                                Watched_Value3 TEXT NOT NULL,
+                                Watched_Value4 TEXT NOT NULL,
+                                Status TEXT NOT NULL,
+                                Extra TEXT NOT NULL,
+                                UserData TEXT NOT NULL,
+                                ForeignKey TEXT NOT NULL,
+                                PRIMARY KEY("Index" AUTOINCREMENT)
+                    ); """
+    db.sql.execute(sql_Plugins_Events)
+
+    # syncHubNodeName column
+    plug_SyncHubNodeName_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Events') WHERE name='SyncHubNodeName'
+      """).fetchone()[0] == 0
+
+    if plug_SyncHubNodeName_missing :
+      mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_Events table"])
+      db.sql.execute("""
+        ALTER TABLE "Plugins_Events" ADD "SyncHubNodeName" TEXT
+      """)
+      
+    # helper columns HelpVal1-4
+    plug_HelpValues_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_Events') WHERE name='HelpVal1'
+      """).fetchone()[0] == 0
+
+    if plug_HelpValues_missing :
+      mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_Events table"])
+      db.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal1" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal2" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal3" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_Events" ADD COLUMN "HelpVal4" TEXT')
+
+
+    # Plugin execution history
+    sql_Plugins_History = """ CREATE TABLE IF NOT EXISTS Plugins_History(
+                                "Index"	          INTEGER,
+                                Plugin TEXT NOT NULL,
+                                Object_PrimaryID TEXT NOT NULL,
+                                Object_SecondaryID TEXT NOT NULL,
+                                DateTimeCreated TEXT NOT NULL,
+                                DateTimeChanged TEXT NOT NULL,
+                                Watched_Value1 TEXT NOT NULL,
+                                Watched_Value2 TEXT NOT NULL,
+                                Watched_Value3 TEXT NOT NULL,
+                                Watched_Value4 TEXT NOT NULL,
+                                Status TEXT NOT NULL,
+                                Extra TEXT NOT NULL,
+                                UserData TEXT NOT NULL,
+                                ForeignKey TEXT NOT NULL,
+                                PRIMARY KEY("Index" AUTOINCREMENT)
+                    ); """
+    db.sql.execute(sql_Plugins_History)
+
+    # syncHubNodeName column
+    plug_SyncHubNodeName_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_History') WHERE name='SyncHubNodeName'
+      """).fetchone()[0] == 0
+
+    if plug_SyncHubNodeName_missing :
+      mylog('verbose', ["[upgradeDB] Adding SyncHubNodeName to the Plugins_History table"])
+      db.sql.execute("""
+        ALTER TABLE "Plugins_History" ADD "SyncHubNodeName" TEXT
+      """)
+      
+    # helper columns HelpVal1-4
+    plug_HelpValues_missing = db.sql.execute ("""
+        SELECT COUNT(*) AS CNTREC FROM pragma_table_info('Plugins_History') WHERE name='HelpVal1'
+      """).fetchone()[0] == 0
+
+    if plug_HelpValues_missing :
+      mylog('verbose', ["[upgradeDB] Adding HelpVal1-4 to the Plugins_History table"])
+      db.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal1" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal2" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal3" TEXT')
+      db.sql.execute('ALTER TABLE "Plugins_History" ADD COLUMN "HelpVal4" TEXT')
+
+
+    # -------------------------------------------------------------------------
+    # Plugins_Language_Strings table setup
+    # -------------------------------------------------------------------------
+
+    # Dynamically generated language strings
+    db.sql.execute("DROP TABLE IF EXISTS Plugins_Language_Strings;")
+    db.sql.execute(""" CREATE TABLE IF NOT EXISTS Plugins_Language_Strings(
+                            "Index"	          INTEGER,
+                            Language_Code TEXT NOT NULL,
+                            String_Key TEXT NOT NULL,
+                            String_Value TEXT NOT NULL,
+                            Extra TEXT NOT NULL,
+                            PRIMARY KEY("Index" AUTOINCREMENT)
+                    ); """)
+
+#-------------------------------------------------------------------------------
+# CurrentScan table and the LatestEventsPerMAC view
+def migrate_current_scan(db):
+
+    # -------------------------------------------------------------------------
+    # CurrentScan table setup
+    # -------------------------------------------------------------------------
+
+    # indicates, if CurrentScan table is available
+    # (replaced by a TEMP table by migrate_current_scan_temp, see DB.createCurrentScan)
+    db.sql.execute("DROP TABLE IF EXISTS CurrentScan;")
+    db.sql.execute(""" CREATE TABLE IF NOT EXISTS CurrentScan (                                
+                            cur_MAC STRING(50) NOT NULL COLLATE NOCASE,
+                            cur_IP STRING(50) NOT NULL COLLATE NOCASE,
+                            cur_Vendor STRING(250),
+                            cur_ScanMethod STRING(10),
+                            cur_Name STRING(250),
+                            cur_LastQuery STRING(250),
+                            cur_DateTime STRING(250),
+                            cur_SyncHubNodeName STRING(50),
+                            cur_NetworkSite STRING(250),
+                            cur_SSID STRING(250),
+                            cur_NetworkNodeMAC STRING(250),
+                            cur_PORT STRING(250),
+                            cur_Type STRING(250)
+                        );
+                    """)
+
+
+    # -------------------------------------------------------------------------
+    # Create the LatestEventsPerMAC view
+    # -------------------------------------------------------------------------
+
+    # Dynamically generated language strings
+    db.sql.execute(""" CREATE VIEW IF NOT EXISTS LatestEventsPerMAC AS
+                            WITH RankedEvents AS (
+                                SELECT 
+                                    e.*,
+                                    ROW_NUMBER() OVER (PARTITION BY e.eve_MAC ORDER BY e.eve_DateTime DESC) AS row_num
+                                FROM Events AS e
+                            )
+                            SELECT 
+                                e.*, 
+                                d.*, 
+                                c.*
+                            FROM RankedEvents AS e
+                            LEFT JOIN Devices AS d ON e.eve_MAC = d.dev_MAC
+                            INNER JOIN CurrentScan AS c ON e.eve_MAC = c.cur_MAC
+                            WHERE e.row_num = 1;
+                        """)
+#-------------------------------------------------------------------------------
+# AppEvents and Notifications tables
+def migrate_app_events(db):
+
+    # Init the AppEvent database table
+    create_app_events(db)
+
+    # Created here as well (same as in Notification_obj) so the change triggers are created for it
+    db.sql.execute("""CREATE TABLE IF NOT EXISTS "Notifications" (
+        "Index"           INTEGER,
+        "GUID"            TEXT UNIQUE,
+        "DateTimeCreated" TEXT,
+        "DateTimePushed"  TEXT,
+        "Status"          TEXT,
+        "JSON"            TEXT,
+        "Text"            TEXT,
+        "HTML"            TEXT,
+        "PublishedVia"    TEXT,
+        "Extra"           TEXT,
+        PRIMARY KEY("Index" AUTOINCREMENT)
+    );
+    """)
+
+#-------------------------------------------------------------------------------
+# Obsolete tables
+def migrate_obsolete_tables(db):
+
+    # -------------------------------------------------------------------------
+    #  DELETING OBSOLETE TABLES - to remove with updated db file after 9/9/2024
+    # -------------------------------------------------------------------------
+
+    # Deletes obsolete ScanCycles
+    db.sql.execute(""" DROP TABLE IF EXISTS ScanCycles;""")
+    db.sql.execute(""" DROP TABLE IF EXISTS DHCP_Leases;""")
+    db.sql.execute(""" DROP TABLE IF EXISTS PiHole_Network;""")
+
+#-------------------------------------------------------------------------------
+# Change counters of the tables exposed via the API, has to run after all tables were (re)created
+def migrate_change_triggers(db):
+
+    db.createChangeTriggers(changeTrackedTables)
+
+#-------------------------------------------------------------------------------
+# Devices inserted without a GUID (e.g. imported from a CSV file in the frontend) get one
+# right away - previously the missing GUIDs were only generated on the next start
+def migrate_devices_guid_trigger(db):
+
+    db.sql.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS "trg_generate_device_guid"
+        AFTER INSERT ON "Devices"
+        WHEN NEW.dev_GUID IS NULL
+        BEGIN
+            UPDATE Devices SET dev_GUID = {sql_generateGuid} WHERE rowid = NEW.rowid;
+        END
+    """)
+
+#-------------------------------------------------------------------------------
+# Secondary indexes of the hot tables for the access paths of the backend, API and DB cleanup,
+# [index name, table, columns] (see test/test_query_plans.py). Later index changes are new migrations.
+def migrate_indexes(db):
+
+    db.createIndexes([
+        ['IDX_Plugins_Objects_PrimaryID',       'Plugins_Objects',  'Plugin, Object_PrimaryID'],
+        ['IDX_Plugins_Objects_SecondaryID',     'Plugins_Objects',  'Plugin, Object_SecondaryID'],
+        ['IDX_Plugins_Events_PrimaryID',        'Plugins_Events',   'Plugin, Object_PrimaryID'],
+        ['IDX_Plugins_History_Plugin',          'Plugins_History',  'Plugin, DateTimeChanged'],
+        ['IDX_Plugins_History_DateTimeChanged', 'Plugins_History',  'DateTimeChanged'],
+        ['IDX_Notifications_Status',            'Notifications',    'Status'],
+        ['IDX_Notifications_DateTimeCreated',   'Notifications',    'DateTimeCreated'],
+    ])
+
+#-------------------------------------------------------------------------------
+# Sessions maintained incrementally from the changed events (see networkscan.update_sessions):
+# the Sessions rows are keyed by the event they come from and the triggers collect the rowids
+# of inserted, changed and deleted events in Sessions_Changes (pair_sessions_events re-sets
+# unchanged values on every scan, hence the WHEN clause)
+def migrate_sessions_changes(db):
+
+    columns = [row[1] for row in db.sql.execute("PRAGMA table_info('Sessions')").fetchall()]
+
+    if 'ses_EventRowid' not in columns:
+        db.sql.execute('ALTER TABLE "Sessions" ADD "ses_EventRowid" INTEGER')
+
+    db.sql.execute('CREATE INDEX IF NOT EXISTS IDX_ses_EventRowid ON Sessions (ses_EventRowid)')
+
+    db.sql.execute('CREATE TABLE IF NOT EXISTS Sessions_Changes (Event_Rowid INTEGER PRIMARY KEY)')
+
+    db.sql.execute("""
+        CREATE TRIGGER IF NOT EXISTS "trg_sessions_changes_insert" AFTER INSERT ON "Events"
+        BEGIN
+            INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid) VALUES (NEW.rowid);
+        END
+    """)
+    db.sql.execute("""
+        CREATE TRIGGER IF NOT EXISTS "trg_sessions_changes_update"
+        AFTER UPDATE OF eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PairEventRowid ON "Events"
+        WHEN OLD.eve_MAC IS NOT NEW.eve_MAC OR OLD.eve_IP IS NOT NEW.eve_IP
+          OR OLD.eve_DateTime IS NOT NEW.eve_DateTime OR OLD.eve_EventType IS NOT NEW.eve_EventType
+          OR OLD.eve_AdditionalInfo IS NOT NEW.eve_AdditionalInfo OR OLD.eve_PairEventRowid IS NOT NEW.eve_PairEventRowid
+        BEGIN
+            INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid) VALUES (OLD.rowid);
+            INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid) VALUES (NEW.rowid);
+        END
+    """)
+    db.sql.execute("""
+        CREATE TRIGGER IF NOT EXISTS "trg_sessions_changes_delete" AFTER DELETE ON "Events"
+        BEGIN
+            INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid) VALUES (OLD.rowid);
+        END
+    """)
+
+    # one full rebuild, the existing sessions have no event rowid
+    db.sql.execute('DELETE FROM Sessions')
+    db.sql.execute(sql_insert_sessions.format(eventRowids = 'SELECT rowid FROM Events'))
+    db.sql.execute('DELETE FROM Sessions_Changes')
+
+#-------------------------------------------------------------------------------
+# Events of a device in time order for the pairing of the session events (see
+# networkscan.pair_sessions_events), also serves the lookups by MAC of IDX_eve_MAC
+def migrate_events_mac_datetime_index(db):
+
+    db.sql.execute('CREATE INDEX IF NOT EXISTS IDX_eve_MAC_DateTime ON Events (eve_MAC COLLATE NOCASE, eve_DateTime)')
+    db.sql.execute('DROP INDEX IF EXISTS IDX_eve_MAC')
+
+#-------------------------------------------------------------------------------
+# LastEvent table with the latest event of each MAC, replaces the LatestEventsPerMAC view
+# which ranked all events on every scan. Kept up to date by triggers on Events, the event
+# type and alert flag are read from the event itself (see networkscan.insert_events).
+def migrate_last_event(db):
+
+    db.sql.execute("""CREATE TABLE IF NOT EXISTS LastEvent (
+                        lev_MAC STRING(50) NOT NULL COLLATE NOCASE PRIMARY KEY,
+                        lev_DateTime DATETIME NOT NULL,
+                        lev_EventRowid INTEGER NOT NULL
+                    )""")
+
+    # the latest event of a MAC, on the same time the last inserted one
+    latestEvent = """SELECT eve_MAC, eve_DateTime, rowid FROM Events WHERE eve_MAC = {mac}
+                     ORDER BY eve_DateTime DESC, rowid DESC LIMIT 1"""
+
+    db.sql.execute("""
+        CREATE TRIGGER IF NOT EXISTS "trg_last_event_insert" AFTER INSERT ON "Events"
+        BEGIN
+            INSERT INTO LastEvent (lev_MAC, lev_DateTime, lev_EventRowid) VALUES (NEW.eve_MAC, NEW.eve_DateTime, NEW.rowid)
+            ON CONFLICT (lev_MAC) DO UPDATE SET lev_DateTime = excluded.lev_DateTime, lev_EventRowid = excluded.lev_EventRowid
+            WHERE excluded.lev_DateTime >= lev_DateTime;
+        END
+    """)
+    db.sql.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS "trg_last_event_update" AFTER UPDATE OF eve_MAC, eve_DateTime ON "Events"
+        BEGIN
+            DELETE FROM LastEvent WHERE lev_MAC IN (OLD.eve_MAC, NEW.eve_MAC);
+            INSERT INTO LastEvent (lev_MAC, lev_DateTime, lev_EventRowid) {latestEvent.format(mac = 'OLD.eve_MAC')};
+            INSERT OR IGNORE INTO LastEvent (lev_MAC, lev_DateTime, lev_EventRowid) {latestEvent.format(mac = 'NEW.eve_MAC')};
+        END
+    """)
+    db.sql.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS "trg_last_event_delete" AFTER DELETE ON "Events"
+        WHEN OLD.rowid = (SELECT lev_EventRowid FROM LastEvent WHERE lev_MAC = OLD.eve_MAC)
+        BEGIN
+            DELETE FROM LastEvent WHERE lev_MAC = OLD.eve_MAC;
+            INSERT INTO LastEvent (lev_MAC, lev_DateTime, lev_EventRowid) {latestEvent.format(mac = 'OLD.eve_MAC')};
+        END
+    """)
+
+    db.sql.execute("DELETE FROM LastEvent")
+    db.sql.execute("""INSERT INTO LastEvent (lev_MAC, lev_DateTime, lev_EventRowid)
+                        SELECT eve_MAC, eve_DateTime, EventRowid FROM (
+                            SELECT eve_MAC, eve_DateTime, rowid AS EventRowid,
+                                   ROW_NUMBER() OVER (PARTITION BY eve_MAC ORDER BY eve_DateTime DESC, rowid DESC) AS RowNumber
+                            FROM Events)
+                        WHERE RowNumber = 1""")
+
+    db.sql.execute("DROP VIEW IF EXISTS LatestEventsPerMAC")
+
+#-------------------------------------------------------------------------------
+# CurrentScan moved to a TEMP table (see DB.createCurrentScan)
+def migrate_current_scan_temp(db):
+
+    db.sql.execute("DROP TABLE IF EXISTS main.CurrentScan")
+
+#-------------------------------------------------------------------------------
+# The notifications are trimmed by their "Index" (see const.sql_notifications_trim), 
+# the index on DateTimeCreated isn't used anymore
+def migrate_drop_notifications_datetime_index(db):
+
+    db.sql.execute('DROP INDEX IF EXISTS IDX_Notifications_DateTimeCreated')
+
+#-------------------------------------------------------------------------------
+# DB schema migrations, the position in the list is the schema version stored in PRAGMA user_version.
+# Each migration has to be idempotent, it is re-run if it fails half way (e.g. on a legacy DB with
+# an unknown schema). Don't change released migrations, append new ones to the end of the list.
+# Migrations define their schema changes themselves, not in shared lists which may change later.
+schemaMigrations = [
+    migrate_devices,
+    migrate_settings_parameters,
+    migrate_nmap_scan_icons,
+    migrate_plugin_tables,
+    migrate_current_scan,
+    migrate_app_events,
+    migrate_obsolete_tables,
+    migrate_change_triggers,
+    migrate_devices_guid_trigger,
+    migrate_indexes,
+    migrate_sessions_changes,
+    migrate_events_mac_datetime_index,
+    migrate_last_event,
+    migrate_current_scan_temp,
+    migrate_drop_notifications_datetime_index,
+]
+
+
 #-------------------------------------------------------------------------------
 def get_device_stats(db):
     # columns = ["online","down","all","archived","new","unknown"]
@@ -655,4 +1081,18 @@ def get_all_devices(db):
     return db.read(sql_devices_all)
 
 #-------------------------------------------------------------------------------
+# Connection to the app DB for the core and the plugin scripts. Writers wait up to
+# dbBusyTimeout seconds for the write lock of another connection instead of failing with
+# "database is locked", readers that don't write get a read-only connection, which never
+# takes the write lock (with WAL they also don't block the writer).
+def get_connection(readOnly = False, dbPath = None, **kwargs):
+    if dbPath is None:
+        dbPath = fullDbPath
+
+    if readOnly:
+        return sqlite3.connect(f'file:{dbPath}?mode=ro', uri = True, timeout = dbBusyTimeout, **kwargs)
+
+    return sqlite3.connect(dbPath, timeout = dbBusyTimeout, **kwargs)
+
+#-------------------------------------------------------------------------------
 
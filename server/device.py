@@ -4,9 +4,11 @@ import subprocess
 import conf
 import os
 import re
-from helper import timeNowTZ, get_setting, get_setting_value, list_to_where, resolve_device_name_dig, resolve_device_name_pholus, get_device_name_nbtlookup, get_device_name_nslookup, get_device_name_mdns, check_IP_format, sanitize_SQL_input
+import mmap
+import struct
+from helper import timeNowTZ, get_setting, get_setting_value, list_to_where, reverseDnsResolver, cleanDeviceName, pholus_names_class, plugin_device_names_class, check_IP_format
 from logger import mylog, print_log
-from const import vendorsPath, vendorsPathNewest, sql_generateGuid
+from const import vendorsPath, vendorsPathNewest, vendorsPathIndex, sql_generateGuid
 
 #-------------------------------------------------------------------------------
 # Device object handling (WIP)
@@ -99,36 +101,86 @@ def save_scanned_devices (db):
             sql.execute (f"""INSERT INTO CurrentScan (cur_MAC, cur_IP, cur_Vendor, cur_ScanMethod) VALUES ( '{local_mac}', '{local_ip}', Null, 'local_MAC') """)
 
 #-------------------------------------------------------------------------------
-def print_scan_stats(db):
-    sql = db.sql # TO-DO
+# Presence diff of a scan - the new, down, disconnected and (re)connected devices and the IP
+# changes. Computed once per scan from Devices, CurrentScan and LastEvent for the events
+# (see networkscan.insert_events) and the scan stats.
+class presence_diff_class:
+    def __init__(self, db):
 
-    query = """
-    SELECT
-        (SELECT COUNT(*) FROM CurrentScan) AS devices_detected,
-        (SELECT COUNT(*) FROM CurrentScan WHERE NOT EXISTS (SELECT 1 FROM Devices WHERE dev_MAC = cur_MAC)) AS new_devices,
-        (SELECT COUNT(*) FROM Devices WHERE dev_AlertDeviceDown != 0 AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)) AS down_alerts,
-        (SELECT COUNT(*) FROM Devices WHERE dev_AlertDeviceDown != 0 AND dev_PresentLastScan = 1 AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)) AS new_down_alerts,
-        (SELECT COUNT(*) FROM Devices WHERE dev_PresentLastScan = 0) AS new_connections,
-        (SELECT COUNT(*) FROM Devices WHERE dev_PresentLastScan = 1 AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)) AS disconnections,
-        (SELECT COUNT(*) FROM Devices, CurrentScan WHERE dev_MAC = cur_MAC AND dev_LastIP <> cur_IP) AS ip_changes,
-        cur_ScanMethod,
-        COUNT(*) AS scan_method_count
-    FROM CurrentScan
-    GROUP BY cur_ScanMethod
-    """
+        scanRows = db.sql.execute("SELECT cur_MAC, cur_IP, cur_ScanMethod FROM CurrentScan").fetchall()
+        devices = db.sql.execute("""SELECT dev_MAC, dev_LastIP, dev_PresentLastScan, dev_AlertDeviceDown, dev_AlertEvents
+                                    FROM Devices""").fetchall()
 
-    sql.execute(query)
-    stats = sql.fetchall()
+        # latest event of the scanned devices, to tell reconnections after a down alert
+        lastEvents = {nocase(row[0]): row for row in db.sql.execute("""
+                        SELECT lev_MAC, eve_EventType, eve_PendingAlertEmail
+                        FROM LastEvent JOIN Events ON Events.rowid = lev_EventRowid
+                        WHERE lev_MAC IN (SELECT cur_MAC FROM CurrentScan)""")}
+
+        # MACs and IPs are compared case-insensitive as in the DB (COLLATE NOCASE)
+        scanned = {nocase(row["cur_MAC"]) for row in scanRows}
+        devicesByMAC = {nocase(row["dev_MAC"]): row for row in devices}
+
+        absent = [row for row in devices if nocase(row["dev_MAC"]) not in scanned]
+
+        self.detected = len(scanRows)
+        self.scanMethods = {}
+        self.newDevices = []
+        self.downAlerts = [row for row in absent if row["dev_AlertDeviceDown"] != 0]
+        self.disconnections = [row for row in absent if row["dev_PresentLastScan"] == 1]
+
+        # events as (MAC, IP, event type, additional info, pending alert)
+        self.down = [(row["dev_MAC"], row["dev_LastIP"], 'Device Down', '', 1)
+                        for row in self.disconnections if row["dev_AlertDeviceDown"] != 0]
+        self.connected = []
+        connectedSet = set()
+        self.disconnected = [(row["dev_MAC"], row["dev_LastIP"], 'Disconnected', '', row["dev_AlertEvents"])
+                                for row in self.disconnections if row["dev_AlertDeviceDown"] == 0]
+        self.ipChanged = []
+
+        for row in scanRows:
+            self.scanMethods[row["cur_ScanMethod"]] = self.scanMethods.get(row["cur_ScanMethod"], 0) + 1
+
+            device = devicesByMAC.get(nocase(row["cur_MAC"]))
+
+            if device is None:
+                self.newDevices.append(row)
+                continue
+
+            lastEvent = lastEvents.get(nocase(row["cur_MAC"]))
+
+            if device["dev_PresentLastScan"] == 0 and lastEvent is not None:
+                eventType = 'Down Reconnected' if lastEvent["eve_EventType"] == 'Device Down' and lastEvent["eve_PendingAlertEmail"] == 0 else 'Connected'
+                event = (row["cur_MAC"], row["cur_IP"], eventType, '', 1)
+
+                if event not in connectedSet:
+                    connectedSet.add(event)
+                    self.connected.append(event)
 
-    mylog('verbose', f'[Scan Stats] Devices Detected.......: {stats[0]["devices_detected"]}')
-    mylog('verbose', f'[Scan Stats] New Devices............: {stats[0]["new_devices"]}')
-    mylog('verbose', f'[Scan Stats] Down Alerts............: {stats[0]["down_alerts"]}')
-    mylog('verbose', f'[Scan Stats] New Down Alerts........: {stats[0]["new_down_alerts"]}')
-    mylog('verbose', f'[Scan Stats] New Connections........: {stats[0]["new_connections"]}')
-    mylog('verbose', f'[Scan Stats] Disconnections.........: {stats[0]["disconnections"]}')
-    mylog('verbose', f'[Scan Stats] IP Changes.............: {stats[0]["ip_changes"]}')
+            if nocase(device["dev_LastIP"]) != nocase(row["cur_IP"]):
+                self.ipChanged.append((row["cur_MAC"], row["cur_IP"], 'IP Changed', f'Previous IP: {device["dev_LastIP"]}', device["dev_AlertEvents"]))
+
+    #-------------------------------------------------------------------------------
+    # Events of the scan in the order they are logged
+    def getEvents(self):
+        return self.down + self.connected + self.disconnected + self.ipChanged
+
+#-------------------------------------------------------------------------------
+def nocase(value):
+    return str(value).lower() if value is not None else None
+
+#-------------------------------------------------------------------------------
+def print_scan_stats(db, presence):
+    sql = db.sql # TO-DO
+
+    mylog('verbose', f'[Scan Stats] Devices Detected.......: {presence.detected}')
+    mylog('verbose', f'[Scan Stats] New Devices............: {len(presence.newDevices)}')
+    mylog('verbose', f'[Scan Stats] Down Alerts............: {len(presence.downAlerts)}')
+    mylog('verbose', f'[Scan Stats] New Down Alerts........: {len(presence.down)}')
+    mylog('verbose', f'[Scan Stats] New Connections........: {len(presence.connected)}')
+    mylog('verbose', f'[Scan Stats] Disconnections.........: {len(presence.disconnections)}')
+    mylog('verbose', f'[Scan Stats] IP Changes.............: {len(presence.ipChanged)}')
 
-    # if str(stats[0]["new_devices"]) != '0':
     mylog('trace', f'   ================ DEVICES table content  ================')
     sql.execute('select * from Devices')
     rows = sql.fetchall()
@@ -159,9 +211,9 @@ def print_scan_stats(db):
         
 
     mylog('verbose', '[Scan Stats] Scan Method Statistics:')
-    for row in stats:
-        if row["cur_ScanMethod"] is not None:
-            mylog('verbose', f'    {row["cur_ScanMethod"]}: {row["scan_method_count"]}')
+    for scanMethod, count in presence.scanMethods.items():
+        if scanMethod is not None:
+            mylog('verbose', f'    {scanMethod}: {count}')
 
 
 #-------------------------------------------------------------------------------
@@ -186,105 +238,69 @@ def create_new_devices (db):
     
     sql.execute(query)
 
-    mylog('debug',f'[New Devices] Insert Connection into session table')
-
-    sql.execute (f"""INSERT INTO Sessions (ses_MAC, ses_IP, ses_EventTypeConnection, ses_DateTimeConnection,
-                        ses_EventTypeDisconnection, ses_DateTimeDisconnection, ses_StillConnected, ses_AdditionalInfo)
-                    SELECT cur_MAC, cur_IP,'Connected','{startTime}', NULL , NULL ,1, cur_Vendor
-                    FROM CurrentScan 
-                    WHERE NOT EXISTS (SELECT 1 FROM Sessions
-                                      WHERE ses_MAC = cur_MAC) 
-                    """)
-                    
     # Create new devices from CurrentScan
     mylog('debug','[New Devices] 2 Create devices')
 
-    # default New Device values preparation
-    newDevColumns =  """dev_AlertEvents, 
-                        dev_AlertDeviceDown, 
-                        dev_PresentLastScan, 
-                        dev_Archived, 
-                        dev_NewDevice, 
-                        dev_SkipRepeated, 
-                        dev_ScanCycle, 
-                        dev_Owner, 
-                        dev_Favorite, 
-                        dev_Group, 
-                        dev_Comments, 
-                        dev_LogEvents, 
-                        dev_Location"""
-
-    newDevDefaults = f"""{get_setting_value('NEWDEV_dev_AlertEvents')}, 
-                        {get_setting_value('NEWDEV_dev_AlertDeviceDown')}, 
-                        {get_setting_value('NEWDEV_dev_PresentLastScan')}, 
-                        {get_setting_value('NEWDEV_dev_Archived')}, 
-                        {get_setting_value('NEWDEV_dev_NewDevice')}, 
-                        {get_setting_value('NEWDEV_dev_SkipRepeated')}, 
-                        {get_setting_value('NEWDEV_dev_ScanCycle')}, 
-                        '{sanitize_SQL_input(get_setting_value('NEWDEV_dev_Owner'))}', 
-                        {get_setting_value('NEWDEV_dev_Favorite')}, 
-                        '{sanitize_SQL_input(get_setting_value('NEWDEV_dev_Group'))}', 
-                        '{sanitize_SQL_input(get_setting_value('NEWDEV_dev_Comments'))}', 
-                        {get_setting_value('NEWDEV_dev_LogEvents')}, 
-                        '{sanitize_SQL_input(get_setting_value('NEWDEV_dev_Location'))}'"""
-
-    # Fetch data from CurrentScan skipping ignored devices by IP and MAC
-    query = f"""SELECT cur_MAC, cur_Name, cur_Vendor, cur_IP, cur_SyncHubNodeName, cur_NetworkNodeMAC, cur_PORT, cur_NetworkSite, cur_SSID, cur_Type 
-                FROM CurrentScan """ 
+    # default New Device values, resolved once for all new devices
+    newDevColumns = ['dev_AlertEvents', 'dev_AlertDeviceDown', 'dev_PresentLastScan', 'dev_Archived', 'dev_NewDevice',
+                     'dev_SkipRepeated', 'dev_ScanCycle', 'dev_Owner', 'dev_Favorite', 'dev_Group', 'dev_Comments',
+                     'dev_LogEvents', 'dev_Location']
+
+    newDevDefaults = tuple(get_setting_value('NEWDEV_' + column) for column in newDevColumns)
+
+    defaultType        = get_setting_value('NEWDEV_dev_DeviceType')
+    defaultNetworkNode = get_setting_value('NEWDEV_dev_Network_Node_MAC_ADDR')
+    syncNodeName       = get_setting_value('SYNC_node_name')
+
+    # Fetch the devices from CurrentScan that are not in Devices yet
+    query = """SELECT cur_MAC, cur_Name, cur_Vendor, cur_IP, cur_SyncHubNodeName, cur_NetworkNodeMAC, cur_PORT, cur_NetworkSite, cur_SSID, cur_Type 
+               FROM CurrentScan
+               WHERE NOT EXISTS (SELECT 1 FROM Devices
+                                 WHERE dev_MAC = cur_MAC)"""
 
-    
     mylog('debug',f'[New Devices] Collecting New Devices Query: {query}')
     current_scan_data = sql.execute(query).fetchall()
 
+    newDevices = []
+
     for row in current_scan_data:
         cur_MAC, cur_Name, cur_Vendor, cur_IP, cur_SyncHubNodeName, cur_NetworkNodeMAC, cur_PORT, cur_NetworkSite, cur_SSID, cur_Type = row
 
         # Handle NoneType
         cur_Name = cur_Name.strip() if cur_Name else '(unknown)'
-        cur_Type = cur_Type.strip() if cur_Type else get_setting_value("NEWDEV_dev_DeviceType")
+        cur_Type = cur_Type.strip() if cur_Type else defaultType
         cur_NetworkNodeMAC = cur_NetworkNodeMAC.strip() if cur_NetworkNodeMAC else ''
-        cur_NetworkNodeMAC = cur_NetworkNodeMAC if cur_NetworkNodeMAC and cur_MAC != "Internet" else (get_setting_value("NEWDEV_dev_Network_Node_MAC_ADDR") if cur_MAC != "Internet" else "null")
-        cur_SyncHubNodeName = cur_SyncHubNodeName if cur_SyncHubNodeName and cur_SyncHubNodeName != "null" else (get_setting_value("SYNC_node_name"))
-
-        # Preparing the individual insert statement
-        sqlQuery = f"""INSERT OR IGNORE INTO Devices 
-                        (
-                            dev_MAC, 
-                            dev_name, 
-                            dev_Vendor,
-                            dev_LastIP, 
-                            dev_FirstConnection, 
-                            dev_LastConnection, 
-                            dev_SyncHubNodeName, 
-                            dev_GUID,
-                            dev_Network_Node_MAC_ADDR, 
-                            dev_Network_Node_port,
-                            dev_NetworkSite, 
-                            dev_SSID,
-                            dev_DeviceType,                          
-                            {newDevColumns}
-                        )
-                        VALUES 
-                        (
-                            '{sanitize_SQL_input(cur_MAC)}', 
-                            '{sanitize_SQL_input(cur_Name)}',
-                            '{sanitize_SQL_input(cur_Vendor)}', 
-                            '{sanitize_SQL_input(cur_IP)}', 
-                            ?, 
-                            ?, 
-                            '{sanitize_SQL_input(cur_SyncHubNodeName)}', 
-                            {sql_generateGuid},
-                            '{sanitize_SQL_input(cur_NetworkNodeMAC)}',
-                            '{sanitize_SQL_input(cur_PORT)}',
-                            '{sanitize_SQL_input(cur_NetworkSite)}', 
-                            '{sanitize_SQL_input(cur_SSID)}',
-                            '{sanitize_SQL_input(cur_Type)}', 
-                            {newDevDefaults}
-                        )"""
-
-        mylog('trace', f'[New Devices] Create device SQL: {sqlQuery}')
-
-        sql.execute(sqlQuery, (startTime, startTime))
+        cur_NetworkNodeMAC = cur_NetworkNodeMAC if cur_NetworkNodeMAC and cur_MAC != "Internet" else (defaultNetworkNode if cur_MAC != "Internet" else "null")
+        cur_SyncHubNodeName = cur_SyncHubNodeName if cur_SyncHubNodeName and cur_SyncHubNodeName != "null" else syncNodeName
+
+        newDevices.append((cur_MAC, cur_Name, cur_Vendor or '', cur_IP or '', startTime, startTime, cur_SyncHubNodeName or '',
+                           cur_NetworkNodeMAC or '', cur_PORT or '', cur_NetworkSite or '', cur_SSID or '', cur_Type or '') + newDevDefaults)
+
+    # one prepared statement and one transaction for all new devices
+    sqlQuery = f"""INSERT OR IGNORE INTO Devices 
+                    (
+                        dev_MAC, 
+                        dev_name, 
+                        dev_Vendor,
+                        dev_LastIP, 
+                        dev_FirstConnection, 
+                        dev_LastConnection, 
+                        dev_SyncHubNodeName, 
+                        dev_Network_Node_MAC_ADDR, 
+                        dev_Network_Node_port,
+                        dev_NetworkSite, 
+                        dev_SSID,
+                        dev_DeviceType,                          
+                        {', '.join(newDevColumns)},
+                        dev_GUID
+                    )
+                    VALUES ({', '.join(['?'] * (12 + len(newDevColumns)))}, {sql_generateGuid})"""
+
+    mylog('debug', f'[New Devices] Creating {len(newDevices)} devices')
+    mylog('trace', f'[New Devices] Create device SQL: {sqlQuery}')
+
+    with db.savepoint('create_new_devices'):
+        sql.executemany(sqlQuery, newDevices)
 
     
     mylog('debug','[New Devices] New Devices end')
@@ -296,146 +312,8 @@ def update_devices_data_from_scan (db):
     sql = db.sql #TO-DO    
     startTime = timeNowTZ().strftime('%Y-%m-%d %H:%M:%S')
 
-    # Update Last Connection
-    mylog('debug', '[Update Devices] 1 Last Connection')
-    sql.execute(f"""UPDATE Devices SET dev_LastConnection = '{startTime}',
-                        dev_PresentLastScan = 1
-                    WHERE dev_PresentLastScan = 0
-                      AND EXISTS (SELECT 1 FROM CurrentScan 
-                                  WHERE dev_MAC = cur_MAC) """)
-
-    # Clean no active devices
-    mylog('debug', '[Update Devices] 2 Clean no active devices')
-    sql.execute("""UPDATE Devices SET dev_PresentLastScan = 0
-                    WHERE NOT EXISTS (SELECT 1 FROM CurrentScan 
-                                      WHERE dev_MAC = cur_MAC) """)
-
-    # Update IP 
-    mylog('debug', '[Update Devices] - cur_IP -> dev_LastIP (always updated)')
-    sql.execute("""UPDATE Devices
-                    SET dev_LastIP = (SELECT cur_IP FROM CurrentScan
-                                      WHERE dev_MAC = cur_MAC)
-                    WHERE EXISTS (SELECT 1 FROM CurrentScan
-                                  WHERE dev_MAC = cur_MAC) """)
-
-    # Update only devices with empty or NULL vendors
-    mylog('debug', '[Update Devices] - cur_Vendor -> (if empty) dev_Vendor')
-    sql.execute("""UPDATE Devices
-                    SET dev_Vendor = (
-                        SELECT cur_Vendor
-                        FROM CurrentScan
-                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                    )
-                    WHERE 
-                        (dev_Vendor IS NULL OR dev_Vendor IN ("", "null"))
-                        AND EXISTS (
-                            SELECT 1
-                            FROM CurrentScan
-                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                        )""")
-
-    # Update only devices with empty or NULL dev_Network_Node_port 
-    mylog('debug', '[Update Devices] - (if not empty) cur_Port -> dev_Network_Node_port')
-    sql.execute("""UPDATE Devices
-                    SET dev_Network_Node_port = (
-                    SELECT cur_Port
-                    FROM CurrentScan        
-                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC          
-                )
-                WHERE EXISTS (
-                    SELECT 1
-                    FROM CurrentScan
-                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                      AND CurrentScan.cur_Port IS NOT NULL AND CurrentScan.cur_Port NOT IN ("", "null")
-                )""")
-
-    # Update only devices with empty or NULL dev_Network_Node_MAC_ADDR 
-    mylog('debug', '[Update Devices] - (if not empty) cur_NetworkNodeMAC -> dev_Network_Node_MAC_ADDR')
-    sql.execute("""UPDATE Devices
-                    SET dev_Network_Node_MAC_ADDR = (
-                    SELECT cur_NetworkNodeMAC
-                    FROM CurrentScan
-                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                )
-                WHERE EXISTS (
-                    SELECT 1
-                    FROM CurrentScan
-                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                        AND CurrentScan.cur_NetworkNodeMAC IS NOT NULL AND CurrentScan.cur_NetworkNodeMAC NOT IN ("", "null")
-                )""")
-
-    # Update only devices with empty or NULL dev_NetworkSite 
-    mylog('debug', '[Update Devices] - (if not empty) cur_NetworkSite -> (if empty) dev_NetworkSite')
-    sql.execute("""UPDATE Devices
-                    SET dev_NetworkSite = (
-                        SELECT cur_NetworkSite
-                        FROM CurrentScan
-                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                    )
-                    WHERE 
-                        (dev_NetworkSite IS NULL OR dev_NetworkSite IN ("", "null"))
-                        AND EXISTS (
-                            SELECT 1
-                            FROM CurrentScan
-                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                                AND CurrentScan.cur_NetworkSite IS NOT NULL AND CurrentScan.cur_NetworkSite NOT IN ("", "null")
-                )""")
-
-    # Update only devices with empty or NULL dev_SSID 
-    mylog('debug', '[Update Devices] - (if not empty) cur_SSID -> (if empty) dev_SSID')
-    sql.execute("""UPDATE Devices
-                    SET dev_SSID = (
-                        SELECT cur_SSID
-                        FROM CurrentScan
-                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                    )
-                    WHERE 
-                        (dev_SSID IS NULL OR dev_SSID IN ("", "null"))
-                        AND EXISTS (
-                            SELECT 1
-                            FROM CurrentScan
-                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                                AND CurrentScan.cur_SSID IS NOT NULL AND CurrentScan.cur_SSID NOT IN ("", "null")
-                        )""")
-
-    # Update only devices with empty or NULL dev_DeviceType
-    mylog('debug', '[Update Devices] - (if not empty) cur_Type -> (if empty) dev_DeviceType')
-    sql.execute("""UPDATE Devices
-                    SET dev_DeviceType = (
-                        SELECT cur_Type
-                        FROM CurrentScan
-                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                    )
-                    WHERE 
-                        (dev_DeviceType IS NULL OR dev_DeviceType IN ("", "null"))
-                        AND EXISTS (
-                            SELECT 1
-                            FROM CurrentScan
-                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
-                                AND CurrentScan.cur_Type IS NOT NULL AND CurrentScan.cur_Type NOT IN ("", "null")
-                        )""")
-
-    # Update (unknown) or (name not found) Names if available
-    mylog('debug','[Update Devices] - (if not empty) cur_Name -> (if empty) dev_NAME')
-    sql.execute ("""    UPDATE Devices
-                        SET dev_NAME = COALESCE((
-                            SELECT cur_Name 
-                            FROM CurrentScan
-                            WHERE cur_MAC = dev_MAC
-                            AND cur_Name IS NOT NULL
-                            AND cur_Name <> 'null'
-                            AND cur_Name <> ''
-                        ), dev_NAME)
-                        WHERE (dev_NAME IN ('(unknown)', '(name not found)', '') 
-                            OR dev_NAME IS NULL)
-                        AND EXISTS (
-                            SELECT 1 
-                            FROM CurrentScan
-                            WHERE cur_MAC = dev_MAC
-                            AND cur_Name IS NOT NULL
-                            AND cur_Name <> 'null'
-                            AND cur_Name <> ''
-                        ) """)
+    # Merge the scan results into the devices
+    update_devices_from_current_scan(db, startTime)
 
     # Update VENDORS
     recordsToUpdate = []
@@ -486,6 +364,58 @@ def update_devices_data_from_scan (db):
     
     mylog('debug','[Update Devices] Update devices end')
 
+#-------------------------------------------------------------------------------
+# Merges the CurrentScan rows into the Devices table in one pass over the devices:
+# - present devices: dev_PresentLastScan = 1 and dev_LastConnection (if they were absent), dev_LastIP,
+#   dev_Vendor (if empty), dev_Network_Node_port, dev_Network_Node_MAC_ADDR, dev_NetworkSite (if empty),
+#   dev_SSID (if empty), dev_DeviceType (if empty), dev_Name (if empty or unknown)
+# - absent devices: dev_PresentLastScan = 0
+# CurrentScan has one row per MAC, the rows of multiple plugins are merged on insert (see
+# database.current_scan_upsert).
+def update_devices_from_current_scan(db, startTime):
+    sql = db.sql
+
+    def isEmpty(column):
+        return f"({column} IS NULL OR {column} IN ('', 'null'))"
+
+    def valueOrNull(column):
+        return f"CASE WHEN {isEmpty(column)} THEN NULL ELSE {column} END"
+
+    scanResults = f"""
+        SELECT cur_MAC, cur_IP, cur_Vendor,
+            {valueOrNull('cur_PORT')} AS cur_PORT,
+            {valueOrNull('cur_NetworkNodeMAC')} AS cur_NetworkNodeMAC,
+            {valueOrNull('cur_NetworkSite')} AS cur_NetworkSite,
+            {valueOrNull('cur_SSID')} AS cur_SSID,
+            {valueOrNull('cur_Type')} AS cur_Type,
+            {valueOrNull('cur_Name')} AS cur_Name
+        FROM CurrentScan
+    """
+
+    mylog('debug', '[Update Devices] Merging the scan results into the devices')
+    sql.execute(f"""UPDATE Devices SET
+                        dev_LastConnection = CASE WHEN dev_PresentLastScan = 0 THEN ? ELSE dev_LastConnection END,
+                        dev_PresentLastScan = 1,
+                        dev_LastIP = cur_IP,
+                        dev_Vendor = CASE WHEN {isEmpty('dev_Vendor')} THEN cur_Vendor ELSE dev_Vendor END,
+                        dev_Network_Node_port = COALESCE(cur_PORT, dev_Network_Node_port),
+                        dev_Network_Node_MAC_ADDR = COALESCE(cur_NetworkNodeMAC, dev_Network_Node_MAC_ADDR),
+                        dev_NetworkSite = CASE WHEN {isEmpty('dev_NetworkSite')} THEN COALESCE(cur_NetworkSite, dev_NetworkSite) ELSE dev_NetworkSite END,
+                        dev_SSID = CASE WHEN {isEmpty('dev_SSID')} THEN COALESCE(cur_SSID, dev_SSID) ELSE dev_SSID END,
+                        dev_DeviceType = CASE WHEN {isEmpty('dev_DeviceType')} THEN COALESCE(cur_Type, dev_DeviceType) ELSE dev_DeviceType END,
+                        dev_Name = CASE WHEN dev_Name IS NULL OR dev_Name IN ('(unknown)', '(name not found)', '') THEN COALESCE(cur_Name, dev_Name) ELSE dev_Name END
+                    FROM ({scanResults}) AS scan
+                    WHERE dev_MAC = scan.cur_MAC""", (startTime,))
+
+    mylog('debug', [f'[Update Devices] Present devices updated: {sql.rowcount}'])
+
+    # Clean no active devices, only the devices which were present, so the triggers don't 
+    # generate app events for devices which didn't change. NOT IN looks up the MACs in
+    # a temporary index instead of scanning CurrentScan for every device.
+    sql.execute("""UPDATE Devices SET dev_PresentLastScan = 0
+                    WHERE dev_PresentLastScan IS NOT 0
+                      AND dev_MAC NOT IN (SELECT cur_MAC FROM CurrentScan) """)
+
 #-------------------------------------------------------------------------------
 def update_devices_names (db):
     sql = db.sql #TO-DO
@@ -498,7 +428,7 @@ def update_devices_names (db):
     ignored = 0
     notFound = 0
 
-    foundDig = 0
+    foundDns = 0
     foundmDNSLookup = 0
     foundNsLookup = 0
     foundNbtLookup = 0
@@ -524,34 +454,46 @@ def update_devices_names (db):
     # Number of entries from previous Pholus scans
     mylog('verbose', ['[Update Device Name] Pholus entries from prev scans: ', len(pholusResults)])
 
+    # index Pholus names by MAC and IP
+    pholusNames = pholus_names_class(pholusResults)
+
+    # get names discovered by the AVAHISCAN, NSLOOKUP and NBTSCAN plugins
+    pluginNames = plugin_device_names_class(db)
+
+    # reverse DNS lookups of all devices at once
+    dnsNames = reverseDnsResolver.resolve([(device['dev_MAC'], device['dev_LastIP']) for device in unknownDevices])
 
     for device in unknownDevices:
         newName = nameNotFound
         
-        # Resolve device name with DiG
-        newName = resolve_device_name_dig (device['dev_MAC'], device['dev_LastIP'])
+        # Resolve device name with reverse DNS
+        if device['dev_MAC'] in dnsNames:
+            newName = cleanDeviceName(dnsNames[device['dev_MAC']], True)
+
+            if newName == '':
+                newName = nameNotFound
         
         # count
         if newName != nameNotFound:
-            foundDig += 1
+            foundDns += 1
             
         # Resolve device name with AVAHISCAN plugin data
         if newName == nameNotFound:
-            newName = get_device_name_mdns(db, device['dev_MAC'], device['dev_LastIP'])
+            newName = pluginNames.get('AVAHISCAN', device['dev_MAC'], device['dev_LastIP'])
 
             if newName != nameNotFound:
                foundmDNSLookup += 1
 
         # Resolve device name with NSLOOKUP plugin data
         if newName == nameNotFound:
-            newName = get_device_name_nslookup(db, device['dev_MAC'], device['dev_LastIP'])
+            newName = pluginNames.get('NSLOOKUP', device['dev_MAC'], device['dev_LastIP'])
 
             if newName != nameNotFound:
                foundNsLookup += 1
                
-        # Resolve device name with NSLOOKUP plugin data
+        # Resolve device name with NBTSCAN plugin data
         if newName == nameNotFound:
-            newName = get_device_name_nbtlookup(db, device['dev_MAC'], device['dev_LastIP'])
+            newName = pluginNames.get('NBTSCAN', device['dev_MAC'], device['dev_LastIP'])
 
             if newName != nameNotFound:
                foundNbtLookup += 1
@@ -561,10 +503,10 @@ def update_devices_names (db):
         if newName == nameNotFound:
 
             # Try MAC matching
-            newName =  resolve_device_name_pholus (device['dev_MAC'], device['dev_LastIP'], pholusResults, nameNotFound, False)
+            newName =  pholusNames.get(device['dev_MAC'], device['dev_LastIP'], nameNotFound, False)
             # Try IP matching 
             if newName == nameNotFound:
-                newName =  resolve_device_name_pholus (device['dev_MAC'], device['dev_LastIP'], pholusResults, nameNotFound, True)
+                newName =  pholusNames.get(device['dev_MAC'], device['dev_LastIP'], nameNotFound, True)
 
             # count
             if newName != nameNotFound:
@@ -580,17 +522,18 @@ def update_devices_names (db):
             if device['dev_Name'] != nameNotFound:
                 recordsNotFound.append (["(name not found)", device['dev_MAC']])          
         else:
-            # name was found with DiG or Pholus
+            # name was found with DNS, plugins or Pholus
             recordsToUpdate.append ([newName, device['dev_MAC']])
 
     # Print log            
-    mylog('verbose', [f'[Update Device Name] Names Found (DiG/mDNS/NSLOOKUP/NBTSCAN/Pholus): {len(recordsToUpdate)} ({foundDig}/{foundmDNSLookup}/{foundNsLookup}/{foundNbtLookup}/{foundPholus})'] )                 
+    mylog('verbose', [f'[Update Device Name] Names Found (DNS/mDNS/NSLOOKUP/NBTSCAN/Pholus): {len(recordsToUpdate)} ({foundDns}/{foundmDNSLookup}/{foundNsLookup}/{foundNbtLookup}/{foundPholus})'] )                 
     mylog('verbose', [f'[Update Device Name] Names Not Found         : {notFound}'] )    
      
-    # update not found devices with (name not found) 
-    sql.executemany ("UPDATE Devices SET dev_Name = ? WHERE dev_MAC = ? ", recordsNotFound )
-    # update names of devices which we were bale to resolve
-    sql.executemany ("UPDATE Devices SET dev_Name = ? WHERE dev_MAC = ? ", recordsToUpdate )
+    with db.savepoint('update_devices_names'):
+        # update not found devices with (name not found) 
+        sql.executemany ("UPDATE Devices SET dev_Name = ? WHERE dev_MAC = ? ", recordsNotFound )
+        # update names of devices which we were bale to resolve
+        sql.executemany ("UPDATE Devices SET dev_Name = ? WHERE dev_MAC = ? ", recordsToUpdate )
     db.commitDB()
 
 #-------------------------------------------------------------------------------
@@ -611,44 +554,254 @@ def check_mac_or_internet(input_str):
 # Lookup unknown vendors on devices
 #===============================================================================
 
+#-------------------------------------------------------------------------------
+# Index of the IEEE vendors database (MAC prefix -> vendor). 
+# Prefixes are stored as integers in one dictionary per prefix length (6, 7 and 9 hex 
+# digits for MA-L, MA-M and MA-S assignments), so the longest prefix match is one 
+# dictionary lookup per prefix length. The index is loaded once and reloaded if the
+# vendors file changes. If a binary index file (see build_vendor_index_file) newer 
+# than the vendors file exists, it's memory-mapped instead of parsing the text file.
+class vendor_index_class:
+    def __init__(self):
+        self.sourcePath = None  # vendors text file the index was loaded from
+        self.modified = None    # modification time of the loaded file
+        self.prefixes = {}      # prefix length -> {prefix as int: vendor}
+        self.lengths = []       # prefix lengths, longest first
+        self.binary = None      # vendor_index_file_class if the binary index is used
+        self.invalidIndex = None    # modification time of an index that failed to load, not retried
+
+    #-------------------------------------------------------------------------------
+    # (Re)load the index if the vendors file changed
+    def refresh(self):
+
+        sourcePath = vendorsPathNewest if os.path.isfile(vendorsPathNewest) else vendorsPath
+
+        try:
+            sourceModified = os.path.getmtime(sourcePath)
+        except FileNotFoundError:
+            mylog('none', [f"[Vendor Check] ⚠ ERROR: Vendors file {sourcePath} not found."])
+            return False
+
+        # use the binary index if it was built from the current vendors file
+        indexModified = os.path.getmtime(vendorsPathIndex) if os.path.isfile(vendorsPathIndex) else None
+
+        if indexModified is not None and indexModified >= sourceModified and indexModified != self.invalidIndex:
+            if self.binary is not None and self.modified == indexModified:
+                return True
+
+            try:
+                binary = vendor_index_file_class(vendorsPathIndex)
+            except (OSError, ValueError) as e:
+                mylog('none', [f"[Vendor Check] ⚠ ERROR: Vendors index {vendorsPathIndex} could not be loaded: {e}"])
+                self.invalidIndex = indexModified
+            else:
+                self.close()
+                self.binary = binary
+                self.sourcePath = vendorsPathIndex
+                self.modified = indexModified
+
+                mylog('debug', [f"[Vendor Check] Loaded vendors index {vendorsPathIndex}"])
+                return True
+
+        if self.binary is None and self.sourcePath == sourcePath and self.modified == sourceModified:
+            return True
+
+        self.close()
+        self.prefixes = load_vendors_file(sourcePath)
+        self.lengths = sorted(self.prefixes.keys(), reverse=True)
+        self.sourcePath = sourcePath
+        self.modified = sourceModified
+
+        mylog('debug', [f"[Vendor Check] Loaded {sum(len(p) for p in self.prefixes.values())} vendors from {sourcePath}"])
+
+        return True
+
+    #-------------------------------------------------------------------------------
+    # Return the vendor for the longest matching prefix of mac (12 hex digits), None if not found
+    def lookup(self, mac):
+        if self.binary is not None:
+            return self.binary.lookup(mac)
+
+        for length in self.lengths:
+            vendor = self.prefixes[length].get(int(mac[:length], 16))
+
+            if vendor is not None:
+                return vendor
+
+        return None
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        if self.binary is not None:
+            self.binary.close()
+            self.binary = None
+
+        self.prefixes = {}
+        self.lengths = []
+
+vendorIndex = vendor_index_class()
+
+#-------------------------------------------------------------------------------
+# Parse a vendors file in the arp-scan format (<MAC-Prefix><TAB or space><Vendor>) 
+# into a dictionary per prefix length
+def load_vendors_file(filePath):
+    prefixes = {}
+
+    with open(filePath, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            # Blank lines and lines beginning with "#" are ignored
+            if line.startswith('#'):
+                continue
+
+            parts = line.split(None, 1)
+
+            if len(parts) != 2:
+                continue
+
+            prefix = parts[0]
+
+            if not 2 <= len(prefix) <= 12:
+                continue
+
+            try:
+                prefixInt = int(prefix, 16)
+            except ValueError:
+                continue
+
+            # keep the first entry if a prefix is listed multiple times
+            prefixes.setdefault(len(prefix), {}).setdefault(prefixInt, parts[1].strip())
+
+    return prefixes
+
+#-------------------------------------------------------------------------------
+# Binary vendors index file format, all integers little-endian:
+#   header : magic (8 bytes), records count (uint32), prefix lengths (uint16, bit n set if
+#            prefixes with n hex digits are indexed)
+#   records: sorted by key, key (uint64) = prefix length << 48 | prefix, 
+#            vendor offset (uint32) and vendor length (uint16) in the vendors blob
+#   vendors: UTF-8 encoded vendor names
+vendorIndexMagic        = b'NAXOUI02'
+vendorIndexHeader       = struct.Struct('<8sIH')
+vendorIndexRecord       = struct.Struct('<QIH')
+
+#-------------------------------------------------------------------------------
+# Build the binary vendors index from a vendors text file, written atomically
+def build_vendor_index_file(sourcePath, indexPath):
+
+    prefixes = load_vendors_file(sourcePath)
+
+    records = sorted(
+        ((length << 48) | prefixInt, vendor.encode('utf-8')[:0xFFFF])
+        for length, entries in prefixes.items()
+        for prefixInt, vendor in entries.items()
+    )
+
+    vendors = bytearray()
+    packed = bytearray()
+
+    for key, vendor in records:
+        packed += vendorIndexRecord.pack(key, len(vendors), len(vendor))
+        vendors += vendor
+
+    lengths = 0
+    for length in prefixes:
+        lengths |= 1 << length
+
+    tmpPath = indexPath + '.tmp'
+
+    with open(tmpPath, 'wb') as f:
+        f.write(vendorIndexHeader.pack(vendorIndexMagic, len(records), lengths))
+        f.write(packed)
+        f.write(vendors)
+
+    os.replace(tmpPath, indexPath)
+
+    mylog('verbose', [f"[Vendor Check] Built vendors index {indexPath} with {len(records)} entries"])
+
+    return len(records)
+
+#-------------------------------------------------------------------------------
+# Memory-mapped binary vendors index, looked up with a binary search per prefix length
+class vendor_index_file_class:
+    def __init__(self, indexPath):
+        with open(indexPath, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, lengths = vendorIndexHeader.unpack_from(self.map, 0)
+
+        if magic != vendorIndexMagic:
+            self.map.close()
+            raise ValueError('Invalid vendors index file')
+
+        self.recordsStart = vendorIndexHeader.size
+        self.vendorsStart = self.recordsStart + self.count * vendorIndexRecord.size
+
+        # prefix lengths present in the index, longest first
+        self.lengths = [length for length in range(12, 1, -1) if lengths & (1 << length)]
+
+    #-------------------------------------------------------------------------------
+    def record(self, i):
+        return vendorIndexRecord.unpack_from(self.map, self.recordsStart + i * vendorIndexRecord.size)
+
+    #-------------------------------------------------------------------------------
+    def find(self, key):
+        low, high = 0, self.count - 1
+
+        while low <= high:
+            middle = (low + high) // 2
+            recordKey, offset, length = self.record(middle)
+
+            if recordKey == key:
+                start = self.vendorsStart + offset
+                return self.map[start:start + length].decode('utf-8')
+            elif recordKey < key:
+                low = middle + 1
+            else:
+                high = middle - 1
+
+        return None
+
+    #-------------------------------------------------------------------------------
+    def lookup(self, mac):
+        for length in self.lengths:
+            vendor = self.find((length << 48) | int(mac[:length], 16))
+
+            if vendor is not None:
+                return vendor
+
+        return None
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        self.map.close()
+
 #-------------------------------------------------------------------------------
 def query_MAC_vendor (pMAC):
 
     pMACstr = str(pMAC)
 
-    filePath = vendorsPath
-    
-    if os.path.isfile(vendorsPathNewest):
-        filePath = vendorsPathNewest
-    
     # Check MAC parameter
     mac = pMACstr.replace (':','').lower()
     if len(pMACstr) != 17 or len(mac) != 12 :
         return -2 # return -2 if ignored MAC
 
     # Search vendor in HW Vendors DB
-    mac_start_string6 = mac[0:6]    
-    mac_start_string9 = mac[0:9]    
-
     try:
-        with open(filePath, 'r') as f:
-            for line in f:
-                line_lower = line.lower()  # Convert line to lowercase for case-insensitive matching
-                if line_lower.startswith(mac_start_string6):                 
-                    parts = line.split(' ', 1)
-                    if len(parts) > 1:
-                        vendor = parts[1].strip()
-                        mylog('debug', [f"[Vendor Check] Found '{vendor}' for '{pMAC}' in {vendorsPath}"])
-                        return vendor
-                    else:
-                        mylog('debug', [f'[Vendor Check] ⚠ ERROR: Match found, but line could not be processed: "{line_lower}"'])
-                        return -1
+        int(mac, 16)
+    except ValueError:
+        return -2 # return -2 if ignored MAC
+
+    if not vendorIndex.refresh():
+        return -1
 
+    vendor = vendorIndex.lookup(mac)
 
+    if vendor is None:
         return -1  # MAC address not found in the database
-    except FileNotFoundError:
-        mylog('none', [f"[Vendor Check] ⚠ ERROR: Vendors file {vendorsPath} not found."])
-        return -1
+
+    mylog('debug', [f"[Vendor Check] Found '{vendor}' for '{pMAC}' in {vendorIndex.sourcePath}"])
+
+    return vendor
 
 
 #===============================================================================
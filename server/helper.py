@@ -15,6 +15,8 @@ from pathlib import Path
 import requests
 import base64
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 import conf
@@ -273,58 +275,117 @@ def write_file(pPath, pText):
 # Setting methods
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
-#  Return whole setting touple
-def get_setting(key):
+# In-memory settings registry so setting lookups don't re-read table_settings.json.
+# The core process loads it from the imported settings (see importConfigs), 
+# every load increases the generation counter and clears the converted values.
+# Plugin subprocesses don't import the config, they use the read-through mode, 
+# which (re)loads table_settings.json only if the file modification time changed.
+class settings_cache_class:
+    def __init__(self, settingsFile):
+        self.settingsFile   = settingsFile
+        self.readThrough    = True  # read from settingsFile until loaded from the imported config
+        self.fileModified   = None  # modification time of the loaded settingsFile
+        self.generation     = 0     # increased every time the settings are (re)loaded
+        self.settings       = {}    # Code_Name -> setting dictionary (as in table_settings.json)
+        self.values         = {}    # Code_Name -> setting value converted to the python type
+
+    #-------------------------------------------------------------------------------
+    # Load the settings from the Settings table tuples (conf.mySettingsSQLsafe)
+    def load(self, settingsTuples):
+        columns = ["Code_Name", "Display_Name", "Description", "Type", "Options", "RegEx", "Value", "Group", "Events", "OverriddenByEnv"]
+
+        self.set({item[0]: dict(zip(columns, item)) for item in settingsTuples})
+        self.readThrough = False
+
+    #-------------------------------------------------------------------------------
+    def set(self, settings):
+        self.settings = settings
+        self.values = {}
+        self.generation += 1
+
+    #-------------------------------------------------------------------------------
+    # Reload the settings from the settingsFile if it changed since the last load
+    def refresh(self):
+        try:
+            fileModified = os.path.getmtime(self.settingsFile)
 
-    settingsFile = apiPath + 'table_settings.json'
+            if fileModified == self.fileModified:
+                return True
 
-    try:
-        with open(settingsFile, 'r') as json_file:
+            with open(self.settingsFile, 'r') as json_file:
+                data = json.load(json_file)
+
+            self.set({item.get("Code_Name"): item for item in data.get("data",[])})
+            self.fileModified = fileModified
 
-            data = json.load(json_file)
+            return True
 
-            for item in data.get("data",[]):
-                if item.get("Code_Name") == key:
-                    return item
+        except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+            # Handle the case when the file is not found, JSON decoding fails, or data is not in the expected format
+            mylog('none', [f'[Settings] ⚠ ERROR - JSONDecodeError or FileNotFoundError for file {self.settingsFile}'])                
 
-            mylog('debug', [f'[Settings] ⚠ ERROR - setting_missing - Setting not found for key: {key} in file {settingsFile}'])  
+            return False
 
+    #-------------------------------------------------------------------------------
+    #  Return whole setting dictionary
+    def get(self, key):
+        if self.readThrough and not self.refresh():
             return None
 
-    except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
-        # Handle the case when the file is not found, JSON decoding fails, or data is not in the expected format
-        mylog('none', [f'[Settings] ⚠ ERROR - JSONDecodeError or FileNotFoundError for file {settingsFile}'])                
+        setting = self.settings.get(key)
 
-        return None
+        if setting is None:
+            mylog('debug', [f'[Settings] ⚠ ERROR - setting_missing - Setting not found for key: {key} in file {self.settingsFile}'])  
 
+        return setting
 
+    #-------------------------------------------------------------------------------
+    #  Return setting value converted to the python type
+    def get_value(self, key):
+        if self.readThrough and not self.refresh():
+            return ''
 
-#-------------------------------------------------------------------------------
-# Settings
-#-------------------------------------------------------------------------------
+        if key not in self.values:
+            setting = self.get(key)
 
-#-------------------------------------------------------------------------------
-#  Return setting value
-def get_setting_value(key):
+            # Returns empty string if not set
+            value = ''
 
-    # Returns empty string if not set
-    value = ''
-    
-    setting = get_setting(key)
+            if setting is not None:
+                set_value = setting["Value"]  # Setting value (Value (upper case) = user overridden default_value)
+                set_type = setting["Type"]  # Setting type  # lower case "type" - default json value vs uppper-case "Type" (= from user defined settings)
 
-    if setting is not None:
+                value = setting_value_to_python_type(set_type, set_value)
 
-        # mylog('none', [f'[SETTINGS] setting json:{json.dumps(setting)}'])        
+            self.values[key] = value
 
-        set_type  = 'Error: Not handled'
-        set_value = 'Error: Not handled'
+        value = self.values[key]
 
-        set_value = setting["Value"]  # Setting value (Value (upper case) = user overridden default_value)
-        set_type = setting["Type"]  # Setting type  # lower case "type" - default json value vs uppper-case "Type" (= from user defined settings)
+        # callers get their own copy of lists and dictionaries
+        if isinstance(value, (list, dict)):
+            value = value.copy()
 
-        value = setting_value_to_python_type(set_type, set_value)
+        return value
 
-    return value
+settingsCache = settings_cache_class(apiPath + 'table_settings.json')
+
+#-------------------------------------------------------------------------------
+#  Return whole setting touple
+def get_setting(key):
+
+    return settingsCache.get(key)
+
+
+
+#-------------------------------------------------------------------------------
+# Settings
+#-------------------------------------------------------------------------------
+
+#-------------------------------------------------------------------------------
+#  Return setting value
+def get_setting_value(key):
+
+    return settingsCache.get_value(key)
 
 #-------------------------------------------------------------------------------
 #  Convert the setting value to the corresponding python type
@@ -515,262 +576,232 @@ def check_IP_format (pIP):
     return IP.group(0)
 
 #-------------------------------------------------------------------------------
-def get_device_name_mdns(db, pMAC, pIP):
-    
-    nameNotFound = "(name not found)"
+# Device names discovered by the name resolution plugins (AVAHISCAN, NSLOOKUP, NBTSCAN).
+# All name entries are loaded with one query and indexed by MAC (Object_PrimaryID) and 
+# IP (Object_SecondaryID) per plugin. The first entry in the table wins, as before.
+class plugin_device_names_class:
+    def __init__(self, db, plugins = ('AVAHISCAN', 'NSLOOKUP', 'NBTSCAN')):
+        self.byMAC = {plugin: {} for plugin in plugins}
+        self.byIP = {plugin: {} for plugin in plugins}
 
-    sql = db.sql
+        rows = db.sql.execute(sql_plugins_device_names.format(placeholders = ', '.join('?' * len(plugins))), plugins).fetchall()
 
-    name = nameNotFound
-    
-    #  get names from the AVAHISCAN plugin entries vased on MAC
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'AVAHISCAN' AND 
-            Object_PrimaryID = '{pMAC}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
+        for plugin, mac, ip, name in rows:
+            self.byMAC[plugin].setdefault(mac, name)
+            self.byIP[plugin].setdefault(ip, name)
 
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], False)
-
-        return name
-
-    #  get names from the AVAHISCAN plugin entries based on IP
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'AVAHISCAN' AND             
-            Object_SecondaryID = '{pIP}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
-
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], True)
+        mylog('debug', [f'[Plugin device names] Loaded {len(rows)} name entries'])
 
-        return name
+    #-------------------------------------------------------------------------------
+    # Name found by the plugin for the MAC, otherwise for the IP (tagged as IP match)
+    def get(self, plugin, pMAC, pIP):
 
-    return name
+        name = self.byMAC[plugin].get(pMAC)
 
-#-------------------------------------------------------------------------------
-def get_device_name_nslookup(db, pMAC, pIP):
-    
-    nameNotFound = "(name not found)"
+        if name is not None:
+            return cleanDeviceName(name, False)
 
-    sql = db.sql
+        name = self.byIP[plugin].get(pIP)
 
-    name = nameNotFound
-    
-    #  get names from the NSLOOKUP plugin entries vased on MAC
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'NSLOOKUP' AND 
-            Object_PrimaryID = '{pMAC}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
+        if name is not None:
+            return cleanDeviceName(name, True)
 
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], False)
-
-        return name
-
-    #  get names from the NSLOOKUP plugin entries based on IP
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'NSLOOKUP' AND             
-            Object_SecondaryID = '{pIP}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
+        return "(name not found)"
 
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], True)
 
-        return name
+#-------------------------------------------------------------------------------
+# Reverse DNS (PTR) name resolution for many devices at once. 
+# Queries run concurrently in a bounded thread pool using dns.resolver instead of a
+# dig subprocess per device. Found names are cached per IP for the TTL of the PTR 
+# record. Devices without a name are retried with an exponential backoff per MAC, 
+# so devices which never resolve are not queried on every scan.
+class reverse_dns_resolver_class:
+    def __init__(self, maxWorkers = 16, timeout = 2, minTTL = 300, maxTTL = 86400, backoffBase = 300, backoffMax = 86400):
+        self.maxWorkers = maxWorkers    # max number of concurrent PTR queries
+        self.timeout = timeout          # lifetime of a single query in seconds
+        self.minTTL = minTTL            # TTL bounds for caching found names in seconds
+        self.maxTTL = maxTTL
+        self.backoffBase = backoffBase  # first retry delay of not found names in seconds
+        self.backoffMax = backoffMax
+        self.found = {}                 # IP  -> (PTR name, expiry time)
+        self.notFound = {}              # MAC -> (failed attempts, next retry time)
+        self.resolver = None
+        self.lock = threading.Lock()
 
-    return name
+    #-------------------------------------------------------------------------------
+    # Resolve the names of a list of (MAC, IP) tuples, returns {MAC: name}. 
+    # Devices which were not resolved or are waiting for their next retry are omitted.
+    def resolve(self, devices):
+        now = time.monotonic()
+        results = {}
+        pending = {}
 
-#-------------------------------------------------------------------------------
-def get_device_name_nbtlookup(db, pMAC, pIP):
-    
-    nameNotFound = "(name not found)"
+        for mac, ip in devices:
+            cached = self.found.get(ip)
 
-    sql = db.sql
+            if cached is not None and cached[1] > now:
+                results[mac] = cached[0]
+                continue
 
-    name = nameNotFound
-    
-    #  get names from the NBTSCAN plugin entries vased on MAC
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'NBTSCAN' AND 
-            Object_PrimaryID = '{pMAC}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
+            failed = self.notFound.get(mac)
 
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], False)
-
-        return name
-
-    #  get names from the NSLOOKUP plugin entries based on IP
-    sql.execute(
-        f"""
-         SELECT Watched_Value2 FROM Plugins_Objects 
-         WHERE 
-            Plugin = 'NBTSCAN' AND             
-            Object_SecondaryID = '{pIP}'
-         """
-    )         
-    nameEntry = sql.fetchall() 
-    db.commitDB()
+            if failed is not None and failed[1] > now:
+                continue
 
-    if len(nameEntry) != 0:
-        name = cleanDeviceName(nameEntry[0][0], True)
+            pending.setdefault(ip, []).append(mac)
 
-        return name
+        if len(pending) > 0:
+            mylog('debug', [f'[Reverse DNS] Querying {len(pending)} IPs, {len(devices) - len(pending)} cached or backed off'])
 
-    return name
+            with ThreadPoolExecutor(max_workers = min(self.maxWorkers, len(pending))) as executor:
+                answers = executor.map(self.query, pending.keys())
 
+                for (ip, macs), answer in zip(pending.items(), answers):
+                    now = time.monotonic()
 
-#-------------------------------------------------------------------------------
-def resolve_device_name_dig (pMAC, pIP):
-    
-    nameNotFound = "(name not found)"
+                    if answer is None:
+                        for mac in macs:
+                            attempts = self.notFound.get(mac, (0, 0))[0] + 1
+                            delay = min(self.backoffBase * 2 ** (attempts - 1), self.backoffMax)
+                            self.notFound[mac] = (attempts, now + delay)
+                        continue
 
-    dig_args = ['dig', '+short', '-x', pIP]
+                    name, ttl = answer
+                    self.found[ip] = (name, now + min(max(ttl, self.minTTL), self.maxTTL))
 
-    # Execute command
-    try:
-        # try runnning a subprocess
-        newName = subprocess.check_output (dig_args, universal_newlines=True)
+                    for mac in macs:
+                        self.notFound.pop(mac, None)
+                        results[mac] = name
 
-        # Check returns
-        newName = newName.strip()
+        # drop expired names
+        self.found = {ip: cached for ip, cached in self.found.items() if cached[1] > now}
 
-        if len(newName) == 0 :
-            return nameNotFound
-            
-        # Cleanup
-        newName = cleanDeviceName(newName, True)
+        return results
 
-        if newName == "" or  len(newName) == 0 or newName == '-1' or newName == -1 or "communications error" in newName or 'malformed message packet' in newName : 
-            return nameNotFound
+    #-------------------------------------------------------------------------------
+    # Single PTR query, returns (name, TTL) or None
+    def query(self, ip):
+        with self.lock:
+            if self.resolver is None:
+                self.resolver = dns.resolver.Resolver()
 
-        # all checks passed
-        mylog('debug', [f'[resolve_device_name_dig] Found a new name: "{newName}"'])  
+        try:
+            answer = self.resolver.resolve(dns.reversename.from_address(ip), 'PTR', lifetime = self.timeout)
 
-        return newName
+            return str(answer[0].target), answer.rrset.ttl
 
-    except subprocess.CalledProcessError as e:
-        # An error occured, handle it
-        mylog('none', ['[resolve_device_name_dig] ⚠ ERROR: ', e.output])            
-        # newName = "Error - check logs"
-        return nameNotFound
+        except (dns.exception.DNSException, ValueError) as e:
+            mylog('trace', [f'[Reverse DNS] No name for {ip}: {e}'])
+            return None
 
+reverseDnsResolver = reverse_dns_resolver_class()
 
 #-------------------------------------------------------------------------------
 # DNS record (Pholus/Name resolution) cleanup methods
 #-------------------------------------------------------------------------------
 
 #-------------------------------------------------------------------------------
-# Disclaimer - I'm interfacing with a script I didn't write (pholus3.py) so it's possible I'm missing types of answers
-# it's also possible the pholus3.py script can be adjusted to provide a better output to interface with it
-# Hit me with a PR if you know how! :)
-def resolve_device_name_pholus (pMAC, pIP, allRes, nameNotFound, match_IP = False):
-    
-    pholusMatchesIndexes = []
+# Pholus "Answer" records indexed by MAC and IPv4 for device name resolution.
+# The name of every record is extracted once (see get_pholus_answer_name), the first 
+# record of a MAC or IP with a usable name is then the resolved name, same as when 
+# matching records were looked up by scanning all records for each device.
+class pholus_names_class:
+    def __init__(self, allRes):
+        self.byMAC = {}     # MAC  -> name
+        self.byIP = {}      # IPv4 -> name
 
-    result = nameNotFound
+        for result in allRes:
+            if result["Record_Type"] != "Answer" or '._googlezone' in result["Value"]:
+                continue
 
-    # Collect all Pholus entries  with matching MAC and of type Answer
-    index = 0
-    for result in allRes:
-        #  limiting entries used for name resolution to the ones containing the current IP (v4 only)
-        if ((match_IP and result["IP_v4_or_v6"] == pIP ) or ( result["MAC"] == pMAC )) and result["Record_Type"] == "Answer" and '._googlezone' not in result["Value"]:
-            # found entries with a matching MAC address, let's collect indexes             
-            pholusMatchesIndexes.append(index)
+            #  only entries with an IPv4 address are used for name resolution
+            if not checkIPV4(result['IP_v4_or_v6']):
+                continue
 
-        index += 1
+            name = get_pholus_answer_name(result["Value"])
 
-    # return if nothing found
-    if len(pholusMatchesIndexes) == 0:
-        return nameNotFound   
+            if name is None:
+                continue
 
-    # we have some entries let's try to select the most useful one
-    # Do I need to pre-order allRes to have the most valuable onse on the top?
+            self.byMAC.setdefault(result["MAC"], name)
+            self.byIP.setdefault(result['IP_v4_or_v6'], name)
 
-    for i in pholusMatchesIndexes:
-        if not checkIPV4(allRes[i]['IP_v4_or_v6']):
-            continue
+        mylog('debug', [f'[Pholus names] Indexed names of {len(self.byMAC)} MACs and {len(self.byIP)} IPs'])
 
-        value = allRes[i]["Value"]
+    #-------------------------------------------------------------------------------
+    # Name for the MAC, or for the IP if match_IP (tagged as IP match)
+    def get(self, pMAC, pIP, nameNotFound, match_IP = False):
 
-        # airplay matches contain a lot of information
-        # Matches for example:
-        # Brand Tv (50)._airplay._tcp.local. TXT Class:32769 "acl=0 deviceid=66:66:66:66:66:66 features=0x77777,0x38BCB46 rsf=0x3 fv=p20.T-FFFFFF-03.1 flags=0x204 model=XXXX manufacturer=Brand serialNumber=XXXXXXXXXXX protovers=1.1 srcvers=777.77.77 pi=FF:FF:FF:FF:FF:FF psi=00000000-0000-0000-0000-FFFFFFFFFF gid=00000000-0000-0000-0000-FFFFFFFFFF gcgl=0 pk=AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
-        if '._airplay._tcp.local. TXT Class:32769' in value:
-            return cleanDeviceName(value.split('._airplay._tcp.local. TXT Class:32769')[0], match_IP)
-        
-        # second best - contains airplay
-        # Matches for example:
-        # _airplay._tcp.local. PTR Class:IN "Brand Tv (50)._airplay._tcp.local."
-        if '_airplay._tcp.local. PTR Class:IN' in value and ('._googlecast') not in value:
-            return cleanDeviceName(value.split('"')[1], match_IP)    
-
-        # Contains PTR Class:32769
-        # Matches for example:
-        # 3.1.168.192.in-addr.arpa. PTR Class:32769 "MyPc.local."
-        if 'PTR Class:32769' in value:
-            return cleanDeviceName(value.split('"')[1], match_IP)
-
-        # Contains AAAA Class:IN
-        # Matches for example:
-        # DESKTOP-SOMEID.local. AAAA Class:IN "fe80::fe80:fe80:fe80:fe80"
-        if 'AAAA Class:IN' in value:
-            return cleanDeviceName(value.split('.local.')[0], match_IP)
-
-        # Contains _googlecast._tcp.local. PTR Class:IN
-        # Matches for example:
-        # _googlecast._tcp.local. PTR Class:IN "Nest-Audio-ff77ff77ff77ff77ff77ff77ff77ff77._googlecast._tcp.local."
-        if '_googlecast._tcp.local. PTR Class:IN' in value and ('Google-Cast-Group') not in value:
-            return cleanDeviceName(value.split('"')[1], match_IP)
-
-        # Contains A Class:32769
-        # Matches for example:
-        # Android.local. A Class:32769 "192.168.1.6"
-        if ' A Class:32769' in value:
-            return cleanDeviceName(value.split(' A Class:32769')[0], match_IP)
-
-        # Contains PTR Class:IN
-        # Matches for example:
-        # _esphomelib._tcp.local. PTR Class:IN "ceiling-light-1._esphomelib._tcp.local."
-        if 'PTR Class:IN' in value and len(value.split('"')) > 1:
-            return cleanDeviceName(value.split('"')[1], match_IP)
-
-    return nameNotFound
+        name = self.byMAC.get(pMAC)
+
+        if name is None and match_IP:
+            name = self.byIP.get(pIP)
+
+        if name is None:
+            return nameNotFound
+
+        return cleanDeviceName(name, match_IP)
+
+#-------------------------------------------------------------------------------
+# Returns the name contained in a Pholus answer, None if it doesn't contain a usable name.
+# The answer types are checked from the most to the least useful one.
+# Disclaimer - I'm interfacing with a script I didn't write (pholus3.py) so it's possible I'm missing types of answers
+# it's also possible the pholus3.py script can be adjusted to provide a better output to interface with it
+# Hit me with a PR if you know how! :)
+def get_pholus_answer_name(value):
+
+    quoted = value.split('"')
+
+    # airplay matches contain a lot of information
+    # Matches for example:
+    # Brand Tv (50)._airplay._tcp.local. TXT Class:32769 "acl=0 deviceid=66:66:66:66:66:66 features=0x77777,0x38BCB46 rsf=0x3 fv=p20.T-FFFFFF-03.1 flags=0x204 model=XXXX manufacturer=Brand serialNumber=XXXXXXXXXXX protovers=1.1 srcvers=777.77.77 pi=FF:FF:FF:FF:FF:FF psi=00000000-0000-0000-0000-FFFFFFFFFF gid=00000000-0000-0000-0000-FFFFFFFFFF gcgl=0 pk=AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+    if '._airplay._tcp.local. TXT Class:32769' in value:
+        return value.split('._airplay._tcp.local. TXT Class:32769')[0]
+    
+    # second best - contains airplay
+    # Matches for example:
+    # _airplay._tcp.local. PTR Class:IN "Brand Tv (50)._airplay._tcp.local."
+    if '_airplay._tcp.local. PTR Class:IN' in value and ('._googlecast') not in value and len(quoted) > 1:
+        return quoted[1]
+
+    # Contains PTR Class:32769
+    # Matches for example:
+    # 3.1.168.192.in-addr.arpa. PTR Class:32769 "MyPc.local."
+    if 'PTR Class:32769' in value and len(quoted) > 1:
+        return quoted[1]
+
+    # Contains AAAA Class:IN
+    # Matches for example:
+    # DESKTOP-SOMEID.local. AAAA Class:IN "fe80::fe80:fe80:fe80:fe80"
+    if 'AAAA Class:IN' in value:
+        return value.split('.local.')[0]
+
+    # Contains _googlecast._tcp.local. PTR Class:IN
+    # Matches for example:
+    # _googlecast._tcp.local. PTR Class:IN "Nest-Audio-ff77ff77ff77ff77ff77ff77ff77ff77._googlecast._tcp.local."
+    if '_googlecast._tcp.local. PTR Class:IN' in value and ('Google-Cast-Group') not in value and len(quoted) > 1:
+        return quoted[1]
+
+    # Contains A Class:32769
+    # Matches for example:
+    # Android.local. A Class:32769 "192.168.1.6"
+    if ' A Class:32769' in value:
+        return value.split(' A Class:32769')[0]
+
+    # Contains PTR Class:IN
+    # Matches for example:
+    # _esphomelib._tcp.local. PTR Class:IN "ceiling-light-1._esphomelib._tcp.local."
+    if 'PTR Class:IN' in value and len(quoted) > 1:
+        return quoted[1]
+
+    return None
     
     
 
 #-------------------------------------------------------------------------------
 import dns.resolver
+import dns.reversename
+import dns.exception
 
 def cleanDeviceName(str, match_IP):
 
@@ -1,8 +1,11 @@
 """ Colection of functions to support all logging for NetAlertX """
 import sys
+import os
 import io
 import datetime
 import threading
+import queue
+import atexit
 import time
 
 import conf
@@ -25,22 +28,37 @@ debugLevels =   [
                     ('none', 0), ('minimal', 1), ('verbose', 2), ('debug', 3), ('trace', 4)
                 ]
 
+debugLevelsMap = dict(debugLevels)
+
 currentLevel = 0
+currentLevelName = None
+
+#-------------------------------------------------------------------------------
+# Resolve the numeric log level once, called when the config is imported
+def setLogLevel(levelName):
+    global currentLevel, currentLevelName
+
+    currentLevel = debugLevelsMap.get(levelName, 0)
+    currentLevelName = levelName
 
+# default level until the config is imported (plugin scripts keep it)
+setLogLevel(conf.LOG_LEVEL)
+
+#-------------------------------------------------------------------------------
+# n can be a list of values to concatenate, a string or a callable returning either, 
+# a callable is only evaluated if the requested level is logged
 def mylog(requestedDebugLevel, n):
 
-    setLvl = 0  
-    reqLvl = 0  
+    if debugLevelsMap.get(requestedDebugLevel, 0) > currentLevel:
+        return
 
-    #  Get debug urgency/relative weight
-    for lvl in debugLevels:
-        if conf.LOG_LEVEL == lvl[0]:
-            setLvl = lvl[1]
-        if requestedDebugLevel == lvl[0]:
-            reqLvl = lvl[1]
+    if callable(n):
+        n = n()
 
-    if reqLvl <= setLvl:
-        file_print (*n)        
+    if isinstance(n, str):
+        n = [n]
+
+    file_print (*n)
 
 #-------------------------------------------------------------------------------
 def file_print (*args):
@@ -51,7 +69,117 @@ def file_print (*args):
         result += str(arg)        
     print(result)
  
-    append_to_file_with_timeout(logPath + "/app.log", result + '\n', 5)
+    logWriter.write(result + '\n')
+
+#-------------------------------------------------------------------------------
+# Background writer to append lines to a log file. 
+# One thread owns the file handle and writes queued lines in batches, so logging 
+# doesn't spawn a thread or open the file for every line.
+class log_writer_class:
+    def __init__(self, file_path, max_queue_size = 10000, batch_size = 500, timeout = 5):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.queue = queue.Queue(max_queue_size)
+        self.file = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    #-------------------------------------------------------------------------------
+    # Queue a line, blocks only if the queue is full
+    def write(self, data):
+        if self.closed:
+            append_to_file(self.file_path, data)
+            return
+
+        self.start()
+
+        try:
+            self.queue.put(data, timeout=self.timeout)
+        except queue.Full:
+            # Handle the timeout here, e.g., log an error
+            print("Appending to file timed out")
+
+    #-------------------------------------------------------------------------------
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='log_writer', daemon=True)
+                self.thread.start()
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            # collect everything else that is already waiting
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            lines = [line for line in batch if line is not None]
+
+            if lines:
+                self.write_batch(''.join(lines))
+
+            for _ in batch:
+                self.queue.task_done()
+
+            if stop:
+                break
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    #-------------------------------------------------------------------------------
+    def write_batch(self, data):
+        try:
+            # reopen if the file was deleted or replaced in the meantime
+            if self.file is not None:
+                try:
+                    if os.stat(self.file_path).st_ino != os.fstat(self.file.fileno()).st_ino:
+                        self.file.close()
+                        self.file = None
+                except FileNotFoundError:
+                    self.file.close()
+                    self.file = None
+
+            if self.file is None:
+                self.file = open(self.file_path, "a")
+
+            self.file.write(data)
+            self.file.flush()
+        except Exception as e:
+            print(f"Error appending to file: {e}")
+            self.file = None
+
+    #-------------------------------------------------------------------------------
+    # Wait until all queued lines are written
+    def flush(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    #-------------------------------------------------------------------------------
+    # Write all queued lines and stop the writer thread
+    def close(self):
+        self.closed = True
+
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(self.timeout)
+
+logWriter = log_writer_class(logPath + "/app.log")
+
+# write everything that is still queued when the process ends
+atexit.register(logWriter.close)
 
 #-------------------------------------------------------------------------------
 # Function to append to the file
@@ -68,25 +196,6 @@ def append_to_file(file_path, data):
     except Exception as e:
         print(f"Error appending to file: {e}")
 
-#-------------------------------------------------------------------------------
-# Function to append to the file with a timeout
-def append_to_file_with_timeout(file_path, data, timeout):
-    # Create a thread for appending to the file
-    append_thread = threading.Thread(target=append_to_file, args=(file_path, data))
-    
-    # Start the thread
-    append_thread.start()
-    
-    # Wait for the thread to complete or timeout
-    append_thread.join(timeout)
-    
-    # If the thread is still running, it has exceeded the timeout
-    if append_thread.is_alive():
-        append_thread.join()  # Optionally, you can force it to terminate
-        
-        # Handle the timeout here, e.g., log an error
-        print("Appending to file timed out")
-
 
 
 #-------------------------------------------------------------------------------
@@ -1,10 +1,13 @@
 
 
+import sqlite3
+
 import conf
 
 
-from device import create_new_devices, print_scan_stats, save_scanned_devices, update_devices_data_from_scan, exclude_ignored_devices
+from device import create_new_devices, print_scan_stats, save_scanned_devices, update_devices_data_from_scan, exclude_ignored_devices, presence_diff_class
 from helper import timeNowTZ
+from const import sql_insert_sessions, sql_sessions_columns
 from logger import mylog
 from reporting import skip_repeated_notifications
 
@@ -16,60 +19,89 @@ from reporting import skip_repeated_notifications
 
 def process_scan (db):
 
+    # The whole scan cycle is one transaction with a savepoint per stage (named stage_<stage>, 
+    # the functions of the stages use their own savepoints when called on their own): the frontend 
+    # sees the results of a complete cycle only, written with one WAL commit, and a failed stage
+    # rolls back the cycle.
+    # The write lock is held for the whole cycle, reads aren't blocked (WAL), but writes of the 
+    # frontend (e.g. editing a device) wait until the cycle is committed. The PHP connection has no
+    # busy timeout, its queries are retried by CustomDatabaseWrapper (front/php/server/db.php).
+    try:
+        with db.savepoint('process_scan'):
+            process_scan_stages(db)
+
+    except sqlite3.Error as e:
+        mylog('none', [f'[Process Scan] ⚠ ERROR processing the scan results, the scan cycle was rolled back: {e}'])
+
+        # don't process the same results again with the next scan
+        db.sql.execute ("DELETE FROM CurrentScan")
+
+#-------------------------------------------------------------------------------
+def process_scan_stages (db):
+
     # Apply exclusions
     mylog('verbose','[Process Scan]  Exclude ignored devices')     
-    exclude_ignored_devices (db)    
+    with db.savepoint('stage_exclude_ignored_devices'):
+        exclude_ignored_devices (db)    
 
     # Load current scan data
     mylog('verbose','[Process Scan]  Processing scan results')     
-    save_scanned_devices (db)    
-
-    db.commitDB()
+    with db.savepoint('stage_save_scanned_devices'):
+        save_scanned_devices (db)    
     
+    # Presence diff of the scan, for the stats and the events
+    presence = presence_diff_class(db)
+
     # Print stats
     mylog('none','[Process Scan] Print Stats')
-    print_scan_stats(db)
+    print_scan_stats(db, presence)
     mylog('none','[Process Scan] Stats end')
 
     # Create Events    
     mylog('verbose','[Process Scan] Sessions Events (connect / disconnect)')
-    insert_events(db)
+    with db.savepoint('stage_insert_events'):
+        insert_events(db, presence)
 
     # Create New Devices
     # after create events -> avoid 'connection' event
     mylog('verbose','[Process Scan] Creating new devices')
-    create_new_devices (db)
+    with db.savepoint('stage_create_new_devices'):
+        create_new_devices (db)
 
     # Update devices info
     mylog('verbose','[Process Scan] Updating Devices Info')
-    update_devices_data_from_scan (db)
+    with db.savepoint('stage_update_devices_data_from_scan'):
+        update_devices_data_from_scan (db)
 
     # Void false connection - disconnections
     mylog('verbose','[Process Scan] Voiding false (ghost) disconnections')    
-    void_ghost_disconnections (db)
+    with db.savepoint('stage_void_ghost_disconnections'):
+        void_ghost_disconnections (db)
 
     # Pair session events (Connection / Disconnection)
     mylog('verbose','[Process Scan] Pairing session events (connection / disconnection) ')
-    pair_sessions_events(db)  
+    with db.savepoint('stage_pair_sessions_events'):
+        pair_sessions_events(db)  
   
-    # Sessions snapshot
-    mylog('verbose','[Process Scan] Creating sessions snapshot')
-    create_sessions_snapshot (db)
+    # Sessions of the changed events
+    mylog('verbose','[Process Scan] Updating sessions')
+    with db.savepoint('stage_update_sessions'):
+        update_sessions (db)
 
     # Sessions snapshot
     mylog('verbose','[Process Scan] Inserting scan results into Online_History')
-    insertOnlineHistory(db)
+    with db.savepoint('stage_insertOnlineHistory'):
+        insertOnlineHistory(db)
   
     # Skip repeated notifications
     mylog('verbose','[Process Scan] Skipping repeated notifications')
-    skip_repeated_notifications (db)
+    with db.savepoint('stage_skip_repeated_notifications'):
+        skip_repeated_notifications (db)
 
     # Clear current scan as processed 
-    # 🐛 CurrentScan DEBUG: comment out below when debugging to keep the CurrentScan table after restarts/scan finishes
+    # (CurrentScan is a TEMP table of the backend's connection, see DB.createCurrentScan - it's not 
+    # visible to other DB connections and doesn't survive restarts, so it can't be kept for debugging)
     db.sql.execute ("DELETE FROM CurrentScan") 
-  
-    # Commit changes    
-    db.commitDB()
 
 #-------------------------------------------------------------------------------
 def void_ghost_disconnections (db):
@@ -130,22 +162,44 @@ def pair_sessions_events (db):
     sql = db.sql #TO-DO
    
 
-    # Pair Connection / New Device events
+    # Pair Connection / New Device events with the next session event of the device, in one
+    # window pass over the events of the devices with unpaired connections, starting at
+    # their oldest unpaired connection. Events at the same time can't be paired with each
+    # other, so the pairing candidates are the first events (lowest rowid) of each time.
     mylog('debug','[Pair Session] - 1 Connections / New Devices')
-    sql.execute ("""UPDATE Events
-                    SET eve_PairEventRowid =
-                       (SELECT ROWID
-                        FROM Events AS EVE2
-                        WHERE EVE2.eve_EventType IN ('New Device', 'Connected', 'Down Reconnected',
-                            'Device Down', 'Disconnected')
-                           AND EVE2.eve_MAC = Events.eve_MAC
-                           AND EVE2.eve_Datetime > Events.eve_DateTime
-                        ORDER BY EVE2.eve_DateTime ASC LIMIT 1)
-                    WHERE eve_EventType IN ('New Device', 'Connected', 'Down Reconnected')
-                    AND eve_PairEventRowid IS NULL
+    sql.execute ("""WITH Unpaired AS (
+                        SELECT eve_MAC, MIN(eve_DateTime) AS FirstDateTime
+                        FROM Events
+                        WHERE eve_EventType IN ('New Device', 'Connected', 'Down Reconnected')
+                          AND eve_PairEventRowid IS NULL
+                        GROUP BY eve_MAC
+                    ),
+                    SessionEvents AS (
+                        SELECT Events.rowid AS EventRowid, Events.eve_MAC, Events.eve_DateTime,
+                               Events.eve_EventType, Events.eve_PairEventRowid
+                        FROM Events JOIN Unpaired ON Events.eve_MAC = Unpaired.eve_MAC
+                        WHERE Events.eve_EventType IN ('New Device', 'Connected', 'Down Reconnected',
+                                                       'Device Down', 'Disconnected')
+                          AND Events.eve_DateTime >= Unpaired.FirstDateTime
+                    ),
+                    NextEvents AS (
+                        SELECT eve_MAC, eve_DateTime,
+                               LEAD(MIN(EventRowid)) OVER (PARTITION BY eve_MAC ORDER BY eve_DateTime) AS NextRowid
+                        FROM SessionEvents
+                        GROUP BY eve_MAC, eve_DateTime
+                    )
+                    UPDATE Events
+                    SET eve_PairEventRowid = NextEvents.NextRowid
+                    FROM SessionEvents JOIN NextEvents ON SessionEvents.eve_MAC = NextEvents.eve_MAC
+                                                      AND SessionEvents.eve_DateTime = NextEvents.eve_DateTime
+                    WHERE Events.rowid = SessionEvents.EventRowid
+                      AND SessionEvents.eve_EventType IN ('New Device', 'Connected', 'Down Reconnected')
+                      AND SessionEvents.eve_PairEventRowid IS NULL
+                      AND NextEvents.NextRowid IS NOT NULL
                  """ )
 
-    # Pair Disconnection / Device Down
+    # Pair Disconnection / Device Down (only the paired ones are written, unpaired
+    # disconnections accumulate over time)
     mylog('debug','[Pair Session] - 2 Disconnections')
     sql.execute ("""UPDATE Events
                     SET eve_PairEventRowid =
@@ -154,88 +208,108 @@ def pair_sessions_events (db):
                          WHERE EVE2.eve_PairEventRowid = Events.ROWID)
                     WHERE eve_EventType IN ('Device Down', 'Disconnected')
                       AND eve_PairEventRowid IS NULL
+                      AND EXISTS (SELECT 1 FROM Events AS EVE2
+                                  WHERE EVE2.eve_PairEventRowid = Events.ROWID)
                  """ )
     mylog('debug','[Pair Session] Pair session end')
 
     db.commitDB()
 
 #-------------------------------------------------------------------------------
-def create_sessions_snapshot (db):
-    sql = db.sql #TO-DO
+# Updates the Sessions rows of the events inserted, changed or deleted since the last
+# update (collected in Sessions_Changes by triggers on Events) instead of rebuilding the
+# whole table from the Convert_Events_to_Sessions view
+def update_sessions (db):
+    sql = db.sql
+
+    # connections paired with a changed event
+    mylog('debug','[Sessions] - 1 Paired events')
+    sql.execute ("""INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid)
+                    SELECT rowid FROM Events
+                    WHERE eve_PairEventRowid IN (SELECT Event_Rowid FROM Sessions_Changes)""")
+
+    # events at the same time as a changed event, which may have the same session (see sql_insert_sessions;
+    # for deleted duplicates the daily reconcile_sessions inserts the session of the remaining event)
+    sql.execute ("""INSERT OR IGNORE INTO Sessions_Changes (Event_Rowid)
+                    SELECT EVE.rowid FROM Events AS EVE
+                    JOIN Events AS CHG ON CHG.eve_MAC = EVE.eve_MAC AND CHG.eve_DateTime = EVE.eve_DateTime
+                    WHERE CHG.rowid IN (SELECT Event_Rowid FROM Sessions_Changes)""")
+
+    mylog('debug','[Sessions] - 2 Delete')
+    sql.execute ("""DELETE FROM Sessions
+                    WHERE ses_EventRowid IN (SELECT Event_Rowid FROM Sessions_Changes)""")
+
+    mylog('debug','[Sessions] - 3 Insert')
+    sql.execute (sql_insert_sessions.format(eventRowids = 'SELECT Event_Rowid FROM Sessions_Changes'))
+
+    sql.execute ("DELETE FROM Sessions_Changes")
+
+    mylog('debug','[Sessions] Sessions end')
+    db.commitDB()
 
-    # Clean sessions snapshot
-    mylog('debug','[Sessions Snapshot] - 1 Clean')
-    sql.execute ("DELETE FROM SESSIONS" )
+#-------------------------------------------------------------------------------
+# Rebuilds the Sessions table from all events
+def rebuild_sessions (db):
+    sql = db.sql
 
-    # Insert sessions
-    mylog('debug','[Sessions Snapshot] - 2 Insert')
-    sql.execute ("""INSERT INTO Sessions
-                    SELECT * FROM Convert_Events_to_Sessions""" )
+    sql.execute ("DELETE FROM Sessions")
+    sql.execute (sql_insert_sessions.format(eventRowids = 'SELECT rowid FROM Events'))
+    sql.execute ("DELETE FROM Sessions_Changes")
 
-    mylog('debug','[Sessions Snapshot] Sessions end')
     db.commitDB()
 
+#-------------------------------------------------------------------------------
+# Checks the incrementally maintained Sessions against the Convert_Events_to_Sessions
+# view and rebuilds them if they differ. Returns True if the sessions were in sync.
+def reconcile_sessions (db):
+
+    # apply the pending changes first
+    update_sessions(db)
+
+    missing = db.sql.execute (f"""SELECT COUNT(*) FROM (
+                                    SELECT * FROM Convert_Events_to_Sessions
+                                    EXCEPT SELECT {sql_sessions_columns} FROM Sessions)""").fetchone()[0]
+    extra = db.sql.execute (f"""SELECT COUNT(*) FROM (
+                                    SELECT {sql_sessions_columns} FROM Sessions
+                                    EXCEPT SELECT * FROM Convert_Events_to_Sessions)""").fetchone()[0]
+
+    # EXCEPT ignores duplicates, the view has none (UNION)
+    if missing == 0 and extra == 0:
+        extra = db.sql.execute ("SELECT COUNT(*) FROM Sessions").fetchone()[0] - \
+                db.sql.execute ("SELECT COUNT(*) FROM Convert_Events_to_Sessions").fetchone()[0]
+
+    if missing == 0 and extra == 0:
+        mylog('verbose', ['[Sessions] Sessions in sync with the events'])
+        return True
+
+    mylog('none', [f'[Sessions] ⚠ ERROR Sessions out of sync with the events ({missing} missing, {extra} extra), rebuilding'])
+    rebuild_sessions(db)
+
+    return False
+
 
 #-------------------------------------------------------------------------------
-def insert_events (db):
-    sql = db.sql #TO-DO
-    startTime = timeNowTZ()    
-    
-    # Check device down
-    mylog('debug','[Events] - 1 - Devices down')
-    sql.execute (f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime,
-                        eve_EventType, eve_AdditionalInfo,
-                        eve_PendingAlertEmail)
-                    SELECT dev_MAC, dev_LastIP, '{startTime}', 'Device Down', '', 1
-                    FROM Devices 
-                    WHERE dev_AlertDeviceDown != 0
-                      AND dev_PresentLastScan = 1                      
-                      AND NOT EXISTS (SELECT 1 FROM CurrentScan
-                                      WHERE dev_MAC = cur_MAC
-                                         ) """)
-
-    # Check new Connections or Down Reconnections
-    mylog('debug','[Events] - 2 - New Connections')
-    sql.execute (f"""    INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime,
-                                            eve_EventType, eve_AdditionalInfo,
-                                            eve_PendingAlertEmail)
-                        SELECT DISTINCT c.cur_MAC, c.cur_IP, '{startTime}', 
-                                        CASE 
-                                            WHEN last_event.eve_EventType = 'Device Down' and  last_event.eve_PendingAlertEmail = 0 THEN 'Down Reconnected' 
-                                            ELSE 'Connected' 
-                                        END,
-                                        '',
-                                        1
-                        FROM LatestEventsPerMAC AS d 
-                        JOIN CurrentScan AS c ON d.dev_MAC = c.cur_MAC
-                        LEFT JOIN LatestEventsPerMAC AS last_event ON d.dev_MAC = last_event.eve_MAC 
-                        WHERE d.dev_PresentLastScan = 0   
-                        """)
-
-    # Check disconnections
-    mylog('debug','[Events] - 3 - Disconnections')
-    sql.execute (f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime,
-                        eve_EventType, eve_AdditionalInfo,
-                        eve_PendingAlertEmail)
-                    SELECT dev_MAC, dev_LastIP, '{startTime}', 'Disconnected', '',
-                        dev_AlertEvents
-                    FROM Devices
-                    WHERE dev_AlertDeviceDown = 0
-                      AND dev_PresentLastScan = 1
-                      AND NOT EXISTS (SELECT 1 FROM CurrentScan
-                                      WHERE dev_MAC = cur_MAC
-                                         ) """)
-
-    # Check IP Changed
-    mylog('debug','[Events] - 4 - IP Changes')
-    sql.execute (f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime,
-                        eve_EventType, eve_AdditionalInfo,
-                        eve_PendingAlertEmail)
-                    SELECT cur_MAC, cur_IP, '{startTime}', 'IP Changed',
-                        'Previous IP: '|| dev_LastIP, dev_AlertEvents
-                    FROM Devices, CurrentScan
-                    WHERE dev_MAC = cur_MAC                        
-                      AND dev_LastIP <> cur_IP """ )
+# Inserts the Device Down, Connected / Down Reconnected, Disconnected and IP Changed
+# events of the scan (see device.presence_diff_class)
+def insert_events (db, presence = None):
+    startTime = timeNowTZ()
+
+    if presence is None:
+        presence = presence_diff_class(db)
+
+    events = presence.getEvents()
+
+    mylog('debug',f'[Events] Inserting {len(presence.down)} devices down, {len(presence.connected)} connections, '
+                  f'{len(presence.disconnected)} disconnections, {len(presence.ipChanged)} IP changes')
+
+    # one transaction for all rows (a savepoint also works within an open transaction)
+    with db.savepoint('insert_events'):
+        db.sql.executemany ("""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo,
+                                                   eve_PendingAlertEmail)
+                               VALUES (?, ?, ?, ?, ?, ?)""",
+                            [(mac, ip, str(startTime), eventType, additionalInfo, pendingAlert)
+                                for mac, ip, eventType, additionalInfo, pendingAlert in events])
+
     mylog('debug','[Events] - Events end')
     
     
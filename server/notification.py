@@ -10,7 +10,7 @@ from json2table import convert
 
 # Register NetAlertX modules 
 import conf
-from const import applicationPath, logPath, apiPath, confFileName, reportTemplatesPath
+from const import applicationPath, logPath, apiPath, confFileName, reportTemplatesPath, sql_notifications_new, sql_notifications_set_processed, sql_notifications_remove
 from logger import logResult, mylog, print_log
 from helper import generate_mac_links, removeDuplicateNewLines, timeNowTZ, get_file_content, write_file, get_setting_value, get_timezone_offset
 
@@ -214,29 +214,19 @@ class Notification_obj:
     # Remove notification object by GUID
     def remove(self, GUID):
         # Execute an SQL query to delete the notification with the specified GUID
-        self.db.sql.execute("""
-            DELETE FROM Notifications
-            WHERE GUID = ?
-        """, (GUID,))
+        self.db.sql.execute(sql_notifications_remove, (GUID,))
         self.save()
 
     # Get all with the "new" status
     def getNew(self):
-        self.db.sql.execute("""
-            SELECT * FROM Notifications
-            WHERE Status = "new"
-        """)
+        self.db.sql.execute(sql_notifications_new)
         return self.db.sql.fetchall()
 
     # Set all to "processed" status
     def setAllProcessed(self):
 
         # Execute an SQL query to update the status of all notifications
-        self.db.sql.execute("""
-            UPDATE Notifications
-            SET Status = "processed"
-            WHERE Status = "new"
-        """)
+        self.db.sql.execute(sql_notifications_set_processed)
 
         self.save()
 
@@ -6,15 +6,17 @@ import datetime
 import base64
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # Register NetAlertX modules
 import conf
-from const import pluginsPath, logPath, applicationPath, reportTemplatesPath
+from const import pluginsPath, logPath, applicationPath, reportTemplatesPath, sql_plugins_objects_plugin, sql_plugins_objects_update
 from logger import mylog
 from helper import timeNowTZ,  updateState, get_file_content, write_file, get_setting, get_setting_value
 from api import update_api
-from plugin_utils import logEventStatusCounts, get_plugin_string, get_plugin_setting_obj, print_plugin_info, list_to_csv, combine_plugin_objects, resolve_wildcards_arr, handle_empty, custom_plugin_decoder, decode_and_rename_files
+from plugin_utils import logEventStatusCounts, get_plugin_string, get_plugin_setting_obj, print_plugin_info, list_to_csv, diff_plugin_objects, resolve_wildcards_arr, handle_empty, custom_plugin_decoder, decode_and_rename_files
 from notification import Notification_obj, write_notification
+from database import current_scan_upsert
 
 
 #-------------------------------------------------------------------------------
@@ -110,6 +112,10 @@ def run_plugin_scripts(db, all_plugins, runType, pluginsState = plugins_state())
 
     mylog('debug', ['[Plugins] Check if any plugins need to be executed on run type: ', runType])
 
+    # plugins due to run, grouped by execution_order layer (all_plugins are sorted by layer),
+    # plugins without an execution_order run on their own as before
+    layers = []
+
     for plugin in all_plugins:
 
         shouldRun = False        
@@ -127,13 +133,25 @@ def run_plugin_scripts(db, all_plugins, runType, pluginsState = plugins_state())
                         # Check if schedule overdue
                         shouldRun = schd.runScheduleCheck()  
 
-        if shouldRun:            
-            # Header
-            updateState(f"Plugin: {prefix}")
-                        
-            print_plugin_info(plugin, ['display_name'])
-            mylog('debug', ['[Plugins] CMD: ', get_plugin_setting_obj(plugin, "CMD")["value"]])
-            pluginsState = execute_plugin(db, all_plugins, plugin, pluginsState) 
+        if shouldRun:
+            if len(layers) == 0 or not same_plugin_layer(layers[-1][0], plugin):
+                layers.append([])
+
+            layers[-1].append(plugin)
+
+    for layerPlugins in layers:
+
+        # Header
+        updateState(f"Plugin: {', '.join(plugin['unique_prefix'] for plugin in layerPlugins)}")
+
+        # run the script plugins of the layer concurrently
+        executed = run_plugin_layer(db, layerPlugins)
+
+        # process the results one plugin at a time, in the execution order
+        for plugin in layerPlugins:
+            prefix = plugin["unique_prefix"]
+
+            pluginsState = execute_plugin(db, all_plugins, plugin, pluginsState, prefix in executed) 
             #  update last run time
             if runType == "schedule":
                 for schd in conf.mySchedules:
@@ -143,12 +161,62 @@ def run_plugin_scripts(db, all_plugins, runType, pluginsState = plugins_state())
 
     return pluginsState
 
+#-------------------------------------------------------------------------------
+# Plugins only run concurrently if they declare the same explicit execution_order layer
+# (for all run types, see docs/PLUGINS_DEV.md)
+def same_plugin_layer(plugin, other):
+    order = plugin.get("execution_order", "Layer_N")
+
+    return order != "Layer_N" and other.get("execution_order", "Layer_N") == order
+
+#-------------------------------------------------------------------------------
+# Runs the commands of the script plugins of one execution_order layer concurrently,
+# at most PLUGINS_MAX_WORKERS at once. Plugins in the same layer don't depend on each other. 
+# The results are processed afterwards by execute_plugin, so only one plugin writes to the DB at a time.
+# Returns the prefixes of the executed plugins
+def run_plugin_layer(db, layerPlugins):
+
+    commands = {}
+
+    for plugin in layerPlugins:
+        set = get_plugin_setting_obj(plugin, "CMD")
 
+        print_plugin_info(plugin, ['display_name'])
+
+        if set != None:
+            mylog('debug', ['[Plugins] CMD: ', set["value"]])
+
+        if plugin['data_source'] == 'script' and set != None:
+            # parameters are resolved before starting the commands as they can query the DB
+            commands[plugin["unique_prefix"]] = (plugin,) + prepare_plugin_command(db, plugin, set["value"])
+
+    maxWorkers = max(1, int(get_setting_value('PLUGINS_MAX_WORKERS') or 4))
+
+    if len(commands) > 1 and maxWorkers > 1:
+        mylog('verbose', [f'[Plugins] Running {len(commands)} plugins concurrently: {", ".join(commands.keys())}'])
+
+        with ThreadPoolExecutor(max_workers = min(maxWorkers, len(commands))) as executor:
+            futures = {prefix: executor.submit(run_plugin_command, plugin, command, timeout)
+                       for prefix, (plugin, command, timeout) in commands.items()}
+
+        # errors not handled by run_plugin_command (e.g. a missing interpreter)
+        for prefix, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                mylog('none', [f'[Plugins] ⚠ ERROR - the plugin {prefix} could not be executed: {e}'])
+    else:
+        for plugin, command, timeout in commands.values():
+            run_plugin_command(plugin, command, timeout)
+
+    return list(commands.keys())
 
 
 #-------------------------------------------------------------------------------
 # Executes the plugin command specified in the setting with the function specified as CMD 
-def execute_plugin(db, all_plugins, plugin, pluginsState = plugins_state() ):
+# and processes its results. scriptExecuted is set if the command of a script plugin was 
+# already run (see run_plugin_layer) and only the results need to be processed.
+def execute_plugin(db, all_plugins, plugin, pluginsState = plugins_state(), scriptExecuted = False):
     sql = db.sql  
 
 
@@ -165,59 +233,15 @@ def execute_plugin(db, all_plugins, plugin, pluginsState = plugins_state() ):
 
     set_CMD = set["value"]
 
-    set = get_plugin_setting_obj(plugin, "RUN_TIMEOUT")
-
-    #  handle missing "function":"<unique_prefix>_TIMEOUT" setting
-    if set == None:   
-        set_RUN_TIMEOUT = 10
-    else:     
-        set_RUN_TIMEOUT = set["value"]         
-
-    #  Prepare custom params    
-    params = []
-
-    if "params" in plugin:
-        for param in plugin["params"]:     
-
-            tempParam = plugin_param(param, plugin, db)
-
-            if tempParam.resolved == None:
-                mylog('none', [f'[Plugins] The parameter "name":"{tempParam.name}" for "value": {tempParam.value} was resolved as None'])
-
-            else:
-                # params.append( [param["name"], resolved] )
-                params.append( [tempParam.name, tempParam.resolved] )
-
-                if tempParam.multiplyTimeout:
-                    
-                    set_RUN_TIMEOUT = set_RUN_TIMEOUT*tempParam.paramValuesCount
-
-                    mylog('debug', [f'[Plugins] The parameter "name":"{param["name"]}" will multiply the timeout {tempParam.paramValuesCount} times. Total timeout: {set_RUN_TIMEOUT}s'])
-    
-    mylog('debug', ['[Plugins] Timeout: ', set_RUN_TIMEOUT]) 
-    
     # build SQL query parameters to insert into the DB
     sqlParams = []
 
     # script 
     if plugin['data_source'] == 'script':
-        # ------- prepare params --------
-        # prepare command from plugin settings, custom parameters  
-        command = resolve_wildcards_arr(set_CMD.split(), params)        
-
-        # Execute command
-        mylog('verbose', ['[Plugins] Executing: ', set_CMD])
-        mylog('debug',   ['[Plugins] Resolved : ', command])        
 
-        try:
-            # try running a subprocess with a forced timeout in case the subprocess hangs
-            output = subprocess.check_output(command, universal_newlines=True, stderr=subprocess.STDOUT, timeout=(set_RUN_TIMEOUT))
-        except subprocess.CalledProcessError as e:
-            # An error occurred, handle it
-            mylog('none', [e.output])
-            mylog('none', ['[Plugins] ⚠ ERROR - enable LOG_LEVEL=debug and check logs'])            
-        except subprocess.TimeoutExpired as timeErr:
-            mylog('none', [f'[Plugins] ⚠ ERROR - TIMEOUT - the plugin {plugin["unique_prefix"]} forcefully terminated as timeout reached. Increase TIMEOUT setting and scan interval.']) 
+        if not scriptExecuted:
+            command, set_RUN_TIMEOUT = prepare_plugin_command(db, plugin, set_CMD)
+            run_plugin_command(plugin, command, set_RUN_TIMEOUT)
 
         # Initialize newLines
         newLines = []
@@ -459,6 +483,65 @@ def execute_plugin(db, all_plugins, plugin, pluginsState = plugins_state() ):
     return pluginsState
 
 
+#-------------------------------------------------------------------------------
+# Resolves the command of a script plugin and its timeout from the plugin settings and custom params
+def prepare_plugin_command(db, plugin, set_CMD):
+
+    set = get_plugin_setting_obj(plugin, "RUN_TIMEOUT")
+
+    #  handle missing "function":"<unique_prefix>_TIMEOUT" setting
+    if set == None:   
+        set_RUN_TIMEOUT = 10
+    else:     
+        set_RUN_TIMEOUT = set["value"]         
+
+    #  Prepare custom params    
+    params = []
+
+    if "params" in plugin:
+        for param in plugin["params"]:     
+
+            tempParam = plugin_param(param, plugin, db)
+
+            if tempParam.resolved == None:
+                mylog('none', [f'[Plugins] The parameter "name":"{tempParam.name}" for "value": {tempParam.value} was resolved as None'])
+
+            else:
+                # params.append( [param["name"], resolved] )
+                params.append( [tempParam.name, tempParam.resolved] )
+
+                if tempParam.multiplyTimeout:
+                    
+                    set_RUN_TIMEOUT = set_RUN_TIMEOUT*tempParam.paramValuesCount
+
+                    mylog('debug', [f'[Plugins] The parameter "name":"{param["name"]}" will multiply the timeout {tempParam.paramValuesCount} times. Total timeout: {set_RUN_TIMEOUT}s'])
+    
+    mylog('debug', ['[Plugins] Timeout: ', set_RUN_TIMEOUT]) 
+
+    # ------- prepare params --------
+    # prepare command from plugin settings, custom parameters  
+    command = resolve_wildcards_arr(set_CMD.split(), params)        
+
+    return command, set_RUN_TIMEOUT
+
+#-------------------------------------------------------------------------------
+# Runs the command of a script plugin, the results are written by the plugin into its last_result file
+def run_plugin_command(plugin, command, set_RUN_TIMEOUT):
+
+    # Execute command
+    mylog('verbose', ['[Plugins] Executing: ', get_plugin_setting_obj(plugin, "CMD")["value"]])
+    mylog('debug',   ['[Plugins] Resolved : ', command])        
+
+    try:
+        # try running a subprocess with a forced timeout in case the subprocess hangs
+        output = subprocess.check_output(command, universal_newlines=True, stderr=subprocess.STDOUT, timeout=(set_RUN_TIMEOUT))
+    except subprocess.CalledProcessError as e:
+        # An error occurred, handle it
+        mylog('none', [e.output])
+        mylog('none', ['[Plugins] ⚠ ERROR - enable LOG_LEVEL=debug and check logs'])            
+    except subprocess.TimeoutExpired as timeErr:
+        mylog('none', [f'[Plugins] ⚠ ERROR - TIMEOUT - the plugin {plugin["unique_prefix"]} forcefully terminated as timeout reached. Increase TIMEOUT setting and scan interval.']) 
+
 #-------------------------------------------------------------------------------
 # Check if watched values changed for the given plugin
 def process_plugin_events(db, plugin, pluginsState, plugEventsArr):    
@@ -480,7 +563,7 @@ def process_plugin_events(db, plugin, pluginsState, plugEventsArr):
             pluginEvents  = []
 
             #  Create plugin objects from existing database entries
-            plugObjectsArr = db.get_sql_array ("SELECT * FROM Plugins_Objects where Plugin = '" + str(pluginPref)+"'") 
+            plugObjectsArr = db.get_sql_array (sql_plugins_objects_plugin, (pluginPref,)) 
 
             for obj in plugObjectsArr: 
                 pluginObjects.append(plugin_object_class(plugin, obj))
@@ -494,66 +577,9 @@ def process_plugin_events(db, plugin, pluginsState, plugEventsArr):
             mylog('debug', ['[Plugins] Existing objects from Plugins_Objects: ', len(pluginObjects)])
             mylog('debug', ['[Plugins] Logged events from the plugin run    : ', len(pluginEvents)])
 
-            
-            #  Loop thru all current events and update the status to "exists" if the event matches an existing object
-            index = 0
-            for tmpObjFromEvent in pluginEvents:        
-
-                #  compare hash of the IDs for uniqueness
-                if any(x.idsHash == tmpObjFromEvent.idsHash for x in pluginObjects):                    
-            
-                    pluginEvents[index].status = "exists"            
-                index += 1
-
-
-            # Loop thru events and check if the ones that exist have changed in the watched columns
-            # if yes update status accordingly
-            index = 0
-            for tmpObjFromEvent in pluginEvents:  
-
-                if tmpObjFromEvent.status == "exists": 
-
-                    #  compare hash of the changed watched columns for uniqueness
-                    if any(x.watchedHash != tmpObjFromEvent.watchedHash for x in pluginObjects):
-                        pluginEvents[index].status = "watched-changed"                            
-                    else:
-                        pluginEvents[index].status = "watched-not-changed"  
-                index += 1
-
-            # Loop thru events and check if previously available objects are missing
-            for tmpObj in pluginObjects:
-                
-                isMissing = True
-
-                for tmpObjFromEvent in pluginEvents:
-                    if tmpObj.idsHash == tmpObjFromEvent.idsHash:
-                        isMissing = False
-
-                if isMissing:
-                    # if wasn't missing before, mark as changed
-                    if tmpObj.status != "missing-in-last-scan":
-                        tmpObj.changed = timeNowTZ().strftime('%Y-%m-%d %H:%M:%S')
-                        tmpObj.status = "missing-in-last-scan"                    
-                    # mylog('debug', [f'[Plugins] Missing from last scan (PrimaryID | SecondaryID): {tmpObj.primaryId} | {tmpObj.secondaryId}'])
-
-
-            # Merge existing plugin objects with newly discovered ones and update existing ones with new values
-            for tmpObjFromEvent in pluginEvents:
-                # set "new" status for new objects and append
-                if tmpObjFromEvent.status == 'not-processed':
-                    # This is a new object as it was not discovered as "exists" previously                    
-                    tmpObjFromEvent.status = 'new'
-
-                    pluginObjects.append(tmpObjFromEvent)
-                # update data of existing objects
-                else:
-                    index = 0
-                    for plugObj in pluginObjects:
-                        # find corresponding object for the event and merge
-                        if plugObj.idsHash == tmpObjFromEvent.idsHash:               
-                            pluginObjects[index] =  combine_plugin_objects(plugObj, tmpObjFromEvent)                    
-
-                        index += 1
+            # Classify events (new, watched-changed, watched-not-changed), detect objects 
+            # missing in the last scan and merge the events into the existing objects
+            pluginObjects, pluginEvents = diff_plugin_objects(pluginObjects, pluginEvents)
 
             # Update the DB
             # ----------------------------
@@ -617,15 +643,7 @@ def process_plugin_events(db, plugin, pluginsState, plugEventsArr):
 
             # Bulk update objects
             if objects_to_update:
-                sql.executemany(
-                    """
-                    UPDATE Plugins_Objects
-                    SET "Plugin" = ?, "Object_PrimaryID" = ?, "Object_SecondaryID" = ?, "DateTimeCreated" = ?, 
-                        "DateTimeChanged" = ?, "Watched_Value1" = ?, "Watched_Value2" = ?, "Watched_Value3" = ?, 
-                        "Watched_Value4" = ?, "Status" = ?, "Extra" = ?, "UserData" = ?, "ForeignKey" = ?, "SyncHubNodeName" = ?, "HelpVal1" = ?, "HelpVal2" = ?, "HelpVal3" = ?, "HelpVal4" = ?
-                    WHERE "Index" = ?
-                    """, objects_to_update
-                )
+                sql.executemany(sql_plugins_objects_update, objects_to_update)
 
             # Bulk insert events
             if events_to_insert:
@@ -749,6 +767,10 @@ def process_plugin_events(db, plugin, pluginsState, plugEventsArr):
         # Generate the SQL INSERT query using the collected information.
         q = f'INSERT into {dbTable} ({columnsStr}) VALUES ({valuesStr})'
 
+        # merge the rows of the MACs already reported by other plugins
+        if dbTable == 'CurrentScan':
+            q += current_scan_upsert([clmn['mapped_to_column'] for clmn in mappedCols])
+
         # Log a debug message showing the generated SQL query for mapping.
         mylog('debug', ['[Plugins] SQL query for mapping: ', q])
         mylog('debug', ['[Plugins] SQL sqlParams for mapping: ', sqlParams])
@@ -797,8 +819,8 @@ class plugin_object_class:
         if self.status not in ["exists", "watched-changed", "watched-not-changed", "new", "not-processed", "missing-in-last-scan"]:
             raise ValueError("Invalid status value for plugin object:", self.status)
 
-        self.idsHash      = str(hash(str(self.primaryId) + str(self.secondaryId)))    
-        # self.idsHash      = str(self.primaryId) + str(self.secondaryId)
+        # key used to match events with existing objects
+        self.idsHash      = (str(self.primaryId), str(self.secondaryId))
 
         self.watchedClmns = []
         self.watchedIndxs = []          
@@ -814,8 +836,8 @@ class plugin_object_class:
 
             for clmName in self.watchedClmns:
                 for mapping in indexNameColumnMapping:
-                    if clmName == indexNameColumnMapping[1]:
-                        self.watchedIndxs.append(indexNameColumnMapping[0])
+                    if clmName == mapping[1]:
+                        self.watchedIndxs.append(mapping[0])
 
         tmp = ''
         for indx in self.watchedIndxs:
@@ -866,9 +888,10 @@ def check_and_run_user_event(db, all_plugins, pluginsState):
         else:
             remaining_lines.append(line)
 
-    # Rewrite the log file with remaining lines
-    with open(logFile, "w") as file:
-        file.writelines(remaining_lines)
+    # Rewrite the log file with remaining lines, if any were processed
+    if len(remaining_lines) != len(lines):
+        with open(logFile, "w") as file:
+            file.writelines(remaining_lines)
 
     # Only show pop-up if not an API event
     if show_events_completed:
@@ -151,6 +151,60 @@ def combine_plugin_objects(old, new):
     return new
 
 
+#-------------------------------------------------------------------------------
+# Classify the events of a plugin run against the existing plugin objects and merge them.
+# Objects and events are indexed by (Object_PrimaryID, Object_SecondaryID), so the whole
+# diff is a single pass over each list instead of nested scans (O(objects + events)).
+# Returns the merged list of objects to be saved and the list of processed events.
+def diff_plugin_objects(pluginObjects, pluginEvents):
+
+    # index existing objects by their IDs, keep the first one if the DB contains duplicates
+    existing = {}
+    for plugObj in pluginObjects:
+        existing.setdefault(plugObj.idsHash, plugObj)
+
+    # index events by their IDs, the last reported event for the same IDs wins
+    events = {}
+    for plugEve in pluginEvents:
+        events[plugEve.idsHash] = plugEve
+
+    #  set the status of the events based on the matching existing object
+    for idsHash, plugEve in events.items():
+        plugObj = existing.get(idsHash)
+
+        if plugObj is None:
+            # This is a new object as it doesn't match any existing one
+            plugEve.status = 'new'
+        elif plugObj.watchedHash != plugEve.watchedHash:
+            plugEve.status = 'watched-changed'
+        else:
+            plugEve.status = 'watched-not-changed'
+
+    # Merge existing plugin objects with newly discovered ones and update existing ones with new values
+    mergedObjects = []
+    for plugObj in pluginObjects:
+        plugEve = events.get(plugObj.idsHash)
+
+        if plugEve is None:
+            # if wasn't missing before, mark as changed
+            if plugObj.status != "missing-in-last-scan":
+                plugObj.changed = timeNowTZ().strftime('%Y-%m-%d %H:%M:%S')
+                plugObj.status = "missing-in-last-scan"
+
+            mergedObjects.append(plugObj)
+
+        elif existing[plugObj.idsHash] is plugObj:
+            # update data of the existing object with the event values
+            mergedObjects.append(combine_plugin_objects(plugObj, plugEve))
+
+    # append new objects
+    for plugEve in events.values():
+        if plugEve.status == 'new':
+            mergedObjects.append(plugEve)
+
+    return mergedObjects, list(events.values())
+
+
 
 #-------------------------------------------------------------------------------
 # Replace {wildcars} with parameters
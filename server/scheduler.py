@@ -1,7 +1,14 @@
 """ class to manage schedules """
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
 import datetime
 
 from logger import mylog, print_log
+from helper import get_setting_value
 import conf
 
 #-------------------------------------------------------------------------------
@@ -41,3 +48,129 @@ class schedule_class:
             self.last_next_schedule = self.scheduleObject.next()            
 
         return result
+
+    # Time the schedule is due next
+    def nextRun(self):
+        return self.last_next_schedule
+
+
+#-------------------------------------------------------------------------------
+# Schedules of plugins set to run on schedule which became due after the last processing cycle
+def pending_schedules():
+    return [schd for schd in conf.mySchedules 
+            if schd.nextRun() > conf.last_scan_run and get_setting_value(schd.service + '_RUN') == 'schedule']
+
+#-------------------------------------------------------------------------------
+# Seconds until the main loop has to run next: the next 1 minute processing cycle 
+# or the earliest pending schedule, whatever comes first
+def seconds_to_next_run(nowTime):
+
+    nextRun = conf.last_scan_run + datetime.timedelta(minutes=1)
+
+    for schd in pending_schedules():
+        nextRun = min(nextRun, schd.nextRun())
+
+    # the loop checks if the time is past the due time, so wait a second longer
+    return max(0, (nextRun - nowTime).total_seconds() + 1)
+
+#-------------------------------------------------------------------------------
+# Checks if any schedule is due, without marking it as used
+def schedule_due(nowTime):
+    return any(nowTime > schd.nextRun() for schd in pending_schedules())
+
+
+#-------------------------------------------------------------------------------
+# Waits for changes of files used to trigger the main loop (e.g. the config file and 
+# the execution queue of the frontend) or a timeout, whatever comes first. 
+# Uses inotify watches of the parent folders (files can be replaced when saved),
+# falls back to checking the modification times every second if inotify is not available.
+class file_watcher_class:
+
+    IN_CLOSE_WRITE  = 0x00000008
+    IN_MOVED_TO     = 0x00000080
+    IN_CREATE       = 0x00000100
+    eventHeader     = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.names = set(os.path.basename(path) for path in paths)
+        self.fd = None
+        self.modified = self.getModified()
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+            for folder in set(os.path.dirname(path) for path in paths):
+                if libc.inotify_add_watch(fd, folder.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE) < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {folder}')
+
+            self.fd = fd
+
+        except (OSError, AttributeError) as e:
+            mylog('verbose', [f'[Scheduler] inotify not available, checking files every second: {e}'])
+
+    #-------------------------------------------------------------------------------
+    def getModified(self):
+        modified = []
+
+        for path in self.paths:
+            try:
+                modified.append(os.path.getmtime(path))
+            except OSError:
+                modified.append(None)
+
+        return modified
+
+    #-------------------------------------------------------------------------------
+    # Returns True if a watched file changed, False if the timeout was reached
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                return False
+
+            if self.fd is None:
+                time.sleep(min(1, remaining))
+
+                modified = self.getModified()
+                if modified != self.modified:
+                    self.modified = modified
+                    return True
+
+                continue
+
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+
+            if ready and self.readEvents():
+                return True
+
+    #-------------------------------------------------------------------------------
+    # Reads the pending inotify events, returns True if any is for a watched file
+    def readEvents(self):
+        changed = False
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+
+        offset = 0
+        while offset + self.eventHeader.size <= len(data):
+            wd, mask, cookie, length = self.eventHeader.unpack_from(data, offset)
+            offset += self.eventHeader.size
+
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+
+            if name in self.names:
+                changed = True
+
+        return changed
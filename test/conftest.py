@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+
+# -------------------------------------------------------------------------------
+# Benchmarks compare wall-clock times and build large DBs, they only run if RUN_BENCHMARKS is set:
+#   RUN_BENCHMARKS=1 python -m pytest -s -m benchmark
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: timing benchmark, skipped unless RUN_BENCHMARKS is set')
+
+# -------------------------------------------------------------------------------
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get('RUN_BENCHMARKS'):
+        return
+
+    skip = pytest.mark.skip(reason = 'benchmark, set RUN_BENCHMARKS=1 to run')
+
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
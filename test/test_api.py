@@ -0,0 +1,305 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import os
+import json
+import hashlib
+import time
+import shutil
+import sqlite3
+
+import pytest
+
+import api
+import database
+from database import DB
+from api import update_api, write_json_stream
+from const import sql_devices_all, sql_settings, sql_plugins_objects, sql_appevents, sql_language_strings
+
+
+legacyDbPath = str(pathlib.Path(__file__).parent.parent.resolve()) + "/back/app.db"
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # legacy DB migrated to the latest schema
+    path = str(tmp_path / 'app.db')
+    shutil.copyfile(legacyDbPath, path)
+
+    monkeypatch.setattr(database, 'fullDbPath', path)
+
+    db = DB()
+    db.open()
+    db.upgradeDB()
+
+    yield db
+
+    db.sql_connection.close()
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def apiFolder(tmp_path, monkeypatch):
+    # endpoints written into a temporary folder, no state of previous updates
+    folder = tmp_path / 'api'
+    folder.mkdir()
+
+    monkeypatch.setattr(api, 'apiPath', str(folder) + '/')
+    monkeypatch.setattr(api, 'apiEndpoints', [])
+    monkeypatch.setattr(api, 'pluginShards', {})
+    monkeypatch.setattr(api, 'pluginManifests', {})
+
+    return folder
+
+# -------------------------------------------------------------------------------
+# Counts the queries of the endpoints
+@pytest.fixture
+def queries(db, monkeypatch):
+    executed = []
+    iter_table_as_json = db.iter_table_as_json
+
+    def counting_iter_table_as_json(sqlQuery, *args, **kwargs):
+        executed.append(sqlQuery)
+        return iter_table_as_json(sqlQuery, *args, **kwargs)
+
+    monkeypatch.setattr(db, 'iter_table_as_json', counting_iter_table_as_json)
+
+    return executed
+
+# -------------------------------------------------------------------------------
+def read_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+# -------------------------------------------------------------------------------
+def insert_device(db, mac):
+    db.sql.execute("""INSERT INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection)
+                      VALUES (?, 'Test', '192.168.1.10', '2024-01-01 00:00:00', '2024-01-01 00:00:00')""", (mac,))
+
+
+# -------------------------------------------------------------------------------
+def test_unchanged_endpoints_are_skipped(db, apiFolder, queries):
+    devicesPath = str(apiFolder / 'table_devices.json')
+
+    update_api(db, [], updateOnlyDataSources = ['devices', 'online_history'])
+
+    assert len(queries) == 2
+    devices = read_json(devicesPath)["data"]
+
+    # no changes - not re-queried and not rewritten
+    modified = os.stat(devicesPath).st_mtime_ns
+    queries.clear()
+
+    update_api(db, [], updateOnlyDataSources = ['devices', 'online_history'])
+
+    assert queries == []
+    assert os.stat(devicesPath).st_mtime_ns == modified
+
+    # a changed device - only the devices endpoint is re-queried and rewritten
+    insert_device(db, 'aa:bb:cc:dd:ee:01')
+
+    update_api(db, [], updateOnlyDataSources = ['devices', 'online_history'])
+
+    assert len(queries) == 1
+    assert [device["dev_MAC"] for device in read_json(devicesPath)["data"]] == [device["dev_MAC"] for device in devices] + ['aa:bb:cc:dd:ee:01']
+
+    # a deleted endpoint file is written again
+    os.remove(devicesPath)
+    queries.clear()
+
+    update_api(db, [], updateOnlyDataSources = ['devices'])
+
+    assert len(queries) == 1
+    assert len(read_json(devicesPath)["data"]) == len(devices) + 1
+
+
+# -------------------------------------------------------------------------------
+def test_custom_endpoint_is_always_queried(db, apiFolder, queries, monkeypatch):
+    monkeypatch.setattr(api.conf, 'API_CUSTOM_SQL', 'SELECT dev_MAC FROM Devices')
+
+    for _ in range(2):
+        update_api(db, [], updateOnlyDataSources = ['custom_endpoint'])
+
+    # source tables unknown
+    assert queries == ['SELECT dev_MAC FROM Devices'] * 2
+
+
+# -------------------------------------------------------------------------------
+def test_streamed_json_matches_json_dumps(db, tmp_path):
+    path = str(tmp_path / 'table.json')
+
+    insert_device(db, 'aa:bb:cc:dd:ee:01')
+    db.sql.execute("UPDATE Devices SET dev_Comments = 'Ünïcode \"quoted\"\n' WHERE dev_MAC = 'aa:bb:cc:dd:ee:01'")
+
+    # AppEvents is empty
+    for query in [sql_devices_all, sql_settings, sql_plugins_objects, sql_appevents, sql_language_strings]:
+        write_json_stream(path, db.iter_table_as_json(query))
+
+        with open(path, 'rb') as file:
+            assert file.read() == json.dumps(db.get_table_as_json(query).json).encode('utf-8')
+
+# -------------------------------------------------------------------------------
+def test_failed_stream_keeps_previous_file(tmp_path):
+    path = str(tmp_path / 'table.json')
+
+    previousHash = write_json_stream(path, ['{"data": []}'])
+
+    def failing_chunks():
+        yield '{"data": ['
+        raise sqlite3.OperationalError('database is locked')
+
+    assert write_json_stream(path, failing_chunks(), previousHash) is None
+
+    with open(path) as file:
+        assert file.read() == '{"data": []}'
+
+    assert os.listdir(tmp_path) == ['table.json']
+
+
+# -------------------------------------------------------------------------------
+def test_failed_endpoint_is_retried(db, apiFolder, monkeypatch):
+    devicesPath = str(apiFolder / 'table_devices.json')
+
+    update_api(db, [], updateOnlyDataSources = ['devices'])
+    devices = read_json(devicesPath)["data"]
+
+    # reading the changed devices fails, the previous file is kept
+    insert_device(db, 'aa:bb:cc:dd:ee:01')
+    iter_table_as_json = db.iter_table_as_json
+
+    def failing_iter_table_as_json(sqlQuery, *args, **kwargs):
+        yield '{"data": ['
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(db, 'iter_table_as_json', failing_iter_table_as_json)
+    update_api(db, [], updateOnlyDataSources = ['devices'])
+
+    assert read_json(devicesPath)["data"] == devices
+    assert not os.path.exists(devicesPath + '.tmp')
+
+    # the next update writes the endpoint, no further changes needed
+    monkeypatch.setattr(db, 'iter_table_as_json', iter_table_as_json)
+    update_api(db, [], updateOnlyDataSources = ['devices'])
+
+    assert len(read_json(devicesPath)["data"]) == len(devices) + 1
+
+
+# -------------------------------------------------------------------------------
+def insert_plugin_objects(db, plugin, count, value = ''):
+    db.sql.executemany("""INSERT INTO Plugins_Objects (Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged, Watched_Value1, Watched_Value2, Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey)
+                          VALUES (?, ?, '', '2024-01-01 00:00:00', '2024-01-01 00:00:00', ?, '', '', '', 'watched-not-changed', '', '', '')""",
+                       [(plugin, str(i), value) for i in range(count)])
+
+# -------------------------------------------------------------------------------
+def test_plugin_shards(db, apiFolder):
+    shardsFolder = apiFolder / 'plugins_objects'
+    pageSize = api.pluginShardsPageSize
+
+    db.sql.execute("DELETE FROM Plugins_Objects")
+    insert_plugin_objects(db, 'PLUGA', 2 * pageSize + 1)
+    insert_plugin_objects(db, 'PLUGB', 3)
+
+    api.update_plugin_shards(db, 'plugins_objects', api.sql_plugins_objects_plugin, 'Plugins_Objects', db.get_table_changes(), str(shardsFolder) + '/')
+
+    manifest = read_json(shardsFolder / 'manifest.json')
+
+    assert manifest["pageSize"] == pageSize
+    assert manifest["count"] == 2 * pageSize + 4
+    assert sorted(manifest["plugins"]) == ['PLUGA', 'PLUGB']
+    assert sorted(os.listdir(shardsFolder)) == ['PLUGA.json', 'PLUGA_page_1.json', 'PLUGA_page_2.json', 'PLUGA_page_3.json', 'PLUGB.json', 'PLUGB_page_1.json', 'manifest.json']
+
+    # shard, pages and manifest entries match the table
+    rows = [row["Object_PrimaryID"] for row in db.get_table_as_json(api.sql_plugins_objects_plugin.replace('?', "'PLUGA'")).json["data"]]
+    entry = manifest["plugins"]["PLUGA"]
+
+    assert [row["Object_PrimaryID"] for row in read_json(shardsFolder / 'PLUGA.json')["data"]] == rows
+    assert [row["Object_PrimaryID"] for page in entry["pages"] for row in read_json(shardsFolder / page["file"])["data"]] == rows
+    assert [page["count"] for page in entry["pages"]] == [pageSize, pageSize, 1]
+    assert entry["file"] == 'PLUGA.json' and entry["count"] == len(rows)
+
+    for fileEntry in [entry] + entry["pages"]:
+        with open(shardsFolder / fileEntry["file"], 'rb') as file:
+            assert fileEntry["hash"] == hashlib.sha256(file.read()).hexdigest()
+
+    # only the changed plugin is rewritten, fewer rows remove the last page
+    modified = os.stat(shardsFolder / 'PLUGB.json').st_mtime_ns
+    db.sql.execute("DELETE FROM Plugins_Objects WHERE Plugin = 'PLUGA' AND CAST(Object_PrimaryID AS INTEGER) >= ?", (pageSize,))
+
+    api.update_plugin_shards(db, 'plugins_objects', api.sql_plugins_objects_plugin, 'Plugins_Objects', db.get_table_changes(), str(shardsFolder) + '/')
+
+    manifest = read_json(shardsFolder / 'manifest.json')
+
+    assert manifest["count"] == pageSize + 3
+    assert [page["file"] for page in manifest["plugins"]["PLUGA"]["pages"]] == ['PLUGA_page_1.json']
+    assert not os.path.exists(shardsFolder / 'PLUGA_page_2.json')
+    assert os.stat(shardsFolder / 'PLUGB.json').st_mtime_ns == modified
+
+    # plugins without rows are pruned
+    db.sql.execute("DELETE FROM Plugins_Objects WHERE Plugin = 'PLUGB'")
+
+    api.update_plugin_shards(db, 'plugins_objects', api.sql_plugins_objects_plugin, 'Plugins_Objects', db.get_table_changes(), str(shardsFolder) + '/')
+
+    manifest = read_json(shardsFolder / 'manifest.json')
+
+    assert sorted(manifest["plugins"]) == ['PLUGA']
+    assert sorted(os.listdir(shardsFolder)) == ['PLUGA.json', 'PLUGA_page_1.json', 'manifest.json']
+    assert ('plugins_objects', 'PLUGB') in api.pluginShards
+
+# -------------------------------------------------------------------------------
+def test_plugin_shards_of_previous_runs_are_pruned(db, apiFolder):
+    shardsFolder = apiFolder / 'plugins_objects'
+    shardsFolder.mkdir()
+
+    # files of a plugin removed while the app wasn't running
+    for fileName in ['OLDPLUGIN.json', 'OLDPLUGIN_page_1.json']:
+        (shardsFolder / fileName).write_text('{"data": []}')
+
+    db.sql.execute("DELETE FROM Plugins_Objects")
+    insert_plugin_objects(db, 'PLUGA', 1)
+
+    update_api(db, [], updateOnlyDataSources = ['plugins_objects'])
+
+    assert sorted(os.listdir(shardsFolder)) == ['PLUGA.json', 'PLUGA_page_1.json', 'manifest.json']
+    assert sorted(read_json(shardsFolder / 'manifest.json')["plugins"]) == ['PLUGA']
+
+
+# -------------------------------------------------------------------------------
+# Overhead of the FOR EACH ROW change triggers on the bulk writes of a scan cycle.
+# PRAGMA data_version only tells that some table changed and max(rowid) misses updates
+# and deletes, so the per-table counters are kept as long as their overhead stays small.
+@pytest.mark.benchmark
+def test_change_triggers_benchmark(db):
+    rows = 20000
+
+    def insert_rows():
+        db.sql.execute('BEGIN')
+        start = time.perf_counter()
+
+        db.sql.executemany("""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                              VALUES (?, '192.168.1.10', '2024-01-01 00:00:00', 'Connected', '', 0)""",
+                           [(f'aa:00:00:00:{i // 256 % 256:02x}:{i % 256:02x}',) for i in range(rows)])
+        db.sql.executemany("""INSERT INTO Plugins_Objects (Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged, Watched_Value1, Watched_Value2, Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey)
+                              VALUES ('ARPSCAN', ?, '', '2024-01-01 00:00:00', '2024-01-01 00:00:00', '', '', '', '', 'watched-not-changed', '', '', '')""",
+                           [(str(i),) for i in range(rows)])
+
+        elapsed = time.perf_counter() - start
+        db.sql.execute('ROLLBACK')
+
+        return elapsed
+
+    withTriggers = min(insert_rows() for _ in range(3))
+
+    triggers = [row[0] for row in db.sql.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_changes_%'").fetchall()]
+    for trigger in triggers:
+        db.sql.execute(f'DROP TRIGGER "{trigger}"')
+
+    withoutTriggers = min(insert_rows() for _ in range(3))
+
+    overhead = (withTriggers - withoutTriggers) / (2 * rows)
+
+    print(f'{2 * rows} inserts: with change triggers {withTriggers:.3f}s, without {withoutTriggers:.3f}s, {overhead * 1e6:.2f}µs per row')
+
+    # a few µs per row, negligible next to the scans of a cycle
+    assert overhead < 50e-6
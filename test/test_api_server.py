@@ -0,0 +1,193 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import gzip
+import json
+import socket
+import sqlite3
+import urllib.request
+import urllib.error
+
+import pytest
+
+from api_server import api_server_class
+
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def server(tmp_path):
+    # fixture DB with a few devices and the change counters maintained by the backend
+    dbPath = str(tmp_path / 'app.db')
+
+    conn = sqlite3.connect(dbPath)
+    conn.execute('CREATE TABLE Devices (dev_MAC TEXT, dev_Name TEXT, dev_Vendor TEXT)')
+    conn.execute('CREATE TABLE Table_Changes (Table_Name TEXT PRIMARY KEY, Changes INTEGER)')
+    conn.execute("INSERT INTO Table_Changes VALUES ('Devices', 1)")
+    conn.execute('CREATE TABLE AppEvents ("Index" INTEGER PRIMARY KEY AUTOINCREMENT, ObjectPrimaryID TEXT, AppEventType TEXT)')
+    conn.execute('CREATE TABLE Parameters (par_ID TEXT PRIMARY KEY, par_Value TEXT)')
+    conn.execute("INSERT INTO Parameters VALUES ('AppEvents_FeedID', 'feed-1')")
+    conn.executemany('INSERT INTO AppEvents (ObjectPrimaryID, AppEventType) VALUES (?, ?)',
+                     [(f'aa:bb:cc:dd:ee:{i:02x}', 'insert') for i in range(5)])
+    conn.executemany('INSERT INTO Devices VALUES (?, ?, ?)',
+                     [(f'aa:bb:cc:dd:ee:{i:02x}', f'Device {i}', 'Acme' if i % 2 else 'Other') for i in range(100)])
+    conn.commit()
+    conn.close()
+
+    apiServer = api_server_class(dbPath)
+    port = apiServer.start(0, '127.0.0.1')
+
+    yield f'http://127.0.0.1:{port}', dbPath
+
+    apiServer.stop()
+
+# -------------------------------------------------------------------------------
+def get(url, headers = None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers = headers or {})) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+# -------------------------------------------------------------------------------
+def test_api_server_data_sources(server):
+    url, _ = server
+
+    status, _, body = get(url + '/')
+    assert status == 200
+    assert 'devices' in json.loads(body)["data"]
+
+    status, _, _ = get(url + '/unknown')
+    assert status == 404
+
+
+# -------------------------------------------------------------------------------
+def test_api_server_filter_and_pagination(server):
+    url, _ = server
+
+    status, _, body = get(url + '/devices')
+    assert status == 200
+    assert len(json.loads(body)["data"]) == 100
+
+    status, _, body = get(url + '/devices?dev_Vendor=Acme&limit=10&offset=20')
+    result = json.loads(body)
+    assert status == 200
+    assert result["count"] == 50
+    assert len(result["data"]) == 10
+    assert result["data"][0]["dev_Name"] == 'Device 41'
+
+    # only known columns can be filtered
+    status, _, _ = get(url + '/devices?dev_Unknown=1')
+    assert status == 400
+
+    status, _, _ = get(url + '/devices?limit=abc')
+    assert status == 400
+
+
+# -------------------------------------------------------------------------------
+def test_api_server_etag(server):
+    url, dbPath = server
+
+    status, headers, _ = get(url + '/devices')
+    etag = headers["ETag"]
+
+    status, _, body = get(url + '/devices', {'If-None-Match': etag})
+    assert status == 304
+    assert body == b''
+
+    # a change of the source table changes the ETag
+    conn = sqlite3.connect(dbPath)
+    conn.execute("UPDATE Table_Changes SET Changes = Changes + 1 WHERE Table_Name = 'Devices'")
+    conn.commit()
+    conn.close()
+
+    status, headers, _ = get(url + '/devices', {'If-None-Match': etag})
+    assert status == 200
+    assert headers["ETag"] != etag
+
+
+# -------------------------------------------------------------------------------
+def test_api_server_gzip(server):
+    url, _ = server
+
+    status, headers, body = get(url + '/devices', {'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers["Content-Encoding"] == 'gzip'
+    assert len(json.loads(gzip.decompress(body))["data"]) == 100
+
+
+# -------------------------------------------------------------------------------
+def test_api_server_changes(server):
+    url, dbPath = server
+
+    status, _, body = get(url + '/changes?limit=3')
+    result = json.loads(body)
+    assert status == 200
+    assert result["feedId"] == 'feed-1'
+    assert [event["Index"] for event in result["data"]] == [1, 2, 3]
+
+    # continue from the cursor
+    status, _, body = get(url + f'/changes?after={result["next"]}')
+    result = json.loads(body)
+    assert [event["Index"] for event in result["data"]] == [4, 5]
+
+    # no new events - the cursor stays
+    status, _, body = get(url + f'/changes?after={result["next"]}')
+    result = json.loads(body)
+    assert result["data"] == []
+    assert result["next"] == 5
+
+    status, _, _ = get(url + '/changes?after=abc')
+    assert status == 400
+
+
+# -------------------------------------------------------------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# -------------------------------------------------------------------------------
+def test_api_server_start_stop(server):
+    _, dbPath = server
+
+    apiServer = api_server_class(dbPath)
+
+    # port in use - not started, retried on the next call
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()
+        usedPort = sock.getsockname()[1]
+
+        assert apiServer.start(usedPort) is None
+        assert apiServer.thread is None
+
+    port = apiServer.start(usedPort)
+    assert port == usedPort
+
+    # listening on the loopback interface by default
+    assert apiServer.server.sockets[0].getsockname()[0] == '127.0.0.1'
+    assert get(f'http://127.0.0.1:{port}/')[0] == 200
+
+    # unchanged settings - same server
+    thread = apiServer.thread
+    assert apiServer.start(port) == port
+    assert apiServer.thread is thread
+
+    # changed port - restarted
+    newPort = apiServer.start(free_port())
+    assert newPort != port
+    assert get(f'http://127.0.0.1:{newPort}/')[0] == 200
+
+    with pytest.raises(urllib.error.URLError):
+        get(f'http://127.0.0.1:{port}/')
+
+    # port cleared - stopped
+    apiServer.stop()
+    assert apiServer.thread is None
+
+    with pytest.raises(urllib.error.URLError):
+        get(f'http://127.0.0.1:{newPort}/')
@@ -0,0 +1,126 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import os
+import json
+import sqlite3
+
+import pytest
+
+from appevent import app_events_feed_class
+
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def connection():
+    # app events table and feed ID as created by the DB migrations
+    connection = sqlite3.connect(':memory:')
+    connection.row_factory = sqlite3.Row
+    connection.execute('CREATE TABLE AppEvents ("Index" INTEGER PRIMARY KEY AUTOINCREMENT, ObjectPrimaryID TEXT, AppEventType TEXT)')
+    connection.execute('CREATE TABLE Parameters (par_ID TEXT PRIMARY KEY, par_Value TEXT)')
+    connection.execute("INSERT INTO Parameters VALUES ('AppEvents_FeedID', 'feed-1')")
+
+    yield connection
+
+    connection.close()
+
+# -------------------------------------------------------------------------------
+def add_events(connection, count):
+    connection.executemany('INSERT INTO AppEvents (ObjectPrimaryID, AppEventType) VALUES (?, ?)',
+                           [(f'aa:bb:cc:dd:ee:{i:02x}', 'insert') for i in range(count)])
+
+# -------------------------------------------------------------------------------
+def read_feed(folder):
+    with open(folder / 'index.json') as file:
+        manifest = json.load(file)
+
+    events = []
+    for segment in manifest["segments"]:
+        with open(folder / segment["file"]) as file:
+            events += [json.loads(line) for line in file]
+
+    return manifest, events
+
+
+# -------------------------------------------------------------------------------
+def test_export_segments(connection, tmp_path):
+    feed = app_events_feed_class(str(tmp_path) + '/', segmentSize = 3)
+
+    add_events(connection, 4)
+    feed.exportEvents(connection)
+
+    manifest, events = read_feed(tmp_path)
+
+    assert manifest["feedId"] == 'feed-1'
+    assert manifest["lastIndex"] == 4
+    assert [(segment["file"], segment["first"], segment["last"], segment["count"]) for segment in manifest["segments"]] == [
+        ('appevents_1.ndjson', 1, 3, 3), ('appevents_4.ndjson', 4, 4, 1)]
+    assert [segment["size"] for segment in manifest["segments"]] == [os.path.getsize(tmp_path / segment["file"]) for segment in manifest["segments"]]
+    assert [event["Index"] for event in events] == [1, 2, 3, 4]
+
+    # new events are appended to the last segment
+    add_events(connection, 3)
+    feed.exportEvents(connection)
+
+    manifest, events = read_feed(tmp_path)
+
+    assert [segment["file"] for segment in manifest["segments"]] == ['appevents_1.ndjson', 'appevents_4.ndjson', 'appevents_7.ndjson']
+    assert [event["Index"] for event in events] == list(range(1, 8))
+
+    # events deleted by the DB cleanup - older segments are removed
+    connection.execute('DELETE FROM AppEvents WHERE "Index" <= 3')
+    feed.exportEvents(connection)
+
+    manifest, events = read_feed(tmp_path)
+
+    assert sorted(os.listdir(tmp_path)) == ['appevents_4.ndjson', 'appevents_7.ndjson', 'index.json']
+    assert [event["Index"] for event in events] == list(range(4, 8))
+
+# -------------------------------------------------------------------------------
+def test_export_after_unsaved_index(connection, tmp_path):
+    feed = app_events_feed_class(str(tmp_path) + '/', segmentSize = 3)
+
+    add_events(connection, 4)
+    feed.exportEvents(connection)
+
+    with open(tmp_path / 'index.json') as file:
+        savedManifest = file.read()
+
+    # events appended, but the app stopped before index.json was saved
+    add_events(connection, 3)
+    feed.exportEvents(connection)
+
+    with open(tmp_path / 'index.json', 'w') as file:
+        file.write(savedManifest)
+
+    # exported again after the restart, without duplicates
+    app_events_feed_class(str(tmp_path) + '/', segmentSize = 3).exportEvents(connection)
+
+    manifest, events = read_feed(tmp_path)
+
+    assert manifest["lastIndex"] == 7
+    assert [event["Index"] for event in events] == list(range(1, 8))
+    assert sorted(os.listdir(tmp_path)) == ['appevents_1.ndjson', 'appevents_4.ndjson', 'appevents_7.ndjson', 'index.json']
+
+# -------------------------------------------------------------------------------
+def test_export_new_feed(connection, tmp_path):
+    feed = app_events_feed_class(str(tmp_path) + '/', segmentSize = 3)
+
+    add_events(connection, 4)
+    feed.exportEvents(connection)
+
+    # the app events table was recreated by a DB upgrade
+    connection.execute('DELETE FROM AppEvents')
+    connection.execute("DELETE FROM sqlite_sequence WHERE name = 'AppEvents'")
+    connection.execute("UPDATE Parameters SET par_Value = 'feed-2' WHERE par_ID = 'AppEvents_FeedID'")
+    add_events(connection, 2)
+    feed.exportEvents(connection)
+
+    manifest, events = read_feed(tmp_path)
+
+    assert manifest["feedId"] == 'feed-2'
+    assert [event["Index"] for event in events] == [1, 2]
+    assert sorted(os.listdir(tmp_path)) == ['appevents_1.ndjson', 'index.json']
@@ -0,0 +1,219 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+import database
+from database import DB, schemaMigrations, current_scan_upsert, get_connection
+
+
+legacyDbPath = str(pathlib.Path(__file__).parent.parent.resolve()) + "/back/app.db"
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def dbPath(tmp_path, monkeypatch):
+    # copy of the legacy DB shipped with the app
+    path = str(tmp_path / 'app.db')
+    shutil.copyfile(legacyDbPath, path)
+
+    monkeypatch.setattr(database, 'fullDbPath', path)
+
+    return path
+
+# -------------------------------------------------------------------------------
+def open_db():
+    db = DB()
+    db.open()
+    return db
+
+# -------------------------------------------------------------------------------
+def get_names(db, type):
+    return [row[0] for row in db.sql.execute("SELECT name FROM sqlite_master WHERE type = ?", (type,)).fetchall()]
+
+# -------------------------------------------------------------------------------
+def get_version(db):
+    return db.sql.execute('PRAGMA user_version').fetchone()[0]
+
+# -------------------------------------------------------------------------------
+def insert_device(db, mac):
+    db.sql.execute("""INSERT INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection)
+                      VALUES (?, 'Test', '192.168.1.10', '2024-01-01 00:00:00', '2024-01-01 00:00:00')""", (mac,))
+
+
+# -------------------------------------------------------------------------------
+def test_upgrade_legacy_db(dbPath):
+    db = open_db()
+    assert get_version(db) == 0
+
+    db.upgradeDB()
+
+    assert get_version(db) == len(schemaMigrations)
+
+    tables = get_names(db, 'table')
+    for table in ['Devices', 'Events', 'Sessions', 'Online_History', 'Settings', 'Parameters', 'Pholus_Scan', 'Plugins_Objects',
+                  'Plugins_Events', 'Plugins_History', 'Plugins_Language_Strings', 'AppEvents',
+                  'Notifications', 'Table_Changes', 'Sessions_Changes', 'LastEvent']:
+        assert table in tables
+
+    for table in ['ScanCycles', 'DHCP_Leases', 'PiHole_Network', 'CurrentScan']:
+        assert table not in tables
+
+    # TEMP table of the connection
+    assert db.sql.execute("SELECT name FROM sqlite_temp_master WHERE name = 'CurrentScan'").fetchone() is not None
+
+    # replaced by the LastEvent table
+    assert 'LatestEventsPerMAC' not in get_names(db, 'view')
+
+    triggers = get_names(db, 'trigger')
+    assert 'trg_create_device' in triggers
+    assert 'trg_changes_Devices_insert' in triggers
+    assert 'trg_changes_Notifications_insert' in triggers
+
+    columns = [row[1] for row in db.sql.execute("PRAGMA table_info('Devices')").fetchall()]
+    for column in ['dev_Network_Node_MAC_ADDR', 'dev_Icon', 'dev_GUID', 'dev_NetworkSite', 'dev_SSID', 'dev_SyncHubNodeName']:
+        assert column in columns
+
+    # existing devices are kept and get a GUID
+    assert db.sql.execute("SELECT COUNT(*) FROM Devices WHERE dev_GUID IS NULL").fetchone()[0] == 0
+
+
+# -------------------------------------------------------------------------------
+def test_upgrade_current_db_keeps_data(dbPath):
+    db = open_db()
+    db.upgradeDB()
+
+    insert_device(db, 'aa:bb:cc:dd:ee:01')
+    appEvents = db.sql.execute("SELECT COUNT(*) FROM AppEvents").fetchone()[0]
+    feedId = db.sql.execute("SELECT par_Value FROM Parameters WHERE par_ID = 'AppEvents_FeedID'").fetchone()[0]
+
+    # devices inserted without a GUID get one
+    assert db.sql.execute("SELECT dev_GUID FROM Devices WHERE dev_MAC = 'aa:bb:cc:dd:ee:01'").fetchone()[0] is not None
+
+    # restart - nothing is re-created
+    db.sql_connection.close()
+    db = open_db()
+    db.upgradeDB()
+
+    assert appEvents > 0
+    assert db.sql.execute("SELECT COUNT(*) FROM AppEvents").fetchone()[0] == appEvents
+    assert db.sql.execute("SELECT par_Value FROM Parameters WHERE par_ID = 'AppEvents_FeedID'").fetchone()[0] == feedId
+
+
+# -------------------------------------------------------------------------------
+def test_migrations_are_idempotent(dbPath):
+    db = open_db()
+    db.upgradeDB()
+
+    insert_device(db, 'aa:bb:cc:dd:ee:01')
+
+    # re-run all migrations on the migrated DB
+    db.sql.execute('PRAGMA user_version = 0')
+    db.upgradeDB()
+
+    assert get_version(db) == len(schemaMigrations)
+    assert db.sql.execute("SELECT COUNT(*) FROM Devices WHERE dev_MAC = 'aa:bb:cc:dd:ee:01'").fetchone()[0] == 1
+
+
+# -------------------------------------------------------------------------------
+def test_failed_migration_is_rolled_back(dbPath, monkeypatch):
+    db = open_db()
+    db.upgradeDB()
+
+    def migrate_failing(db):
+        db.sql.execute("CREATE TABLE Test_Migration (Id INTEGER)")
+        db.sql.execute("ALTER TABLE Unknown_Table ADD Test TEXT")
+
+    monkeypatch.setattr(database, 'schemaMigrations', schemaMigrations + [migrate_failing])
+
+    with pytest.raises(sqlite3.Error):
+        db.upgradeDB()
+
+    assert get_version(db) == len(schemaMigrations)
+    assert 'Test_Migration' not in get_names(db, 'table')
+
+
+# -------------------------------------------------------------------------------
+def test_current_scan_merges_rows(dbPath):
+    db = open_db()
+    db.upgradeDB()
+
+    columns = ['cur_MAC', 'cur_IP', 'cur_Vendor', 'cur_Name', 'cur_SSID', 'cur_Type']
+    insert = f"INSERT INTO CurrentScan ({', '.join(columns)}) VALUES (?, ?, ?, ?, ?, ?)" + current_scan_upsert(columns)
+
+    # the same MAC reported by two scanners
+    db.sql.execute(insert, ('aa:bb:cc:dd:ee:01', '192.168.1.10', 'Acme', '', 'null', 'Phone'))
+    db.sql.executemany(insert, [('AA:BB:CC:DD:EE:01', '192.168.1.11', 'Other', 'Name', 'Wifi', 'Laptop'),
+                                ('aa:bb:cc:dd:ee:02', '192.168.1.12', None, None, None, None)])
+
+    rows = db.sql.execute("SELECT * FROM CurrentScan ORDER BY cur_MAC").fetchall()
+    assert len(rows) == 2
+
+    # IP and vendor of the first row, the other columns from the first row with a value
+    assert [rows[0][column] for column in columns] == ['aa:bb:cc:dd:ee:01', '192.168.1.10', 'Acme', 'Name', 'Wifi', 'Phone']
+
+    # scan results don't survive a restart
+    db.sql_connection.close()
+    db = open_db()
+    db.upgradeDB()
+
+    assert db.sql.execute("SELECT COUNT(*) FROM CurrentScan").fetchone()[0] == 0
+
+
+# -------------------------------------------------------------------------------
+def test_savepoints(dbPath):
+    db = open_db()
+    db.upgradeDB()
+
+    reader = open_db()
+
+    with db.savepoint('outer'):
+        insert_device(db, 'aa:bb:cc:dd:ee:01')
+
+        # committed with the outermost savepoint
+        assert db.commitDB()
+        assert db.sql_connection.in_transaction
+
+        # a failed block is rolled back, the rest of the transaction is kept
+        with pytest.raises(sqlite3.IntegrityError):
+            with db.savepoint('inner'):
+                insert_device(db, 'aa:bb:cc:dd:ee:02')
+                insert_device(db, 'aa:bb:cc:dd:ee:01')
+
+        assert reader.sql.execute("SELECT COUNT(*) FROM Devices WHERE dev_MAC LIKE 'aa:bb:cc:dd:ee:%'").fetchone()[0] == 0
+
+    assert not db.sql_connection.in_transaction
+    assert [row[0] for row in reader.sql.execute("SELECT dev_MAC FROM Devices WHERE dev_MAC LIKE 'aa:bb:cc:dd:ee:%'")] == ['aa:bb:cc:dd:ee:01']
+
+
+# -------------------------------------------------------------------------------
+def test_connections_wait_for_the_writer(dbPath):
+    db = open_db()
+    db.upgradeDB()
+
+    # read-only connections can't write
+    reader = get_connection(readOnly = True)
+    assert reader.execute("SELECT COUNT(*) FROM Devices").fetchone()[0] > 0
+
+    with pytest.raises(sqlite3.OperationalError):
+        reader.execute("DELETE FROM Devices")
+
+    # a plugin writing while the core holds the write lock waits for it instead of failing
+    core = get_connection(isolation_level = None, check_same_thread = False)
+    core.execute('BEGIN IMMEDIATE')
+    core.execute("""INSERT INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection)
+                    VALUES ('aa:bb:cc:dd:ee:01', 'Test', '192.168.1.10', '2024-01-01 00:00:00', '2024-01-01 00:00:00')""")
+
+    threading.Timer(0.5, lambda: core.execute('COMMIT')).start()
+
+    writer = get_connection()
+    writer.execute("UPDATE Devices SET dev_Name = 'Plugin' WHERE dev_MAC = 'aa:bb:cc:dd:ee:01'")
+    writer.commit()
+
+    assert reader.execute("SELECT dev_Name FROM Devices WHERE dev_MAC = 'aa:bb:cc:dd:ee:01'").fetchone()[0] == 'Plugin'
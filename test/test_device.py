@@ -0,0 +1,419 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import os
+import shutil
+import time
+
+import pytest
+
+import database
+from database import DB, current_scan_upsert
+import device
+from device import (update_devices_from_current_scan, create_new_devices, build_vendor_index_file, vendor_index_file_class,
+                    vendor_index_class, query_MAC_vendor, vendorIndexHeader, vendorIndexMagic)
+
+
+legacyDbPath = str(pathlib.Path(__file__).parent.parent.resolve()) + "/back/app.db"
+
+startTime = '2024-02-01 12:00:00'
+
+# -------------------------------------------------------------------------------
+# The previous implementation with one UPDATE and correlated subqueries per column, as reference
+def legacy_update_devices(sql, startTime):
+
+    # Update Last Connection
+    sql.execute(f"""UPDATE Devices SET dev_LastConnection = '{startTime}',
+                        dev_PresentLastScan = 1
+                    WHERE dev_PresentLastScan = 0
+                      AND EXISTS (SELECT 1 FROM CurrentScan
+                                  WHERE dev_MAC = cur_MAC) """)
+
+    # Clean no active devices
+    sql.execute("""UPDATE Devices SET dev_PresentLastScan = 0
+                    WHERE NOT EXISTS (SELECT 1 FROM CurrentScan
+                                      WHERE dev_MAC = cur_MAC) """)
+
+    # Update IP
+    sql.execute("""UPDATE Devices
+                    SET dev_LastIP = (SELECT cur_IP FROM CurrentScan
+                                      WHERE dev_MAC = cur_MAC)
+                    WHERE EXISTS (SELECT 1 FROM CurrentScan
+                                  WHERE dev_MAC = cur_MAC) """)
+
+    # Update only devices with empty or NULL vendors
+    sql.execute("""UPDATE Devices
+                    SET dev_Vendor = (
+                        SELECT cur_Vendor
+                        FROM CurrentScan
+                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                    )
+                    WHERE
+                        (dev_Vendor IS NULL OR dev_Vendor IN ("", "null"))
+                        AND EXISTS (
+                            SELECT 1
+                            FROM CurrentScan
+                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                        )""")
+
+    # Update only devices with empty or NULL dev_Network_Node_port
+    sql.execute("""UPDATE Devices
+                    SET dev_Network_Node_port = (
+                    SELECT cur_Port
+                    FROM CurrentScan
+                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                )
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM CurrentScan
+                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                      AND CurrentScan.cur_Port IS NOT NULL AND CurrentScan.cur_Port NOT IN ("", "null")
+                )""")
+
+    # Update only devices with empty or NULL dev_Network_Node_MAC_ADDR
+    sql.execute("""UPDATE Devices
+                    SET dev_Network_Node_MAC_ADDR = (
+                    SELECT cur_NetworkNodeMAC
+                    FROM CurrentScan
+                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                )
+                WHERE EXISTS (
+                    SELECT 1
+                    FROM CurrentScan
+                    WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                        AND CurrentScan.cur_NetworkNodeMAC IS NOT NULL AND CurrentScan.cur_NetworkNodeMAC NOT IN ("", "null")
+                )""")
+
+    # Update only devices with empty or NULL dev_NetworkSite
+    sql.execute("""UPDATE Devices
+                    SET dev_NetworkSite = (
+                        SELECT cur_NetworkSite
+                        FROM CurrentScan
+                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                    )
+                    WHERE
+                        (dev_NetworkSite IS NULL OR dev_NetworkSite IN ("", "null"))
+                        AND EXISTS (
+                            SELECT 1
+                            FROM CurrentScan
+                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                                AND CurrentScan.cur_NetworkSite IS NOT NULL AND CurrentScan.cur_NetworkSite NOT IN ("", "null")
+                )""")
+
+    # Update only devices with empty or NULL dev_SSID
+    sql.execute("""UPDATE Devices
+                    SET dev_SSID = (
+                        SELECT cur_SSID
+                        FROM CurrentScan
+                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                    )
+                    WHERE
+                        (dev_SSID IS NULL OR dev_SSID IN ("", "null"))
+                        AND EXISTS (
+                            SELECT 1
+                            FROM CurrentScan
+                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                                AND CurrentScan.cur_SSID IS NOT NULL AND CurrentScan.cur_SSID NOT IN ("", "null")
+                        )""")
+
+    # Update only devices with empty or NULL dev_DeviceType
+    sql.execute("""UPDATE Devices
+                    SET dev_DeviceType = (
+                        SELECT cur_Type
+                        FROM CurrentScan
+                        WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                    )
+                    WHERE
+                        (dev_DeviceType IS NULL OR dev_DeviceType IN ("", "null"))
+                        AND EXISTS (
+                            SELECT 1
+                            FROM CurrentScan
+                            WHERE Devices.dev_MAC = CurrentScan.cur_MAC
+                                AND CurrentScan.cur_Type IS NOT NULL AND CurrentScan.cur_Type NOT IN ("", "null")
+                        )""")
+
+    # Update (unknown) or (name not found) Names if available
+    sql.execute ("""    UPDATE Devices
+                        SET dev_NAME = COALESCE((
+                            SELECT cur_Name
+                            FROM CurrentScan
+                            WHERE cur_MAC = dev_MAC
+                            AND cur_Name IS NOT NULL
+                            AND cur_Name <> 'null'
+                            AND cur_Name <> ''
+                        ), dev_NAME)
+                        WHERE (dev_NAME IN ('(unknown)', '(name not found)', '')
+                            OR dev_NAME IS NULL)
+                        AND EXISTS (
+                            SELECT 1
+                            FROM CurrentScan
+                            WHERE cur_MAC = dev_MAC
+                            AND cur_Name IS NOT NULL
+                            AND cur_Name <> 'null'
+                            AND cur_Name <> ''
+                        ) """)
+
+
+# -------------------------------------------------------------------------------
+def make_db(path, count, scanRows = None, unkeyedScan = False):
+    # legacy DB migrated to the latest schema with <count> devices, every 10th device is absent
+    shutil.copyfile(legacyDbPath, path)
+
+    fullDbPath = database.fullDbPath
+    database.fullDbPath = path
+
+    db = DB()
+    db.open()
+    db.upgradeDB()
+
+    database.fullDbPath = fullDbPath
+
+    def mac(i):
+        return f'aa:bb:cc:{i >> 16 & 255:02x}:{i >> 8 & 255:02x}:{i & 255:02x}'
+
+    # a mix of empty, "null" and set values
+    values = ['', 'null', None, 'set']
+
+    # CurrentScan as before it got a key
+    if unkeyedScan:
+        db.sql.execute('DROP TABLE CurrentScan')
+        db.sql.execute("""CREATE TEMP TABLE CurrentScan (cur_MAC STRING(50) NOT NULL COLLATE NOCASE, cur_IP STRING(50) NOT NULL COLLATE NOCASE,
+                              cur_Vendor STRING(250), cur_ScanMethod STRING(10), cur_Name STRING(250), cur_LastQuery STRING(250),
+                              cur_DateTime STRING(250), cur_SyncHubNodeName STRING(50), cur_NetworkSite STRING(250), cur_SSID STRING(250),
+                              cur_NetworkNodeMAC STRING(250), cur_PORT STRING(250), cur_Type STRING(250))""")
+
+    db.sql.execute('BEGIN')
+
+    db.sql.executemany("""INSERT INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection,
+                                               dev_PresentLastScan, dev_Vendor, dev_NetworkSite, dev_SSID, dev_DeviceType)
+                          VALUES (?, ?, '10.0.0.1', '2024-01-01 00:00:00', '2024-01-01 00:00:00', ?, ?, ?, ?, ?)""",
+                       [(mac(i), ['(unknown)', 'Device', '(name not found)'][i % 3], i % 2, values[i % 4], values[(i + 1) % 4],
+                         values[(i + 2) % 4], values[(i + 3) % 4]) for i in range(count)])
+
+    if scanRows is None:
+        scanRows = [(mac(i), f'10.0.1.{i % 250}', values[i % 4], values[(i + 1) % 4], values[(i + 2) % 4], values[(i + 3) % 4],
+                     values[i % 4], values[(i + 1) % 4], values[(i + 2) % 4]) for i in range(count) if i % 10]
+
+    columns = ['cur_MAC', 'cur_IP', 'cur_Vendor', 'cur_Name', 'cur_PORT', 'cur_NetworkNodeMAC', 'cur_NetworkSite', 'cur_SSID', 'cur_Type']
+
+    db.sql.executemany(f"""INSERT INTO CurrentScan ({', '.join(columns)})
+                           VALUES ({', '.join('?' * len(columns))})""" + ('' if unkeyedScan else current_scan_upsert(columns)), scanRows)
+
+    db.sql.execute('COMMIT')
+
+    return db
+
+# -------------------------------------------------------------------------------
+def get_devices(db):
+    # without the random GUIDs
+    return [tuple(value for key, value in zip(row.keys(), row) if key != 'dev_GUID')
+            for row in db.sql.execute("SELECT * FROM Devices ORDER BY dev_MAC").fetchall()]
+
+
+# -------------------------------------------------------------------------------
+def test_update_devices_matches_legacy(tmp_path):
+    legacyDb = make_db(str(tmp_path / 'legacy.db'), 1000)
+    db = make_db(str(tmp_path / 'app.db'), 1000)
+
+    legacy_update_devices(legacyDb.sql, startTime)
+    update_devices_from_current_scan(db, startTime)
+
+    assert get_devices(db) == get_devices(legacyDb)
+
+
+# -------------------------------------------------------------------------------
+def test_update_devices_multiple_scan_rows(tmp_path):
+    # the same MAC reported by two plugins
+    db = make_db(str(tmp_path / 'app.db'), 1, [
+        ('aa:bb:cc:00:00:00', '10.0.1.1', 'Acme', '', '', 'node1', '', None, ''),
+        ('aa:bb:cc:00:00:00', '10.0.1.2', 'Other', 'Phone', '5', 'node2', 'Site', 'Wifi', 'Phone'),
+    ])
+
+    update_devices_from_current_scan(db, startTime)
+
+    device = db.sql.execute("SELECT * FROM Devices WHERE dev_MAC = 'aa:bb:cc:00:00:00'").fetchone()
+
+    # IP and vendor of the first row, the other columns from the first row with a value
+    assert device['dev_LastIP'] == '10.0.1.1'
+    assert device['dev_Vendor'] == 'Acme'
+    assert device['dev_Name'] == 'Phone'
+    assert device['dev_Network_Node_port'] == 5
+    assert device['dev_Network_Node_MAC_ADDR'] == 'node1'
+    assert device['dev_SSID'] == 'Wifi'
+    assert device['dev_PresentLastScan'] == 1
+    assert device['dev_LastConnection'] == startTime
+
+
+# -------------------------------------------------------------------------------
+@pytest.mark.benchmark
+def test_update_devices_benchmark(tmp_path):
+    legacyDb = make_db(str(tmp_path / 'legacy.db'), 2000, unkeyedScan = True)
+    db = make_db(str(tmp_path / 'app.db'), 2000)
+
+    start = time.perf_counter()
+    legacy_update_devices(legacyDb.sql, startTime)
+    legacyTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    update_devices_from_current_scan(db, startTime)
+    newTime = time.perf_counter() - start
+
+    # the legacy queries scan CurrentScan for every device and column, too slow to run with 50k devices
+    db = make_db(str(tmp_path / 'large.db'), 50000)
+
+    start = time.perf_counter()
+    update_devices_from_current_scan(db, startTime)
+    largeTime = time.perf_counter() - start
+
+    print(f"\n[Benchmark] update devices legacy     2000 devices: {legacyTime:.4f}s")
+    print(f"[Benchmark] update devices           2000 devices: {newTime:.4f}s")
+    print(f"[Benchmark] update devices          50000 devices: {largeTime:.4f}s")
+
+    # quadratic before, ~25x the devices took ~625x the time
+    assert newTime * 10 < legacyTime
+    assert largeTime < newTime * 100
+
+
+# -------------------------------------------------------------------------------
+def test_create_new_devices(tmp_path, monkeypatch):
+    settings = {'NEWDEV_dev_AlertEvents': 1, 'NEWDEV_dev_AlertDeviceDown': 0, 'NEWDEV_dev_PresentLastScan': 1,
+                'NEWDEV_dev_Archived': 0, 'NEWDEV_dev_NewDevice': 1, 'NEWDEV_dev_SkipRepeated': 0, 'NEWDEV_dev_ScanCycle': 1,
+                'NEWDEV_dev_Owner': "Owner's", 'NEWDEV_dev_Favorite': 0, 'NEWDEV_dev_Group': 'Group', 'NEWDEV_dev_Comments': '',
+                'NEWDEV_dev_LogEvents': 1, 'NEWDEV_dev_Location': 'Home', 'NEWDEV_dev_DeviceType': 'Laptop',
+                'NEWDEV_dev_Network_Node_MAC_ADDR': 'node0', 'SYNC_node_name': 'hub'}
+    lookups = []
+
+    def get_setting_value(key):
+        lookups.append(key)
+        return settings.get(key, '')
+
+    monkeypatch.setattr(device, 'get_setting_value', get_setting_value)
+
+    # one known device and 500 new ones
+    db = make_db(str(tmp_path / 'app.db'), 1,
+                 [('aa:bb:cc:00:00:00', '10.0.1.1', 'Acme', 'Known', '', '', '', '', '')] +
+                 [(f'aa:bb:cc:00:{i >> 8:02x}:{i & 255:02x}', '10.0.2.1', None, " Bob's phone " if i == 1 else None, None,
+                   'node1' if i == 2 else None, None, None, 'Phone' if i == 1 else None) for i in range(1, 501)] +
+                 [('Internet', '1.2.3.4', None, 'Internet', None, None, None, None, 'Router')])
+
+    # the Internet device of the legacy DB is created again
+    db.sql.execute("DELETE FROM Devices WHERE dev_MAC = 'Internet'")
+
+    known = get_devices(db)[0]
+
+    create_new_devices(db)
+
+    assert db.sql.execute("SELECT COUNT(*) FROM Devices").fetchone()[0] == 502
+    assert db.sql.execute("SELECT COUNT(*) FROM Events WHERE eve_EventType = 'New Device'").fetchone()[0] == 501
+    assert db.sql.execute("SELECT COUNT(DISTINCT dev_GUID) FROM Devices").fetchone()[0] == 502
+    assert get_devices(db)[0] == known
+
+    # settings are resolved once, not per device
+    assert len(lookups) == len(set(lookups))
+
+    rows = {row['dev_MAC']: row for row in db.sql.execute("SELECT * FROM Devices").fetchall()}
+
+    assert rows['aa:bb:cc:00:00:01']['dev_Name'] == "Bob's phone"
+    assert rows['aa:bb:cc:00:00:01']['dev_DeviceType'] == 'Phone'
+    assert rows['aa:bb:cc:00:00:01']['dev_Network_Node_MAC_ADDR'] == 'node0'
+    assert rows['aa:bb:cc:00:00:02']['dev_Name'] == '(unknown)'
+    assert rows['aa:bb:cc:00:00:02']['dev_DeviceType'] == 'Laptop'
+    assert rows['aa:bb:cc:00:00:02']['dev_Network_Node_MAC_ADDR'] == 'node1'
+    assert rows['aa:bb:cc:00:00:02']['dev_SyncHubNodeName'] == 'hub'
+    assert rows['aa:bb:cc:00:00:02']['dev_Owner'] == "Owner's"
+    assert rows['aa:bb:cc:00:00:02']['dev_LastIP'] == '10.0.2.1'
+    assert rows['aa:bb:cc:00:00:02']['dev_FirstConnection'] == rows['aa:bb:cc:00:00:02']['dev_LastConnection']
+    assert [rows['aa:bb:cc:00:00:02'][column] for column in ['dev_AlertEvents', 'dev_AlertDeviceDown', 'dev_ScanCycle', 'dev_LogEvents']] == [1, 0, 1, 1]
+    assert rows['Internet']['dev_Network_Node_MAC_ADDR'] == 'null'
+
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def vendorFiles(tmp_path, monkeypatch):
+    # MA-L, MA-M and MA-S assignments of the same block, in the arp-scan format
+    vendorsPath = str(tmp_path / 'ieee-oui.txt')
+
+    with open(vendorsPath, 'w') as f:
+        f.write('# comment\n'
+                '001122\tLarge Vendor\n'
+                '0011223\tMedium Vendor\n'
+                '001122334\tSmall Vendor\n'
+                'AABBCC\tOther, Inc.\n'
+                'AABBCC\tDuplicate\n'
+                'invalid line\n')
+
+    monkeypatch.setattr(device, 'vendorsPath', vendorsPath)
+    monkeypatch.setattr(device, 'vendorsPathNewest', str(tmp_path / 'missing.txt'))
+    monkeypatch.setattr(device, 'vendorsPathIndex', str(tmp_path / 'ieee-oui.idx'))
+    monkeypatch.setattr(device, 'vendorIndex', vendor_index_class())
+
+    return vendorsPath, str(tmp_path / 'ieee-oui.idx')
+
+# -------------------------------------------------------------------------------
+def assert_vendor_lookups():
+    # longest prefix wins
+    assert query_MAC_vendor('00:11:22:33:44:55') == 'Small Vendor'
+    assert query_MAC_vendor('00:11:22:3f:44:55') == 'Medium Vendor'
+    assert query_MAC_vendor('00:11:22:ff:44:55') == 'Large Vendor'
+    assert query_MAC_vendor('AA:BB:CC:00:00:01') == 'Other, Inc.'
+
+    # unknown and ignored MACs
+    assert query_MAC_vendor('00:00:00:00:00:01') == -1
+    assert query_MAC_vendor('Internet') == -2
+    assert query_MAC_vendor('zz:11:22:33:44:55') == -2
+
+
+# -------------------------------------------------------------------------------
+def test_vendor_index_file(vendorFiles):
+    vendorsPath, indexPath = vendorFiles
+
+    assert build_vendor_index_file(vendorsPath, indexPath) == 4
+
+    with open(indexPath, 'rb') as f:
+        magic, count, lengths = vendorIndexHeader.unpack(f.read(vendorIndexHeader.size))
+
+    assert (magic, count, lengths) == (vendorIndexMagic, 4, 1 << 6 | 1 << 7 | 1 << 9)
+
+    index = vendor_index_file_class(indexPath)
+    assert index.lengths == [9, 7, 6]
+    index.close()
+
+    assert_vendor_lookups()
+    assert device.vendorIndex.binary is not None
+
+
+# -------------------------------------------------------------------------------
+def test_vendor_lookup_without_index(vendorFiles):
+    assert_vendor_lookups()
+    assert device.vendorIndex.binary is None
+
+
+# -------------------------------------------------------------------------------
+def test_vendor_lookup_with_stale_index(vendorFiles):
+    vendorsPath, indexPath = vendorFiles
+
+    build_vendor_index_file(vendorsPath, indexPath)
+
+    # the vendors file was updated after the index was built
+    with open(vendorsPath, 'a') as f:
+        f.write('000000\tNew Vendor\n')
+
+    os.utime(indexPath, (time.time() - 100, time.time() - 100))
+
+    assert query_MAC_vendor('00:00:00:00:00:01') == 'New Vendor'
+    assert device.vendorIndex.binary is None
+
+
+# -------------------------------------------------------------------------------
+def test_vendor_lookup_with_invalid_index(vendorFiles):
+    vendorsPath, indexPath = vendorFiles
+
+    # e.g. written by a previous version
+    with open(indexPath, 'wb') as f:
+        f.write(b'NAXOUI01' + bytes(100))
+
+    assert_vendor_lookups()
+    assert device.vendorIndex.binary is None
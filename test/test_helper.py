@@ -4,9 +4,16 @@ import pathlib
 sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
 
 
+import os
+import json
+import time
 import datetime
+import threading
 
-from helper import timeNowTZ, updateSubnets
+import dns.resolver
+import pytest
+
+from helper import timeNowTZ, updateSubnets, settings_cache_class, setting_value_to_python_type, pholus_names_class, reverse_dns_resolver_class
 
 
 # -------------------------------------------------------------------------------
@@ -27,3 +34,184 @@ def test_updateSubnets():
     result = updateSubnets(subnet)
     assert type(result) is list
     assert len(result) == 2
+
+
+# -------------------------------------------------------------------------------
+def write_settings_file(path, settings):
+    string_type = '{"dataType":"string", "elements": [{"elementType" : "input", "elementOptions" : [] ,"transformers": []}]}'
+
+    data = {"data": [{"Code_Name": key, "Type": string_type, "Value": value} for key, value in settings.items()]}
+
+    with open(path, 'w') as json_file:
+        json.dump(data, json_file)
+
+
+# -------------------------------------------------------------------------------
+def test_settings_cache(tmp_path):
+    settingsFile = str(tmp_path / 'table_settings.json')
+    write_settings_file(settingsFile, {"SETTING_A": "a", "SETTING_B": "b"})
+
+    cache = settings_cache_class(settingsFile)
+
+    # read-through mode
+    assert cache.get_value("SETTING_A") == "a"
+    assert cache.get_value("SETTING_MISSING") == ""
+
+    # file changes are picked up
+    write_settings_file(settingsFile, {"SETTING_A": "changed"})
+    os.utime(settingsFile, (time.time() + 10, time.time() + 10))
+    assert cache.get_value("SETTING_A") == "changed"
+    assert cache.get("SETTING_B") is None
+
+    # settings loaded from the imported config replace the file
+    generation = cache.generation
+    cache.load([("SETTING_A", "name", "desc", '{"dataType":"string", "elements": [{"elementType" : "input", "elementOptions" : [] ,"transformers": []}]}', "[]", "", "imported", "General", "[]", 0)])
+    assert cache.generation == generation + 1
+    assert cache.get_value("SETTING_A") == "imported"
+
+
+# -------------------------------------------------------------------------------
+@pytest.mark.benchmark
+def test_settings_cache_benchmark(tmp_path):
+    settingsFile = str(tmp_path / 'table_settings.json')
+    write_settings_file(settingsFile, {f"SETTING_{i}": f"value {i}" for i in range(500)})
+
+    # previous implementation - load and scan the whole file for every lookup
+    def get_setting_value_from_file(key):
+        with open(settingsFile, 'r') as json_file:
+            for item in json.load(json_file).get("data", []):
+                if item.get("Code_Name") == key:
+                    return setting_value_to_python_type(item["Type"], item["Value"])
+        return ''
+
+    def lookups_per_second(getter, lookups):
+        start = time.perf_counter()
+        for i in range(lookups):
+            getter(f"SETTING_{i % 500}")
+        return lookups / (time.perf_counter() - start)
+
+    cache = settings_cache_class(settingsFile)
+
+    before = lookups_per_second(get_setting_value_from_file, 500)
+    after = lookups_per_second(cache.get_value, 50000)
+
+    print(f"\n[Benchmark] Setting lookups per second - file: {before:,.0f} | cache: {after:,.0f}")
+
+    assert after > before * 10
+
+
+# -------------------------------------------------------------------------------
+def make_pholus_table(devices, rowsPerDevice):
+    # synthetic Pholus_Scan answers, the useful names are at the end of each device's records
+    rows = []
+    for i in range(devices):
+        mac = f"aa:bb:cc:{i // 65536:02x}:{i // 256 % 256:02x}:{i % 256:02x}"
+        ip = f"10.{i // 65536}.{i // 256 % 256}.{i % 256}"
+        for j in range(rowsPerDevice - 2):
+            rows.append({"MAC": mac, "IP_v4_or_v6": ip, "Record_Type": "Answer", "Value": f"_service{j}._tcp.local. SRV Class:IN"})
+        rows.append({"MAC": mac, "IP_v4_or_v6": ip, "Record_Type": "Answer", "Value": f'10.0.0.{i % 256}.in-addr.arpa. PTR Class:32769 "device-{i}"'})
+        rows.append({"MAC": mac, "IP_v4_or_v6": ip, "Record_Type": "Answer", "Value": f'device-{i}-airplay._airplay._tcp.local. TXT Class:32769 "acl=0"'})
+    return rows
+
+# -------------------------------------------------------------------------------
+def test_pholus_names():
+    rows = make_pholus_table(3, 5)
+    rows.append({"MAC": "ff:ff:ff:ff:ff:ff", "IP_v4_or_v6": "fe80::1", "Record_Type": "Answer", "Value": '_x._tcp.local. PTR Class:IN "ipv6-only.local."'})
+
+    names = pholus_names_class(rows)
+
+    # first usable record wins
+    assert names.get("aa:bb:cc:00:00:01", "", "(name not found)") == "device-1"
+    # IP matches are tagged
+    assert names.get("00:00:00:00:00:00", "10.0.0.2", "(name not found)", True) == "device-2 (IP match)"
+    assert names.get("00:00:00:00:00:00", "10.0.0.2", "(name not found)") == "(name not found)"
+    # only IPv4 records are used
+    assert names.get("ff:ff:ff:ff:ff:ff", "fe80::1", "(name not found)", True) == "(name not found)"
+
+# -------------------------------------------------------------------------------
+def benchmark_pholus_names(devices, rowsPerDevice = 20):
+    rows = make_pholus_table(devices, rowsPerDevice)
+
+    start = time.perf_counter()
+    names = pholus_names_class(rows)
+    for i in range(devices):
+        names.get("00:00:00:00:00:00", f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", "(name not found)", True)
+    return time.perf_counter() - start
+
+# -------------------------------------------------------------------------------
+@pytest.mark.benchmark
+def test_pholus_names_benchmark():
+    small = min(benchmark_pholus_names(1000) for _ in range(3))
+    large = min(benchmark_pholus_names(10000) for _ in range(3))
+
+    print(f"\n[Benchmark] Pholus names   1000 devices /  20000 records: {small:.4f}s")
+    print(f"[Benchmark] Pholus names  10000 devices / 200000 records: {large:.4f}s")
+
+    # 10x the devices and records - linear is ~10x the time, scanning all records per device was ~100x
+    assert large < small * 30
+
+
+# -------------------------------------------------------------------------------
+# dns.resolver.Resolver stand-in answering PTR queries from a dictionary
+class stub_resolver_class:
+    def __init__(self, names, ttl = 600):
+        self.names = names
+        self.ttl = ttl
+        self.queries = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.maxActive = 0
+
+    def resolve(self, qname, rdtype, lifetime = None):
+        ip = '.'.join(reversed(str(qname).split('.')[:4]))
+
+        with self.lock:
+            self.queries.append(ip)
+            self.active += 1
+            self.maxActive = max(self.maxActive, self.active)
+
+        time.sleep(0.01)
+
+        with self.lock:
+            self.active -= 1
+
+        if ip not in self.names:
+            raise dns.resolver.NXDOMAIN()
+
+        answer = type('answer', (list,), {})([type('ptr', (), {'target': self.names[ip]})()])
+        answer.rrset = type('rrset', (), {'ttl': self.ttl})()
+
+        return answer
+
+# -------------------------------------------------------------------------------
+def test_reverse_dns_resolver():
+    names = {f'10.0.0.{i}': f'host{i}.lan.' for i in range(0, 40, 2)}
+
+    resolver = reverse_dns_resolver_class(maxWorkers = 8)
+    resolver.resolver = stub_resolver_class(names)
+
+    devices = [(f'aa:bb:cc:dd:ee:{i:02x}', f'10.0.0.{i}') for i in range(40)]
+
+    # found names, the others are omitted
+    assert resolver.resolve(devices) == {f'aa:bb:cc:dd:ee:{i:02x}': f'host{i}.lan.' for i in range(0, 40, 2)}
+
+    # one query per IP, run concurrently within the worker limit
+    assert sorted(resolver.resolver.queries) == sorted(ip for mac, ip in devices)
+    assert 1 < resolver.resolver.maxActive <= 8
+
+    # found names are cached, not found ones are backed off - no new queries
+    resolver.resolver.queries = []
+    assert len(resolver.resolve(devices)) == 20
+    assert resolver.resolver.queries == []
+    assert resolver.notFound['aa:bb:cc:dd:ee:01'][0] == 1
+
+    # expired entries are queried again, a second failure doubles the backoff
+    resolver.found['10.0.0.0'] = ('host0.lan.', 0)
+    resolver.notFound['aa:bb:cc:dd:ee:01'] = (1, 0)
+
+    assert resolver.resolve(devices[:2]) == {'aa:bb:cc:dd:ee:00': 'host0.lan.'}
+    assert sorted(resolver.resolver.queries) == ['10.0.0.0', '10.0.0.1']
+
+    attempts, retry = resolver.notFound['aa:bb:cc:dd:ee:01']
+    assert attempts == 2
+    assert retry - time.monotonic() > resolver.backoffBase * 1.5
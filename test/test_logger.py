@@ -0,0 +1,70 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import logger
+from logger import log_writer_class, setLogLevel, mylog
+
+
+# -------------------------------------------------------------------------------
+def read_lines(path):
+    with open(path) as file:
+        return file.read().splitlines()
+
+
+# -------------------------------------------------------------------------------
+def test_log_writer_keeps_the_order(tmp_path):
+    path = str(tmp_path / 'app.log')
+    writer = log_writer_class(path, batch_size = 7)
+
+    for i in range(1000):
+        writer.write(f'line {i}\n')
+
+    writer.flush()
+
+    assert read_lines(path) == [f'line {i}' for i in range(1000)]
+
+    writer.close()
+
+
+# -------------------------------------------------------------------------------
+def test_log_writer_close_writes_the_queue(tmp_path):
+    path = str(tmp_path / 'app.log')
+    writer = log_writer_class(path)
+
+    for i in range(100):
+        writer.write(f'line {i}\n')
+
+    # as on exit (registered with atexit)
+    writer.close()
+
+    assert not writer.thread.is_alive()
+
+    # lines logged after the close are appended directly
+    writer.write('after close\n')
+
+    assert read_lines(path) == [f'line {i}' for i in range(100)] + ['after close']
+
+
+# -------------------------------------------------------------------------------
+def test_log_level(monkeypatch):
+    lines = []
+    monkeypatch.setattr(logger, 'file_print', lambda *args: lines.append(''.join(str(arg) for arg in args)))
+
+    level = logger.currentLevelName
+
+    try:
+        setLogLevel('verbose')
+
+        mylog('verbose', ['shown'])
+        mylog('debug', ['hidden'])
+        mylog('debug', lambda: 1 / 0)    # not evaluated
+
+        setLogLevel('debug')
+        mylog('debug', lambda: 'lazy')
+    finally:
+        setLogLevel(level)
+
+    assert lines == ['shown', 'lazy']
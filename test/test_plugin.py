@@ -0,0 +1,113 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import threading
+import time
+
+import pytest
+
+import plugin
+from plugin import run_plugin_scripts, run_plugin_layer, plugins_state
+
+
+# -------------------------------------------------------------------------------
+def make_plugin(prefix, order = None):
+    config = {"unique_prefix": prefix, "data_source": "script",
+              "settings": [{"function": "RUN", "value": "always_after_scan"},
+                           {"function": "CMD", "value": f"python3 /app/front/plugins/{prefix}/script.py"}]}
+
+    if order is not None:
+        config["execution_order"] = order
+
+    return config
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def commands(monkeypatch):
+    # records the executed commands instead of running them
+    state = {"executed": [], "active": 0, "maxActive": 0, "maxWorkers": 4, "fail": set()}
+    lock = threading.Lock()
+
+    def run_plugin_command(config, command, timeout):
+        with lock:
+            state["active"] += 1
+            state["maxActive"] = max(state["maxActive"], state["active"])
+
+        time.sleep(0.05)
+
+        with lock:
+            state["active"] -= 1
+            state["executed"].append(config["unique_prefix"])
+
+        if config["unique_prefix"] in state["fail"]:
+            raise FileNotFoundError('python3')
+
+    monkeypatch.setattr(plugin, 'run_plugin_command', run_plugin_command)
+    monkeypatch.setattr(plugin, 'prepare_plugin_command', lambda db, config, cmd: (cmd.split(), 10))
+    monkeypatch.setattr(plugin, 'print_plugin_info', lambda config, elements: None)
+    monkeypatch.setattr(plugin, 'updateState', lambda state: None)
+    monkeypatch.setattr(plugin, 'get_setting_value', lambda key: state["maxWorkers"] if key == 'PLUGINS_MAX_WORKERS' else '')
+
+    return state
+
+
+# -------------------------------------------------------------------------------
+def test_plugins_are_grouped_by_declared_layer(commands, monkeypatch):
+    layers = []
+
+    def run_layer(db, layerPlugins):
+        layers.append([config["unique_prefix"] for config in layerPlugins])
+        return layers[-1]
+
+    monkeypatch.setattr(plugin, 'run_plugin_layer', run_layer)
+    monkeypatch.setattr(plugin, 'execute_plugin', lambda db, all_plugins, config, pluginsState, executed: pluginsState)
+
+    # sorted by layer, as returned by get_plugins_configs
+    all_plugins = [make_plugin('ARPSCAN', 'Layer_0'), make_plugin('PIHOLE', 'Layer_0'), make_plugin('NMAP', 'Layer_1'),
+                   make_plugin('DBCLNP'), make_plugin('SYNC'), make_plugin('CSVBCKP', 'Layer_N')]
+
+    run_plugin_scripts(None, all_plugins, 'always_after_scan', plugins_state())
+
+    # plugins without an explicit execution_order run one after the other
+    assert layers == [['ARPSCAN', 'PIHOLE'], ['NMAP'], ['DBCLNP'], ['SYNC'], ['CSVBCKP']]
+
+
+# -------------------------------------------------------------------------------
+def test_layer_runs_concurrently(commands):
+    layer = [make_plugin(f'PLUG{i}', 'Layer_0') for i in range(6)]
+
+    assert run_plugin_layer(None, layer) == [f'PLUG{i}' for i in range(6)]
+
+    assert sorted(commands["executed"]) == [f'PLUG{i}' for i in range(6)]
+    assert 1 < commands["maxActive"] <= 4
+
+
+# -------------------------------------------------------------------------------
+def test_layer_max_workers(commands):
+    commands["maxWorkers"] = 1
+
+    layer = [make_plugin(f'PLUG{i}', 'Layer_0') for i in range(3)]
+    run_plugin_layer(None, layer)
+
+    # sequential, in the execution order
+    assert commands["executed"] == ['PLUG0', 'PLUG1', 'PLUG2']
+    assert commands["maxActive"] == 1
+
+
+# -------------------------------------------------------------------------------
+def test_layer_errors_are_logged(commands, monkeypatch):
+    logged = []
+    monkeypatch.setattr(plugin, 'mylog', lambda level, message: logged.append(''.join(str(part) for part in message)))
+
+    commands["fail"] = {'PLUG1'}
+
+    layer = [make_plugin(f'PLUG{i}', 'Layer_0') for i in range(3)]
+
+    # the other plugins of the layer are still executed
+    assert run_plugin_layer(None, layer) == ['PLUG0', 'PLUG1', 'PLUG2']
+    assert sorted(commands["executed"]) == ['PLUG0', 'PLUG1', 'PLUG2']
+
+    assert [line for line in logged if 'ERROR' in line] == ['[Plugins] ⚠ ERROR - the plugin PLUG1 could not be executed: python3']
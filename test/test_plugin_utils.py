@@ -0,0 +1,118 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import time
+from collections import Counter
+
+import pytest
+
+from plugin import plugin_object_class
+from plugin_utils import diff_plugin_objects
+
+
+plugin = {
+    "unique_prefix": "TEST",
+    "settings": [{"function": "WATCH", "value": ["Watched_Value1"]}]
+}
+
+# -------------------------------------------------------------------------------
+def make_row(primaryId, secondaryId, watched1, status, index=0):
+    return [index, "TEST", primaryId, secondaryId, "2024-01-01 00:00:00", "2024-01-01 00:00:00",
+            watched1, "w2", "w3", "w4", status, "extra", "user data", "fk", "", "", "", "", ""]
+
+# -------------------------------------------------------------------------------
+def make_objects(count, status, watched1="online", offset=0):
+    return [plugin_object_class(plugin, make_row(f"mac_{i}", f"ip_{i}", watched1, status, i + 1))
+            for i in range(offset, offset + count)]
+
+
+# -------------------------------------------------------------------------------
+def test_diff_plugin_objects_statuses():
+    pluginObjects = [
+        plugin_object_class(plugin, make_row("aa", "1", "online", "watched-not-changed", 1)),
+        plugin_object_class(plugin, make_row("bb", "2", "online", "watched-not-changed", 2)),
+        plugin_object_class(plugin, make_row("cc", "3", "online", "watched-not-changed", 3)),
+        plugin_object_class(plugin, make_row("dd", "4", "online", "missing-in-last-scan", 4)),
+    ]
+    pluginEvents = [
+        plugin_object_class(plugin, make_row("aa", "1", "online", "not-processed")),
+        plugin_object_class(plugin, make_row("bb", "2", "offline", "not-processed")),
+        plugin_object_class(plugin, make_row("ee", "5", "online", "not-processed")),
+    ]
+
+    objects, events = diff_plugin_objects(pluginObjects, pluginEvents)
+
+    statuses = {obj.primaryId: obj.status for obj in objects}
+
+    assert statuses == {
+        "aa": "watched-not-changed",
+        "bb": "watched-changed",
+        "cc": "missing-in-last-scan",
+        "dd": "missing-in-last-scan",
+        "ee": "new",
+    }
+    assert len(events) == 3
+
+    # merged objects keep the DB index and user data of the existing object
+    merged = {obj.primaryId: obj for obj in objects}
+    assert merged["bb"].index == 2
+    assert merged["bb"].userData == "user data"
+    assert merged["bb"].watched1 == "offline"
+
+    # an object already missing keeps its changed time
+    assert merged["dd"].changed == "2024-01-01 00:00:00"
+    assert merged["cc"].changed != "2024-01-01 00:00:00"
+
+
+# -------------------------------------------------------------------------------
+def test_diff_plugin_objects_duplicate_events():
+    pluginEvents = [
+        plugin_object_class(plugin, make_row("aa", "1", "online", "not-processed")),
+        plugin_object_class(plugin, make_row("aa", "1", "offline", "not-processed")),
+    ]
+
+    objects, events = diff_plugin_objects([], pluginEvents)
+
+    assert len(objects) == 1
+    assert objects[0].status == "new"
+    assert objects[0].watched1 == "offline"
+
+
+# -------------------------------------------------------------------------------
+# half of the objects are reported again, half are missing, plus the same amount of new ones
+def make_scan(count):
+    pluginObjects = make_objects(count, "watched-not-changed")
+    pluginEvents = make_objects(count // 2, "not-processed", "offline") + make_objects(count // 2, "not-processed", offset=count)
+
+    return pluginObjects, pluginEvents
+
+# -------------------------------------------------------------------------------
+def test_diff_plugin_objects_many_objects():
+    objects, events = diff_plugin_objects(*make_scan(2000))
+
+    assert Counter(obj.status for obj in objects) == {"watched-changed": 1000, "missing-in-last-scan": 1000, "new": 1000}
+    assert sorted(obj.index for obj in objects if obj.status != "new") == list(range(1, 2001))
+    assert len(events) == 2000
+
+# -------------------------------------------------------------------------------
+def benchmark_diff(count):
+    pluginObjects, pluginEvents = make_scan(count)
+
+    start = time.perf_counter()
+    diff_plugin_objects(pluginObjects, pluginEvents)
+    return time.perf_counter() - start
+
+# -------------------------------------------------------------------------------
+@pytest.mark.benchmark
+def test_diff_plugin_objects_scales_linearly():
+    small = min(benchmark_diff(5000) for _ in range(3))
+    large = min(benchmark_diff(20000) for _ in range(3))
+
+    print(f"\n[Benchmark] diff_plugin_objects   5000 objects: {small:.4f}s")
+    print(f"[Benchmark] diff_plugin_objects  20000 objects: {large:.4f}s")
+
+    # 4x the input - linear is ~4x the time, the previous nested scans were ~16x
+    assert large < small * 10
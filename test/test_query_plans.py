@@ -0,0 +1,181 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import re
+import shutil
+
+import pytest
+
+import database
+from database import DB
+from const import (sql_plugins_objects_plugin, sql_plugins_events_plugin, sql_plugins_history_plugin, sql_plugins_history,
+                   sql_plugins_objects_update, sql_plugins_device_names, sql_notifications_new, sql_notifications_set_processed,
+                   sql_notifications_remove, sql_appevents_after, sql_appevents_export, sql_appevents_oldest,
+                   sql_plugins_history_plugins, sql_plugins_history_trim, sql_notifications_trim, sql_appevents_trim,
+                   sql_plugins_objects_dedupe)
+
+
+legacyDbPath = str(pathlib.Path(__file__).parent.parent.resolve()) + "/back/app.db"
+
+hotTables = ['Plugins_Objects', 'Plugins_Events', 'Plugins_History', 'AppEvents', 'Notifications']
+
+plugins = ['ARPSCAN', 'AVAHISCAN', 'NSLOOKUP', 'NBTSCAN', 'INTRNT', 'NMAP', 'DHCPLSS', 'PIHOLE', 'SNMPDSC', 'UNFIMP']
+
+# Hot queries of the backend, API and DB cleanup plugin on the hot tables: [description, query, params]
+hotQueries = [
+    ['API plugin objects shard',        sql_plugins_objects_plugin, ('ARPSCAN',)],
+    ['API plugin events shard',         sql_plugins_events_plugin, ('ARPSCAN',)],
+    ['API plugin history shard',        sql_plugins_history_plugin, ('ARPSCAN',)],
+    ['API plugin history',              sql_plugins_history, ()],
+    # plugin.process_plugin_events
+    ['Plugin objects of a plugin',      sql_plugins_objects_plugin, ('ARPSCAN',)],
+    ['Plugin object update',            sql_plugins_objects_update, ('ARPSCAN', 'id', '', '', '', '', '', '', '', 'new', '', '', '', '', '', '', '', '', 1)],
+    # helper.plugin_device_names_class
+    ['Device names from plugins',       sql_plugins_device_names.format(placeholders = '?, ?, ?'), ('AVAHISCAN', 'NSLOOKUP', 'NBTSCAN')],
+    # notification.Notification_obj
+    ['New notifications',               sql_notifications_new, ()],
+    ['Processed notifications',         sql_notifications_set_processed, ()],
+    ['Remove notification',             sql_notifications_remove, ('guid',)],
+    # appevent.app_events_feed_class
+    ['App events after cursor',         sql_appevents_after, (100, 1000)],
+    ['App events export',               sql_appevents_export, (100,)],
+    ['Oldest app event',                sql_appevents_oldest, ()],
+    # db_cleanup plugin
+    ['Plugins with history',            sql_plugins_history_plugins, ()],
+    ['Trim plugin history',             sql_plugins_history_trim, ('ARPSCAN', 'ARPSCAN', 50)],
+    ['Trim notifications',              sql_notifications_trim, (100,)],
+    ['Trim app events',                 sql_appevents_trim, (100,)],
+    ['Dedupe plugin objects',           sql_plugins_objects_dedupe, ()],
+]
+
+# Expected scans of hot tables
+expectedScans = {
+    # the rowid in reverse order, stopped by the LIMIT after the latest <n> rows
+    'Trim notifications':       ['SCAN Notifications'],
+    'Trim app events':          ['SCAN AppEvents'],
+    # every object is checked once, the duplicates are looked up with the (Plugin, Object_PrimaryID) index
+    'Dedupe plugin objects':    ['SCAN Plugins_Objects'],
+}
+
+
+# -------------------------------------------------------------------------------
+@pytest.fixture(scope = 'module', params = [False, True], ids = ['no-stats', 'analyzed'])
+def db(tmp_path_factory, request):
+    # legacy DB migrated to the latest schema, populated with plugin data
+    path = str(tmp_path_factory.mktemp('db') / 'app.db')
+    shutil.copyfile(legacyDbPath, path)
+
+    fullDbPath = database.fullDbPath
+    database.fullDbPath = path
+
+    db = DB()
+    db.open()
+    db.upgradeDB()
+
+    database.fullDbPath = fullDbPath
+
+    rows = [(plugin, f'aa:bb:cc:dd:{i // 256:02x}:{i % 256:02x}', f'192.168.{i // 256}.{i % 256}', f'2024-01-01 00:{i % 60:02d}:00',
+             f'2024-01-01 00:{i % 60:02d}:00', f'name{i}', 'w2', 'w3', 'w4', 'watched-not-changed', '', '', '')
+            for plugin in plugins for i in range(300)]
+
+    for table in ['Plugins_Objects', 'Plugins_Events', 'Plugins_History']:
+        db.sql.executemany(f"""INSERT INTO {table} (Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged,
+                               Watched_Value1, Watched_Value2, Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+
+    db.sql.executemany("""INSERT INTO Notifications (GUID, DateTimeCreated, Status, JSON, Text, HTML, PublishedVia, Extra)
+                          VALUES (?, ?, ?, '{}', '', '', '', '')""",
+                       [(f'guid{i}', f'2024-01-{i // 100 + 1:02d} 00:00:{i % 60:02d}', 'new' if i % 50 == 0 else 'processed') for i in range(1000)])
+
+    if request.param:
+        db.sql.execute('ANALYZE')
+
+    yield db
+
+    db.sql_connection.close()
+
+# -------------------------------------------------------------------------------
+# Returns the full table scans of hot tables in the query plan
+def get_table_scans(db, query, params):
+    plan = db.sql.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()
+
+    scans = []
+    for row in plan:
+        detail = row[3]
+        match = re.match(r'SCAN (TABLE )?(\w+)', detail)
+
+        # "SCAN <table> USING [COVERING] INDEX ..." reads an index, not the table
+        if match and match.group(2) in hotTables and 'INDEX' not in detail:
+            scans.append(detail)
+
+    return scans
+
+
+# -------------------------------------------------------------------------------
+@pytest.mark.parametrize('description, query, params', hotQueries, ids = [query[0] for query in hotQueries])
+def test_hot_query_uses_index(db, description, query, params):
+    assert get_table_scans(db, query, params) == expectedScans.get(description, [])
+
+
+# -------------------------------------------------------------------------------
+def test_full_scans_are_detected(db):
+    assert get_table_scans(db, 'SELECT * FROM Plugins_Objects WHERE Extra = ?', ('x',)) != []
+
+
+# -------------------------------------------------------------------------------
+def test_trim_queries(db):
+    db.sql.execute('SAVEPOINT trim')
+
+    db.sql.execute(sql_plugins_history_trim, ('ARPSCAN', 'ARPSCAN', 50))
+    db.sql.execute(sql_notifications_trim, (100,))
+    db.sql.execute(sql_appevents_trim, (100,))
+
+    assert db.sql.execute("SELECT COUNT(*) FROM Plugins_History WHERE Plugin = 'ARPSCAN'").fetchone()[0] == 50
+    assert db.sql.execute("SELECT COUNT(*) FROM Plugins_History WHERE Plugin = 'NMAP'").fetchone()[0] == 300
+    assert db.sql.execute("SELECT COUNT(*) FROM Notifications").fetchone()[0] == 100
+    assert db.sql.execute("SELECT MIN(DateTimeCreated) FROM Notifications").fetchone()[0] == '2024-01-10 00:00:00'
+    assert db.sql.execute("SELECT COUNT(*) FROM AppEvents").fetchone()[0] == 100
+
+    db.sql.execute('ROLLBACK TO trim')
+
+    # notifications created at the same time, app events with gaps in the "Index"
+    db.sql.execute("UPDATE Notifications SET DateTimeCreated = '2024-01-01 00:00:00'")
+    db.sql.execute('DELETE FROM AppEvents WHERE "Index" % 3 = 0')
+    appEvents = db.sql.execute('SELECT "Index" FROM AppEvents ORDER BY "Index" DESC LIMIT 100').fetchall()
+
+    db.sql.execute(sql_notifications_trim, (100,))
+    db.sql.execute(sql_appevents_trim, (100,))
+
+    assert db.sql.execute("SELECT COUNT(*) FROM Notifications").fetchone()[0] == 100
+    assert db.sql.execute("SELECT MIN(GUID) FROM Notifications").fetchone()[0] == 'guid900'
+    assert db.sql.execute('SELECT "Index" FROM AppEvents ORDER BY "Index" DESC').fetchall() == appEvents
+
+    db.sql.execute('ROLLBACK TO trim')
+
+    # duplicate plugin objects, the first one of each is kept
+    objects = db.sql.execute('SELECT "Index" FROM Plugins_Objects ORDER BY "Index"').fetchall()
+    db.sql.execute("""INSERT INTO Plugins_Objects (Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged,
+                      Watched_Value1, Watched_Value2, Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey)
+                      SELECT Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged, Watched_Value1,
+                      'changed', Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey FROM Plugins_Objects WHERE Plugin = 'NMAP'""")
+    db.sql.execute("""INSERT INTO Plugins_Objects (Plugin, Object_PrimaryID, Object_SecondaryID, DateTimeCreated, DateTimeChanged,
+                      Watched_Value1, Watched_Value2, Watched_Value3, Watched_Value4, Status, Extra, UserData, ForeignKey)
+                      VALUES ('NMAP', 'aa:bb:cc:dd:00:00', '192.168.0.0', '', '', '', '', '', '', '', '', 'user data', '')""")
+
+    db.sql.execute(sql_plugins_objects_dedupe)
+
+    assert db.sql.execute('SELECT "Index" FROM Plugins_Objects ORDER BY "Index"').fetchall()[:len(objects)] == objects
+    assert db.sql.execute("SELECT COUNT(*) FROM Plugins_Objects").fetchone()[0] == len(objects) + 1
+
+    db.sql.execute('ROLLBACK TO trim')
+    db.sql.execute('RELEASE trim')
+
+
+# -------------------------------------------------------------------------------
+def test_notifications_indexes(db):
+    indexes = [row[0] for row in db.sql.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'Notifications' AND name LIKE 'IDX_%'")]
+
+    assert indexes == ['IDX_Notifications_Status']
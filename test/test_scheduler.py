@@ -0,0 +1,123 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import os
+import datetime
+import threading
+import time
+
+import pytest
+
+import conf
+import scheduler
+from scheduler import seconds_to_next_run, schedule_due, file_watcher_class
+
+
+nowTime = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+# -------------------------------------------------------------------------------
+class fake_schedule_class:
+    def __init__(self, service, nextRun):
+        self.service = service
+        self.next = nextRun
+
+    def nextRun(self):
+        return self.next
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def schedules(monkeypatch):
+    # last processing cycle 20 seconds ago
+    monkeypatch.setattr(conf, 'last_scan_run', nowTime - datetime.timedelta(seconds=20))
+    monkeypatch.setattr(conf, 'mySchedules', [])
+
+    runTypes = {}
+    monkeypatch.setattr(scheduler, 'get_setting_value', lambda key: runTypes.get(key, ''))
+
+    return runTypes
+
+
+# -------------------------------------------------------------------------------
+def test_seconds_to_next_run(schedules):
+    # next 1 minute cycle
+    assert seconds_to_next_run(nowTime) == 41
+    assert not schedule_due(nowTime)
+
+    # an earlier schedule of a plugin set to run on schedule
+    conf.mySchedules.append(fake_schedule_class('NMAP', nowTime + datetime.timedelta(seconds=10)))
+    assert seconds_to_next_run(nowTime) == 41
+
+    schedules['NMAP_RUN'] = 'schedule'
+    assert seconds_to_next_run(nowTime) == 11
+    assert not schedule_due(nowTime)
+    assert schedule_due(nowTime + datetime.timedelta(seconds=11))
+
+    # a later schedule doesn't delay the cycle, an overdue cycle doesn't wait
+    conf.mySchedules[0].next = nowTime + datetime.timedelta(minutes=5)
+    assert seconds_to_next_run(nowTime) == 41
+    assert seconds_to_next_run(nowTime + datetime.timedelta(minutes=2)) == 0
+
+
+# -------------------------------------------------------------------------------
+def test_schedules_before_the_last_cycle_are_ignored(schedules):
+    # already handled by the last processing cycle
+    schedules['NMAP_RUN'] = 'schedule'
+    conf.mySchedules.append(fake_schedule_class('NMAP', nowTime - datetime.timedelta(seconds=30)))
+
+    assert seconds_to_next_run(nowTime) == 41
+    assert not schedule_due(nowTime)
+
+
+# -------------------------------------------------------------------------------
+def write_later(path, delay = 0.2):
+    def write():
+        with open(path, 'w') as f:
+            f.write('changed')
+
+    timer = threading.Timer(delay, write)
+    timer.start()
+    return timer
+
+# -------------------------------------------------------------------------------
+@pytest.mark.parametrize('inotify', [True, False], ids = ['inotify', 'polling'])
+def test_file_watcher(tmp_path, inotify):
+    confPath = str(tmp_path / 'app.conf')
+    with open(confPath, 'w') as f:
+        f.write('initial')
+
+    watcher = file_watcher_class([confPath, str(tmp_path / 'execution_queue.log')])
+
+    if not inotify:
+        if watcher.fd is not None:
+            os.close(watcher.fd)
+            watcher.fd = None
+    elif watcher.fd is None:
+        pytest.skip('inotify not available')
+
+    # timeout without changes
+    start = time.monotonic()
+    assert watcher.wait(0.3) is False
+    assert time.monotonic() - start >= 0.3
+
+    # other files in the folder don't wake up the watcher
+    with open(str(tmp_path / 'other.txt'), 'w') as f:
+        f.write('x')
+    assert watcher.wait(0.3) is False
+
+    # a config write wakes it up before the timeout
+    os.utime(confPath, (time.time() - 10, time.time() - 10))
+    watcher.modified = watcher.getModified()
+
+    start = time.monotonic()
+    write_later(confPath)
+    assert watcher.wait(10) is True
+    assert time.monotonic() - start < 5
+
+    # a file created by the frontend
+    start = time.monotonic()
+    write_later(str(tmp_path / 'execution_queue.log'))
+    assert watcher.wait(10) is True
+    assert time.monotonic() - start < 5
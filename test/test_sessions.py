@@ -0,0 +1,552 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parent.parent.resolve()) + "/server/")
+
+
+import random
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+import database
+from database import DB, current_scan_upsert
+from device import presence_diff_class
+from const import sql_insert_sessions, sql_sessions_columns
+import networkscan
+from networkscan import insert_events as insert_scan_events, pair_sessions_events, update_sessions, reconcile_sessions, process_scan
+
+
+legacyDbPath = str(pathlib.Path(__file__).parent.parent.resolve()) + "/back/app.db"
+
+# -------------------------------------------------------------------------------
+# The previous pairing with a correlated subquery per unpaired event, as reference
+def legacy_pair_sessions_events(sql):
+
+    sql.execute("""UPDATE Events
+                    SET eve_PairEventRowid =
+                       (SELECT ROWID
+                        FROM Events AS EVE2
+                        WHERE EVE2.eve_EventType IN ('New Device', 'Connected', 'Down Reconnected',
+                            'Device Down', 'Disconnected')
+                           AND EVE2.eve_MAC = Events.eve_MAC
+                           AND EVE2.eve_Datetime > Events.eve_DateTime
+                        ORDER BY EVE2.eve_DateTime ASC LIMIT 1)
+                    WHERE eve_EventType IN ('New Device', 'Connected', 'Down Reconnected')
+                    AND eve_PairEventRowid IS NULL
+                 """)
+
+    sql.execute("""UPDATE Events
+                    SET eve_PairEventRowid =
+                        (SELECT ROWID
+                         FROM Events AS EVE2
+                         WHERE EVE2.eve_PairEventRowid = Events.ROWID)
+                    WHERE eve_EventType IN ('Device Down', 'Disconnected')
+                      AND eve_PairEventRowid IS NULL
+                 """)
+
+# -------------------------------------------------------------------------------
+# The previous detection of connections with the LatestEventsPerMAC view, as reference
+legacy_latest_events_view = """CREATE TEMP VIEW LatestEventsPerMAC AS
+                                   WITH RankedEvents AS (
+                                       SELECT e.*, ROW_NUMBER() OVER (PARTITION BY e.eve_MAC ORDER BY e.eve_DateTime DESC) AS row_num
+                                       FROM Events AS e
+                                   )
+                                   SELECT e.*, d.*, c.*
+                                   FROM RankedEvents AS e
+                                   LEFT JOIN Devices AS d ON e.eve_MAC = d.dev_MAC
+                                   INNER JOIN CurrentScan AS c ON e.eve_MAC = c.cur_MAC
+                                   WHERE e.row_num = 1"""
+
+legacy_connections = """SELECT DISTINCT c.cur_MAC, c.cur_IP,
+                               CASE WHEN last_event.eve_EventType = 'Device Down' and last_event.eve_PendingAlertEmail = 0
+                                    THEN 'Down Reconnected' ELSE 'Connected' END
+                        FROM LatestEventsPerMAC AS d
+                        JOIN CurrentScan AS c ON d.dev_MAC = c.cur_MAC
+                        LEFT JOIN LatestEventsPerMAC AS last_event ON d.dev_MAC = last_event.eve_MAC
+                        WHERE d.dev_PresentLastScan = 0"""
+
+# -------------------------------------------------------------------------------
+# The previous event detection with one INSERT ... SELECT per event type, as reference
+def legacy_insert_events(sql, startTime):
+
+    sql.execute(f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                    SELECT dev_MAC, dev_LastIP, '{startTime}', 'Device Down', '', 1
+                    FROM Devices
+                    WHERE dev_AlertDeviceDown != 0 AND dev_PresentLastScan = 1
+                      AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)""")
+
+    sql.execute(f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                    SELECT DISTINCT c.cur_MAC, c.cur_IP, '{startTime}',
+                           CASE WHEN last_event.eve_EventType = 'Device Down' and last_event.eve_PendingAlertEmail = 0
+                                THEN 'Down Reconnected' ELSE 'Connected' END, '', 1
+                    FROM CurrentScan AS c
+                    JOIN Devices AS d ON d.dev_MAC = c.cur_MAC
+                    JOIN LastEvent ON lev_MAC = c.cur_MAC
+                    JOIN Events AS last_event ON last_event.rowid = lev_EventRowid
+                    WHERE d.dev_PresentLastScan = 0""")
+
+    sql.execute(f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                    SELECT dev_MAC, dev_LastIP, '{startTime}', 'Disconnected', '', dev_AlertEvents
+                    FROM Devices
+                    WHERE dev_AlertDeviceDown = 0 AND dev_PresentLastScan = 1
+                      AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)""")
+
+    sql.execute(f"""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                    SELECT cur_MAC, cur_IP, '{startTime}', 'IP Changed', 'Previous IP: '|| dev_LastIP, dev_AlertEvents
+                    FROM Devices, CurrentScan
+                    WHERE dev_MAC = cur_MAC AND dev_LastIP <> cur_IP""")
+
+# -------------------------------------------------------------------------------
+def open_db(path):
+    database.fullDbPath = path
+
+    db = DB()
+    db.open()
+    db.upgradeDB()
+
+    return db
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # legacy DB migrated to the latest schema
+    path = str(tmp_path / 'app.db')
+    shutil.copyfile(legacyDbPath, path)
+
+    monkeypatch.setattr(database, 'fullDbPath', path)
+
+    db = open_db(path)
+
+    yield db
+
+    db.sql_connection.close()
+
+# -------------------------------------------------------------------------------
+def insert_events(db, dateTime, events):
+    db.sql.executemany("""INSERT INTO Events (eve_MAC, eve_IP, eve_DateTime, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail)
+                          VALUES (?, '192.168.1.10', ?, ?, '', 1)""", [(mac, dateTime, eventType) for mac, eventType in events])
+
+# -------------------------------------------------------------------------------
+def get_sessions(db):
+    return sorted(tuple(row) for row in db.sql.execute(f"SELECT {sql_sessions_columns} FROM Sessions").fetchall())
+
+# -------------------------------------------------------------------------------
+def get_view_sessions(db):
+    return sorted(tuple(row) for row in db.sql.execute("SELECT * FROM Convert_Events_to_Sessions").fetchall())
+
+# -------------------------------------------------------------------------------
+def process_cycle(db):
+    pair_sessions_events(db)
+    update_sessions(db)
+
+    assert db.sql.execute("SELECT COUNT(*) FROM Sessions_Changes").fetchone()[0] == 0
+
+
+# -------------------------------------------------------------------------------
+def test_incremental_sessions_match_view(db):
+
+    insert_events(db, '2024-01-01 10:00:00', [('aa:00:00:00:00:01', 'New Device'), ('aa:00:00:00:00:02', 'Connected'),
+                                              ('aa:00:00:00:00:03', 'Disconnected')])
+    process_cycle(db)
+    assert len(get_sessions(db)) > 0
+    assert get_sessions(db) == get_view_sessions(db)
+
+    # the open sessions are closed
+    insert_events(db, '2024-01-01 10:05:00', [('aa:00:00:00:00:01', 'Disconnected'), ('aa:00:00:00:00:02', 'Device Down')])
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+    assert db.sql.execute("""SELECT ses_EventTypeDisconnection FROM Sessions
+                             WHERE ses_MAC = 'aa:00:00:00:00:01' AND ses_EventTypeConnection = 'New Device'""").fetchone()[0] == 'Disconnected'
+
+    # reconnection, voided ghost events and events deleted in the frontend
+    insert_events(db, '2024-01-01 10:10:00', [('aa:00:00:00:00:01', 'Connected'), ('aa:00:00:00:00:02', 'Connected')])
+    db.sql.execute("""UPDATE Events SET eve_PairEventRowid = NULL, eve_EventType = 'VOIDED - ' || eve_EventType
+                      WHERE eve_MAC = 'aa:00:00:00:00:01' AND eve_EventType = 'Disconnected'""")
+    db.sql.execute("UPDATE Events SET eve_PairEventRowid = NULL WHERE eve_MAC = 'aa:00:00:00:00:01' AND eve_EventType = 'New Device'")
+    db.sql.execute("DELETE FROM Events WHERE eve_MAC = 'aa:00:00:00:00:03'")
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+    assert db.sql.execute("SELECT COUNT(*) FROM Sessions WHERE ses_MAC = 'aa:00:00:00:00:03'").fetchone()[0] == 0
+
+    # deleted disconnection of a closed session
+    db.sql.execute("DELETE FROM Events WHERE eve_MAC = 'aa:00:00:00:00:02' AND eve_EventType = 'Device Down'")
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+
+    assert reconcile_sessions(db) is True
+
+
+# -------------------------------------------------------------------------------
+def test_only_changed_events_are_updated(db):
+
+    insert_events(db, '2024-01-01 10:00:00', [(f'aa:00:00:00:{i // 256:02x}:{i % 256:02x}', 'Connected') for i in range(500)])
+    process_cycle(db)
+
+    # sessions of events which didn't change are kept
+    db.sql.execute("UPDATE Sessions SET ses_AdditionalInfo = 'kept' WHERE ses_MAC = 'aa:00:00:00:00:01'")
+
+    insert_events(db, '2024-01-01 10:05:00', [('aa:00:00:00:00:02', 'Disconnected')])
+    process_cycle(db)
+
+    assert db.sql.execute("SELECT ses_AdditionalInfo FROM Sessions WHERE ses_MAC = 'aa:00:00:00:00:01'").fetchone()[0] == 'kept'
+    assert db.sql.execute("SELECT ses_StillConnected FROM Sessions WHERE ses_MAC = 'aa:00:00:00:00:02'").fetchone()[0] == 0
+
+    # the changed events are looked up by rowid, not by a scan of Events
+    plan = db.sql.execute('EXPLAIN QUERY PLAN ' + sql_insert_sessions.format(eventRowids = 'SELECT Event_Rowid FROM Sessions_Changes')).fetchall()
+    assert [row[3] for row in plan if row[3].startswith('SCAN EVE') or row[3].startswith('SCAN Events')] == []
+
+
+# -------------------------------------------------------------------------------
+def test_duplicate_events_have_one_session(db):
+
+    # the same connection and an unpaired disconnection reported twice
+    insert_events(db, '2024-01-01 10:00:00', [('aa:00:00:00:00:01', 'Connected'), ('aa:00:00:00:00:01', 'Connected'),
+                                              ('aa:00:00:00:00:02', 'Disconnected'), ('aa:00:00:00:00:02', 'Disconnected')])
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+    assert len(get_sessions(db)) == 2
+
+    # both connections are paired with the same disconnection
+    insert_events(db, '2024-01-01 10:05:00', [('aa:00:00:00:00:01', 'Disconnected')])
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+
+    # the first duplicate changes - the session of the second one is inserted
+    db.sql.execute("""UPDATE Events SET eve_AdditionalInfo = 'changed'
+                      WHERE rowid = (SELECT MIN(rowid) FROM Events WHERE eve_MAC = 'aa:00:00:00:00:01' AND eve_EventType = 'Connected')""")
+    process_cycle(db)
+    assert get_sessions(db) == get_view_sessions(db)
+    assert len(get_sessions(db)) == 3
+
+    assert reconcile_sessions(db) is True
+
+# -------------------------------------------------------------------------------
+def test_reconciliation_detects_duplicates(db):
+
+    insert_events(db, '2024-01-01 10:00:00', [('aa:00:00:00:00:01', 'Connected')])
+    process_cycle(db)
+
+    # a second copy of a session, not visible to EXCEPT
+    db.sql.execute(f"INSERT INTO Sessions ({sql_sessions_columns}) SELECT {sql_sessions_columns} FROM Sessions")
+
+    assert reconcile_sessions(db) is False
+    assert get_sessions(db) == get_view_sessions(db)
+
+    assert reconcile_sessions(db) is True
+
+
+# -------------------------------------------------------------------------------
+def test_reconciliation_repairs_drift(db):
+
+    insert_events(db, '2024-01-01 10:00:00', [('aa:00:00:00:00:01', 'Connected'), ('aa:00:00:00:00:02', 'Connected')])
+    process_cycle(db)
+
+    # changes not tracked by the triggers
+    db.sql.execute("DELETE FROM Sessions WHERE ses_MAC = 'aa:00:00:00:00:01'")
+    db.sql.execute("""INSERT INTO Sessions (ses_MAC, ses_EventTypeConnection, ses_StillConnected)
+                      VALUES ('aa:00:00:00:00:09', 'Connected', 1)""")
+
+    assert reconcile_sessions(db) is False
+    assert get_sessions(db) == get_view_sessions(db)
+
+    assert reconcile_sessions(db) is True
+
+
+# -------------------------------------------------------------------------------
+# Random event history of the given devices, one list of events per scan cycle: devices come
+# and go, change their IP, get ghost events voided and occasionally have several events at once
+def make_history(macs, cycles, seed = 1):
+    rng = random.Random(seed)
+    online = {}
+    history = []
+
+    for cycle in range(cycles):
+        dateTime = f'2024-01-{1 + cycle // 1440:02d} {cycle // 60 % 24:02d}:{cycle % 60:02d}:00'
+        events = []
+
+        for mac in macs:
+            if rng.random() > 0.1:
+                continue
+
+            if mac not in online:
+                events.append((mac, 'New Device'))
+                online[mac] = True
+            elif online[mac]:
+                events.append((mac, rng.choice(['Disconnected', 'Device Down', 'IP Changed'])))
+                online[mac] = events[-1][1] == 'IP Changed'
+            else:
+                events.append((mac, rng.choice(['Connected', 'Down Reconnected', 'VOIDED - Connected'])))
+                online[mac] = True
+
+            if rng.random() < 0.05:
+                events.append((mac, rng.choice(['Connected', 'Disconnected', 'VOIDED - Disconnected'])))
+
+        history.append((dateTime, events))
+
+    return history
+
+# -------------------------------------------------------------------------------
+def get_pairs(db):
+    return db.sql.execute("SELECT rowid, eve_PairEventRowid FROM Events ORDER BY rowid").fetchall()
+
+# -------------------------------------------------------------------------------
+@pytest.fixture
+def dbs(tmp_path, monkeypatch):
+    # two copies of the migrated legacy DB, open_db changes the DB path
+    monkeypatch.setattr(database, 'fullDbPath', database.fullDbPath)
+
+    shutil.copyfile(legacyDbPath, str(tmp_path / 'legacy.db'))
+    shutil.copyfile(legacyDbPath, str(tmp_path / 'new.db'))
+
+    dbs = [open_db(str(tmp_path / 'legacy.db')), open_db(str(tmp_path / 'new.db'))]
+
+    yield dbs
+
+    for db in dbs:
+        db.sql_connection.close()
+
+
+# -------------------------------------------------------------------------------
+def test_pairing_matches_legacy(dbs):
+    legacyDb, db = dbs
+
+    macs = [f'aa:00:00:00:00:{i:02x}' for i in range(30)]
+
+    for cycle, (dateTime, events) in enumerate(make_history(macs, 300)):
+        for target in dbs:
+            insert_events(target, dateTime, events)
+
+            # voided pairs are paired again
+            if cycle % 50 == 49:
+                target.sql.execute("UPDATE Events SET eve_PairEventRowid = NULL WHERE rowid % 7 = 0")
+
+        legacy_pair_sessions_events(legacyDb.sql)
+        pair_sessions_events(db)
+
+        assert get_pairs(db) == get_pairs(legacyDb)
+
+    assert db.sql.execute("SELECT COUNT(*) FROM Events WHERE eve_PairEventRowid IS NOT NULL").fetchone()[0] > 100
+
+
+# -------------------------------------------------------------------------------
+@pytest.mark.benchmark
+def test_pairing_benchmark(dbs):
+    legacyDb, db = dbs
+
+    # the legacy pairing with the previous index on the MAC only
+    legacyDb.sql.execute('DROP INDEX IDX_eve_MAC_DateTime')
+    legacyDb.sql.execute('CREATE INDEX IDX_eve_MAC ON Events (eve_MAC COLLATE NOCASE)')
+
+    macs = [f'aa:00:00:00:00:{i:02x}' for i in range(50)]
+
+    # a long history with all sessions paired, then one scan cycle
+    for target in dbs:
+        target.sql.execute('BEGIN')
+
+        for dateTime, events in make_history(macs, 4000, seed = 2):
+            insert_events(target, dateTime, events)
+
+        target.sql.execute('COMMIT')
+
+        pair_sessions_events(target)
+        insert_events(target, '2024-02-01 00:00:00', [(mac, 'Connected') for mac in macs])
+
+    start = time.perf_counter()
+    legacy_pair_sessions_events(legacyDb.sql)
+    legacyTime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pair_sessions_events(db)
+    newTime = time.perf_counter() - start
+
+    print(f'Pairing after {len(get_pairs(db))} events: legacy {legacyTime:.3f}s, window function {newTime:.3f}s')
+
+    assert get_pairs(db) == get_pairs(legacyDb)
+    assert newTime * 2 < legacyTime
+
+
+# -------------------------------------------------------------------------------
+def get_last_events(db):
+    return [tuple(row) for row in db.sql.execute("SELECT lev_MAC, lev_DateTime, lev_EventRowid FROM LastEvent ORDER BY lev_MAC")]
+
+# -------------------------------------------------------------------------------
+def get_ranked_last_events(db):
+    return [tuple(row) for row in db.sql.execute("""SELECT eve_MAC, eve_DateTime, EventRowid FROM (
+                                                        SELECT eve_MAC, eve_DateTime, rowid AS EventRowid,
+                                                               ROW_NUMBER() OVER (PARTITION BY eve_MAC ORDER BY eve_DateTime DESC, rowid DESC) AS RowNumber
+                                                        FROM Events)
+                                                     WHERE RowNumber = 1 ORDER BY eve_MAC""")]
+
+
+# -------------------------------------------------------------------------------
+def test_last_event_follows_events(db):
+
+    macs = [f'aa:00:00:00:00:{i:02x}' for i in range(20)]
+
+    for dateTime, events in make_history(macs, 200):
+        insert_events(db, dateTime, events)
+
+    assert len(get_last_events(db)) == 20
+    assert get_last_events(db) == get_ranked_last_events(db)
+
+    # events deleted in the frontend and by the DB cleanup, events moved in time
+    db.sql.execute("""DELETE FROM Events WHERE rowid IN (SELECT lev_EventRowid FROM LastEvent
+                                                          WHERE lev_MAC IN ('aa:00:00:00:00:00', 'aa:00:00:00:00:01'))""")
+    db.sql.execute("DELETE FROM Events WHERE eve_MAC = 'aa:00:00:00:00:02'")
+    db.sql.execute("DELETE FROM Events WHERE eve_DateTime <= '2024-01-01 01:30:00'")
+    db.sql.execute("""UPDATE Events SET eve_DateTime = '2023-12-31 00:00:00'
+                      WHERE rowid = (SELECT lev_EventRowid FROM LastEvent WHERE lev_MAC = 'aa:00:00:00:00:03')""")
+
+    assert len(get_last_events(db)) == 19
+    assert get_last_events(db) == get_ranked_last_events(db)
+
+
+# -------------------------------------------------------------------------------
+def test_connections_match_latest_events_view(db):
+
+    macs = [f'aa:00:00:00:00:{i:02x}' for i in range(40)]
+
+    for dateTime, events in make_history(macs, 100):
+        insert_events(db, dateTime, events)
+
+    # down alerts already sent
+    db.sql.execute("UPDATE Events SET eve_PendingAlertEmail = 0 WHERE rowid % 3 = 0")
+
+    # devices absent in the last scan, a device without events and a scanned MAC without a device
+    db.sql.executemany("""INSERT OR REPLACE INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection, dev_PresentLastScan)
+                          VALUES (?, 'Test', '192.168.1.10', '2024-01-01 00:00:00', '2024-01-01 00:00:00', ?)""",
+                       [(mac, i % 3 != 0) for i, mac in enumerate(macs[:-1] + ['aa:00:00:00:01:00'])])
+    db.sql.executemany("INSERT INTO CurrentScan (cur_MAC, cur_IP) VALUES (?, ?)" + current_scan_upsert(['cur_MAC', 'cur_IP']),
+                       [(mac, '192.168.1.10') for mac in macs[::2] + ['aa:00:00:00:01:00']] + [(macs[0], '192.168.1.11')])
+
+    db.sql.execute(legacy_latest_events_view)
+    expected = sorted(tuple(row) for row in db.sql.execute(legacy_connections).fetchall())
+
+    lastRowid = db.sql.execute("SELECT MAX(rowid) FROM Events").fetchone()[0]
+    insert_scan_events(db)
+
+    connections = db.sql.execute("""SELECT eve_MAC, eve_IP, eve_EventType FROM Events
+                                    WHERE rowid > ? AND eve_EventType IN ('Connected', 'Down Reconnected')""", (lastRowid,)).fetchall()
+
+    assert len(expected) > 5
+    assert 'Down Reconnected' in [row[2] for row in expected]
+    assert sorted(tuple(row) for row in connections) == expected
+
+
+# -------------------------------------------------------------------------------
+# Devices with random presence and alert settings, a scan with known, new and upper case MACs,
+# changed IPs and MACs scanned twice
+def make_scan(db, count, seed = 1):
+    rng = random.Random(seed)
+
+    macs = [f'aa:00:00:00:{i // 256:02x}:{i % 256:02x}' for i in range(count)]
+
+    for dateTime, events in make_history(macs, 50, seed = seed):
+        insert_events(db, dateTime, events)
+
+    db.sql.execute("UPDATE Events SET eve_PendingAlertEmail = 0 WHERE rowid % 3 = 0")
+
+    db.sql.executemany("""INSERT OR REPLACE INTO Devices (dev_MAC, dev_Name, dev_LastIP, dev_FirstConnection, dev_LastConnection,
+                                                          dev_PresentLastScan, dev_AlertDeviceDown, dev_AlertEvents)
+                          VALUES (?, 'Test', ?, '2024-01-01 00:00:00', '2024-01-01 00:00:00', ?, ?, ?)""",
+                       [(mac, f'192.168.{i // 256}.{i % 256}', rng.randint(0, 1), rng.randint(0, 1), rng.randint(0, 1))
+                        for i, mac in enumerate(macs) if i % 10])
+
+    scanRows = []
+    for i, mac in enumerate(macs):
+        if rng.random() < 0.7:
+            ip = f'192.168.{i // 256}.{i % 256}' if rng.random() < 0.8 else f'10.0.{i // 256}.{i % 256}'
+            scanRows.append((mac.upper() if rng.random() < 0.1 else mac, ip, rng.choice(['ARPSCAN', 'PIHOLE', None])))
+
+            if rng.random() < 0.05:
+                scanRows.append((mac, '10.1.0.1', 'PIHOLE'))
+
+    db.sql.executemany("INSERT INTO CurrentScan (cur_MAC, cur_IP, cur_ScanMethod) VALUES (?, ?, ?)"
+                       + current_scan_upsert(['cur_MAC', 'cur_IP', 'cur_ScanMethod']), scanRows)
+
+# -------------------------------------------------------------------------------
+def get_scan_events(db, lastRowid):
+    return [tuple(row) for row in db.sql.execute("""SELECT eve_MAC, eve_IP, eve_EventType, eve_AdditionalInfo, eve_PendingAlertEmail
+                                                    FROM Events WHERE rowid > ? ORDER BY rowid""", (lastRowid,))]
+
+
+# -------------------------------------------------------------------------------
+def test_presence_diff_matches_legacy(dbs):
+    legacyDb, db = dbs
+
+    for target in dbs:
+        make_scan(target, 1000)
+
+    lastRowid = db.sql.execute("SELECT MAX(rowid) FROM Events").fetchone()[0]
+
+    legacy_insert_events(legacyDb.sql, '2024-02-01 00:00:00')
+
+    presence = presence_diff_class(db)
+    db.sql.execute("DELETE FROM Events WHERE rowid > ?", (lastRowid,))
+    insert_scan_events(db, presence)
+
+    events = get_scan_events(db, lastRowid)
+
+    assert events == get_scan_events(legacyDb, lastRowid)
+    assert {event[2] for event in events} == {'Device Down', 'Connected', 'Down Reconnected', 'Disconnected', 'IP Changed'}
+
+    # the stats of the same diff
+    stats = db.sql.execute("""SELECT
+                                (SELECT COUNT(*) FROM CurrentScan WHERE NOT EXISTS (SELECT 1 FROM Devices WHERE dev_MAC = cur_MAC)),
+                                (SELECT COUNT(*) FROM Devices WHERE dev_AlertDeviceDown != 0 AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC)),
+                                (SELECT COUNT(*) FROM Devices WHERE dev_PresentLastScan = 1 AND NOT EXISTS (SELECT 1 FROM CurrentScan WHERE dev_MAC = cur_MAC))
+                           """).fetchone()
+
+    assert (len(presence.newDevices), len(presence.downAlerts), len(presence.disconnections)) == tuple(stats)
+    assert sum(presence.scanMethods.values()) == presence.detected
+
+
+# -------------------------------------------------------------------------------
+def test_process_scan_is_one_transaction(db, monkeypatch):
+    make_scan(db, 200)
+
+    events = db.sql.execute("SELECT COUNT(*) FROM Events").fetchone()[0]
+
+    # a second connection, like the frontend, during the last stage of the cycle
+    reader = sqlite3.connect(database.fullDbPath)
+    seen = []
+
+    def skip_repeated_notifications(db):
+        seen.append(reader.execute("SELECT COUNT(*) FROM Events").fetchone()[0])
+
+    monkeypatch.setattr(networkscan, 'skip_repeated_notifications', skip_repeated_notifications)
+
+    process_scan(db)
+
+    # the changes of the cycle are visible once it's committed
+    assert seen == [events]
+    assert reader.execute("SELECT COUNT(*) FROM Events").fetchone()[0] > events
+    assert not db.sql_connection.in_transaction
+    assert db.sql.execute("SELECT COUNT(*) FROM CurrentScan").fetchone()[0] == 0
+    assert db.sql.execute("SELECT COUNT(*) FROM Sessions_Changes").fetchone()[0] == 0
+
+    reader.close()
+
+
+# -------------------------------------------------------------------------------
+def test_failed_scan_stage_rolls_back_the_cycle(db, monkeypatch):
+    make_scan(db, 200)
+
+    before = [db.sql.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ['Events', 'Devices', 'Online_History']]
+
+    def pair_sessions_events(db):
+        raise sqlite3.OperationalError('stage failed')
+
+    monkeypatch.setattr(networkscan, 'pair_sessions_events', pair_sessions_events)
+
+    process_scan(db)
+
+    assert [db.sql.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ['Events', 'Devices', 'Online_History']] == before
+    assert not db.sql_connection.in_transaction
+    assert db.savepoints == []
+
+    # the results of the failed cycle are discarded
+    assert db.sql.execute("SELECT COUNT(*) FROM CurrentScan").fetchone()[0] == 0